@@ -0,0 +1,192 @@
+"""
+存储后端基准 + 一致性测试：Postgres 与 SQLite 跑同一组写入/查询，
+记录各操作耗时，并对比两边的查询结果与检查点
+
+用法:
+    python benchmarks/backends.py [记录数]
+    DATABASE_URL=postgresql://... python benchmarks/backends.py [记录数]
+
+SQLite 使用临时文件；设置了 DATABASE_URL 时同时测试 Postgres
+测试群组的数据最后用 reset() 清除，结果不一致时退出码为 1
+"""
+import os
+import sys
+import time
+import shutil
+import tempfile
+from datetime import datetime, timedelta
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from storage import create_storage
+from sqlite_storage import SQLiteStorage
+
+BENCH_CHAT_ID = -999000997
+BENCH_TIMEZONE = "Asia/Shanghai"
+LIVE_ENTRIES = 200
+REPEAT = 20
+
+
+def timed(timings, name, fn, repeat=REPEAT):
+    start = time.perf_counter()
+    for _ in range(repeat):
+        result = fn()
+    timings[name] = (time.perf_counter() - start) / repeat * 1000
+    return result
+
+
+def spooled_workload(rows, now):
+    """
+    暂存回放记录：时间跨度约 14 个月，写入顺序打乱 (部分记录落在已有检查点之前)
+    """
+    span = timedelta(days=420)
+    base = now - timedelta(days=30) - span
+
+    for i in range(rows):
+        slot = (i * 7919) % rows
+        yield (
+            300 + i % 50 if i % 3 == 0 else -(40 + i % 70),
+            f"tag{i % 12} note {i}",
+            f"user{i % 5}",
+            base + span * slot / rows,
+            f"bench-{BENCH_CHAT_ID}-{i}",
+        )
+
+
+def run(storage, rows):
+    chat_id = BENCH_CHAT_ID
+    now = datetime.utcnow()
+    timings = {}
+
+    storage.init_schema()
+    storage.reset(chat_id)
+
+    # ---------------- 写入 ----------------
+    workload = list(spooled_workload(rows, now))
+    start = time.perf_counter()
+    for amount, description, user_name, timestamp, key in workload:
+        storage.add_spooled_entry(chat_id, amount, description, user_name, timestamp, key)
+    timings["add_spooled_entry"] = (time.perf_counter() - start) / rows * 1000
+
+    # 同一个 key 重复回放不入账
+    amount, description, user_name, timestamp, key = workload[0]
+    duplicate = storage.add_spooled_entry(chat_id, amount, description, user_name, timestamp, key)
+
+    start = time.perf_counter()
+    for i in range(LIVE_ENTRIES):
+        storage.add_entry(chat_id, 100 if i % 2 else -35, f"live{i % 4} 备注", "live")
+    timings["add_entry"] = (time.perf_counter() - start) / LIVE_ENTRIES * 1000
+
+    undone = storage.undo_last(chat_id)
+
+    # ---------------- 查询 ----------------
+    month_start = datetime(now.year, now.month, 1) - timedelta(days=200)
+    month_start = month_start.replace(day=1)
+    month_end = (month_start + timedelta(days=32)).replace(day=1)
+
+    results = {
+        "duplicate_replay": duplicate,
+        "undone": (undone[1], undone[2], undone[4]),
+        "ledger_rows": [
+            (description, amount, balance)
+            for description, amount, balance, _ in timed(
+                timings, "ledger_rows", lambda: storage.ledger_rows(chat_id), repeat=5
+            )
+        ],
+        "totals": tuple(timed(timings, "totals", lambda: storage.totals(chat_id))),
+        "totals_month": tuple(storage.totals(chat_id, month_start, month_end)),
+        "grouped_day": [tuple(r) for r in timed(
+            timings, "grouped_totals(day)",
+            lambda: storage.grouped_totals(chat_id, BENCH_TIMEZONE, "day", descending=True)
+        )],
+        "grouped_month": [tuple(r) for r in timed(
+            timings, "grouped_totals(month)",
+            lambda: storage.grouped_totals(chat_id, BENCH_TIMEZONE, "month", month_start, month_end)
+        )],
+        "grouped_year_utc": [tuple(r) for r in storage.grouped_totals(chat_id, "UTC", "year")],
+        "periods_month": timed(
+            timings, "periods(month)",
+            lambda: storage.periods(chat_id, BENCH_TIMEZONE, "month", limit=12)
+        ),
+        "periods_year": storage.periods(chat_id, BENCH_TIMEZONE, "year"),
+        "breakdown_months": storage.breakdown_months(chat_id, "tag"),
+        "breakdown_user": [tuple(r) for r in timed(
+            timings, "breakdown_top",
+            lambda: storage.breakdown_top(chat_id, "user")
+        )],
+        "breakdown_tag_month": [tuple(r) for r in storage.breakdown_top(
+            chat_id, "tag", month_start, month_end
+        )],
+        "find_totals": tuple(timed(
+            timings, "find_totals",
+            lambda: storage.find_totals(chat_id, "tag1")
+        )),
+        "find_page": [
+            (description, amount)
+            for _, description, amount, _ in timed(
+                timings, "find_page",
+                lambda: storage.find_page(chat_id, "tag1", None, None, None, 11)
+            )
+        ],
+        "find_escape": tuple(storage.find_totals(chat_id, "%")),
+        "balance_as_of": [
+            tuple(storage.balance_as_of(chat_id, now - timedelta(days=days)))
+            for days in (0, 45, 200, 500)
+        ],
+        "checkpoint_drift": storage.checkpoint_drift(chat_id),
+    }
+
+    timed(timings, "balance_as_of", lambda: storage.balance_as_of(chat_id, now - timedelta(days=100)))
+
+    storage.reset(chat_id)
+    return timings, results
+
+
+def main():
+    rows = int(sys.argv[1]) if len(sys.argv) > 1 else 2000
+
+    tmp_dir = tempfile.mkdtemp(prefix="ledger-bench-")
+    backends = {"sqlite": lambda: SQLiteStorage(os.path.join(tmp_dir, "ledger.db"))}
+    if os.getenv("DATABASE_URL"):
+        backends["postgres"] = lambda: create_storage("postgres")
+
+    runs = {}
+    try:
+        for name, factory in backends.items():
+            runs[name] = run(factory(), rows)
+    finally:
+        shutil.rmtree(tmp_dir, ignore_errors=True)
+
+    # ---------------- 耗时 ----------------
+    names = list(runs)
+    print(f"测试记录数: {rows} 回放 + {LIVE_ENTRIES} 实时写入")
+    print(f"{'操作':<24}" + "".join(f"{name:>12}" for name in names) + "   (ms)")
+    for op in runs[names[0]][0]:
+        print(f"{op:<24}" + "".join(f"{runs[name][0][op]:12.3f}" for name in names))
+
+    # ---------------- 一致性 ----------------
+    failed = []
+    for name, (_, results) in runs.items():
+        if results["checkpoint_drift"]:
+            failed.append(f"{name}: 检查点与历史记录不一致 ({len(results['checkpoint_drift'])})")
+        if results["duplicate_replay"]:
+            failed.append(f"{name}: 重复 key 被再次入账")
+
+    if len(names) > 1:
+        reference = runs[names[0]][1]
+        for name in names[1:]:
+            for key, value in runs[name][1].items():
+                if value != reference[key]:
+                    failed.append(f"{key}: {names[0]}={reference[key]!r} {name}={value!r}")
+
+    print()
+    if failed:
+        for line in failed:
+            print(f"❌ {line}")
+        sys.exit(1)
+
+    print(f"✅ {' / '.join(names)} 结果一致")
+
+
+if __name__ == "__main__":
+    main()
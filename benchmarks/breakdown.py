@@ -0,0 +1,85 @@
+"""
+操作人/分类统计基准测试：在大群组上对比
+history_breakdown 汇总表查询与直接扫描 history 的耗时
+
+用法:
+    DATABASE_URL=postgresql://... python benchmarks/breakdown.py [记录数]
+
+测试数据在事务内生成并最终回滚
+"""
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from database import get_db_connection, rebuild_breakdown
+
+BENCH_CHAT_ID = -999000998
+REPEAT = 20
+
+
+def timed(cursor, sql, params):
+    start = time.perf_counter()
+    for _ in range(REPEAT):
+        cursor.execute(sql, params)
+        cursor.fetchall()
+    return (time.perf_counter() - start) / REPEAT * 1000
+
+
+def main():
+    rows = int(sys.argv[1]) if len(sys.argv) > 1 else 500000
+
+    conn = get_db_connection()
+    if conn is None:
+        raise SystemExit("❌ DATABASE_URL not available")
+
+    cursor = conn.cursor()
+    try:
+        # 20 个操作人、200 个分类，时间跨度约 3 年
+        cursor.execute("""
+            INSERT INTO history (chat_id, amount, description, balance_after, user_name, timestamp)
+            SELECT %s,
+                   CASE WHEN g %% 3 = 0 THEN 500 ELSE -120 END,
+                   'tag' || (g %% 200) || ' note',
+                   0,
+                   'user' || (g %% 20),
+                   LOCALTIMESTAMP - (g %% 1000) * INTERVAL '1 day'
+            FROM generate_series(1, %s) g
+        """, (BENCH_CHAT_ID, rows))
+        rebuild_breakdown(cursor, BENCH_CHAT_ID)
+        cursor.execute("ANALYZE history")
+        cursor.execute("ANALYZE history_breakdown")
+
+        aggregate_ms = timed(cursor, """
+            SELECT label, SUM(entries), SUM(income), SUM(expense)
+            FROM history_breakdown
+            WHERE chat_id = %s AND kind = 'tag'
+            GROUP BY label
+            ORDER BY SUM(income) - SUM(expense) DESC
+            LIMIT 10
+        """, (BENCH_CHAT_ID,))
+
+        scan_ms = timed(cursor, """
+            SELECT split_part(COALESCE(description, ''), ' ', 1), COUNT(*),
+                   COALESCE(SUM(CASE WHEN amount > 0 THEN amount END), 0),
+                   COALESCE(SUM(CASE WHEN amount < 0 THEN amount END), 0)
+            FROM history
+            WHERE chat_id = %s
+            GROUP BY 1
+            ORDER BY SUM(ABS(amount)) DESC
+            LIMIT 10
+        """, (BENCH_CHAT_ID,))
+
+    finally:
+        conn.rollback()
+        cursor.close()
+        conn.close()
+
+    print(f"群组记录数: {rows}")
+    print(f"汇总表查询: {aggregate_ms:.2f} ms")
+    print(f"直接扫描:   {scan_ms:.2f} ms")
+
+
+if __name__ == "__main__":
+    main()
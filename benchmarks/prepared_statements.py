@@ -0,0 +1,85 @@
+"""
+预编译语句基准测试：对比每次更新的 4 条高频查询
+(owner_expiry / assistant_exists / last_balance / insert_entry)
+普通执行与 PREPARE + EXECUTE 的耗时
+
+用法:
+    DATABASE_URL=postgresql://... python benchmarks/prepared_statements.py [次数]
+
+插入在事务内执行并最终回滚，不会留下测试数据
+"""
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from database import get_db_connection, execute_prepared, PREPARED_STATEMENTS
+
+BENCH_CHAT_ID = -999000999
+BENCH_USER_ID = 999000999
+
+
+def plain_sql(name):
+    sql = PREPARED_STATEMENTS[name]
+    for i in range(5, 0, -1):
+        sql = sql.replace(f"${i}", "%s")
+    return sql
+
+
+def one_update_plain(cursor, i):
+    cursor.execute(plain_sql("owner_expiry"), (BENCH_USER_ID,))
+    cursor.fetchone()
+    cursor.execute(plain_sql("assistant_exists"), (BENCH_CHAT_ID, BENCH_USER_ID))
+    cursor.fetchone()
+    cursor.execute(plain_sql("last_balance"), (BENCH_CHAT_ID,))
+    cursor.fetchone()
+    cursor.execute(plain_sql("insert_entry"), (BENCH_CHAT_ID, 1, "bench", i, "bench"))
+
+
+def one_update_prepared(cursor, i):
+    execute_prepared(cursor, "owner_expiry", (BENCH_USER_ID,))
+    cursor.fetchone()
+    execute_prepared(cursor, "assistant_exists", (BENCH_CHAT_ID, BENCH_USER_ID))
+    cursor.fetchone()
+    execute_prepared(cursor, "last_balance", (BENCH_CHAT_ID,))
+    cursor.fetchone()
+    execute_prepared(cursor, "insert_entry", (BENCH_CHAT_ID, 1, "bench", i, "bench"))
+
+
+def run(fn, iterations):
+    conn = get_db_connection()
+    if conn is None:
+        raise SystemExit("❌ DATABASE_URL not available")
+
+    cursor = conn.cursor()
+    try:
+        # 预热 (包括 PREPARE)
+        fn(cursor, 0)
+
+        start = time.perf_counter()
+        for i in range(iterations):
+            fn(cursor, i)
+        elapsed = time.perf_counter() - start
+    finally:
+        conn.rollback()
+        cursor.close()
+        conn.close()
+
+    return elapsed
+
+
+def main():
+    iterations = int(sys.argv[1]) if len(sys.argv) > 1 else 2000
+
+    plain = run(one_update_plain, iterations)
+    prepared = run(one_update_prepared, iterations)
+
+    print(f"更新次数: {iterations}")
+    print(f"普通执行:   {plain / iterations * 1000:.3f} ms/更新")
+    print(f"预编译执行: {prepared / iterations * 1000:.3f} ms/更新")
+    print(f"每次更新节省: {(plain - prepared) / iterations * 1000:.3f} ms")
+
+
+if __name__ == "__main__":
+    main()
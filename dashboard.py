@@ -0,0 +1,97 @@
+import os
+import time
+import logging
+from datetime import datetime, timedelta
+
+from storage import get_storage, run_storage, StorageUnavailable
+from subscriptions import subscription_scheduler
+from rate_limit import rate_limiter
+
+
+# ================= CONFIG =================
+DASHBOARD_REFRESH_SECONDS = int(os.getenv("DASHBOARD_REFRESH_SECONDS", "60"))
+DASHBOARD_EXPIRY_DAYS = int(os.getenv("DASHBOARD_EXPIRY_DAYS", "7"))
+DASHBOARD_DAYS = 7
+DASHBOARD_TOP = 5
+
+
+# ================= DASHBOARD =================
+class Dashboard:
+    """
+    MASTER 全局看板：后台定时从 chat_stats / daily_stats 汇总表生成快照
+    /dashboard 只读内存中的快照，耗时与总记录数无关
+    """
+
+    def __init__(self):
+        self.snapshot = None
+        self.refreshed_at = None
+
+    def refresh(self):
+
+        started = time.perf_counter()
+        now = datetime.utcnow()
+
+        try:
+            snapshot = get_storage().dashboard_stats(now, DASHBOARD_DAYS, DASHBOARD_TOP)
+        except StorageUnavailable:
+            return False
+        except Exception as e:
+            logging.error(f"❌ Dashboard refresh failed: {e}")
+            return False
+
+        self.snapshot = snapshot
+        self.refreshed_at = now
+
+        logging.info(f"📊 Dashboard refreshed in {(time.perf_counter() - started) * 1000:.1f}ms")
+        return True
+
+    async def refresh_job(self, context):
+        await run_storage(self.refresh)
+
+    def render(self):
+        """
+        快照 + 内存中的到期信息与限流统计
+        """
+        snap = self.snapshot
+        age = int((datetime.utcnow() - self.refreshed_at).total_seconds())
+
+        lines = [
+            "📊 全局看板",
+            "━━━━━━━━━━━━━━━",
+            f"群组总数: {snap['chats']:,}",
+            f"记录总数: {snap['entries']:,}",
+            f"活跃群组: 24小时 {snap['active_1d']:,} / 7天 {snap['active_7d']:,}",
+            "",
+            f"📅 最近{DASHBOARD_DAYS}天记账 (UTC)",
+        ]
+
+        if snap["daily"]:
+            for day, count, day_chats in snap["daily"]:
+                lines.append(f"{day:%m-%d}: {count:,} 条 / {day_chats:,} 个群组")
+        else:
+            lines.append("暂无记录")
+
+        lines += ["", "📒 最大账本"]
+        for chat_id, count, balance, last_entry_at in snap["largest"]:
+            lines.append(
+                f"{chat_id}: {count:,} 条, 余额 {balance:,}, 最后 {last_entry_at:%Y-%m-%d}"
+            )
+
+        expiring = subscription_scheduler.expiring(timedelta(days=DASHBOARD_EXPIRY_DAYS))
+        lines += ["", f"⏳ {DASHBOARD_EXPIRY_DAYS}天内到期 Owner: {len(expiring)}"]
+        for user_id, expire in expiring[:10]:
+            lines.append(f"{user_id}: {expire:%Y-%m-%d %H:%M}")
+
+        hits = rate_limiter.stats()
+        lines += ["", "📉 限流次数 (本进程)"]
+        if hits:
+            for (kind, scope), count in sorted(hits.items()):
+                lines.append(f"{kind}/{scope}: {count:,}")
+        else:
+            lines.append("无")
+
+        lines += ["", f"🕒 数据更新于 {age} 秒前"]
+        return "\n".join(lines)
+
+
+dashboard = Dashboard()
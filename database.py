@@ -1,10 +1,295 @@
 import os
+import time
+import threading
 import psycopg2
+import psycopg2.extensions
+import psycopg2.errors
 import logging
+from collections import OrderedDict
+
+
+# ================= CONFIG =================
+DATABASE_SSLMODE = os.getenv("DATABASE_SSLMODE", "require")
+
+# 会话统一使用 UTC，history.timestamp 默认值按 UTC 写入
+DATABASE_OPTIONS = "-c timezone=UTC"
+
+# 只读副本：报表类查询走副本，延迟超过阈值时回退到主库
+REPLICA_MAX_LAG_SECONDS = float(os.getenv("REPLICA_MAX_LAG_SECONDS", "10"))
+REPLICA_LAG_CHECK_INTERVAL = float(os.getenv("REPLICA_LAG_CHECK_INTERVAL", "5"))
+
+# 记录最近写入群组的主库 WAL 位置 (LSN)，副本回放到该位置之前的读取改走主库
+REPLICA_TRACKED_CHATS = int(os.getenv("REPLICA_TRACKED_CHATS", "10000"))
+
+# 熔断：连续连接失败达到阈值后暂停连接尝试，避免每个更新都等待连接超时
+DB_CONNECT_TIMEOUT = int(os.getenv("DB_CONNECT_TIMEOUT", "5"))
+DB_BREAKER_THRESHOLD = int(os.getenv("DB_BREAKER_THRESHOLD", "3"))
+DB_BREAKER_COOLDOWN = float(os.getenv("DB_BREAKER_COOLDOWN", "30"))
+
+# 连接池：close() 时连接回到池中，预编译语句随连接保留
+DB_POOL_SIZE = int(os.getenv("DB_POOL_SIZE", "10"))
+DB_POOL_MAX_IDLE = float(os.getenv("DB_POOL_MAX_IDLE", "300"))
+
+# 启动时预先建立的连接数
+DB_POOL_WARM = min(int(os.getenv("DB_POOL_WARM", "4")), DB_POOL_SIZE)
+
+# 表结构版本：与数据库中 schema_version 一致时启动跳过全部 DDL
+# 修改 init_db 中的表结构时必须 +1
+SCHEMA_VERSION = 2
+
+
+# ================= CIRCUIT BREAKER =================
+class CircuitBreaker:
+    """
+    closed -> (连续失败 threshold 次) -> open -> (cooldown 后放行一次尝试) -> half-open
+    """
+
+    def __init__(self, threshold, cooldown):
+        self.threshold = threshold
+        self.cooldown = cooldown
+        self.failures = 0
+        self.opened_at = None
+        self._lock = threading.Lock()
+
+    @property
+    def is_open(self):
+        return self.opened_at is not None
+
+    @property
+    def probe_due(self):
+        # 打开状态下冷却已结束，下一次 allow() 会放行试探
+        with self._lock:
+            return self.opened_at is not None and time.monotonic() - self.opened_at >= self.cooldown
+
+    def allow(self):
+        with self._lock:
+            if self.opened_at is None:
+                return True
+
+            # 冷却结束：放行一次试探，失败则重新计时
+            if time.monotonic() - self.opened_at >= self.cooldown:
+                self.opened_at = time.monotonic()
+                return True
+
+            return False
+
+    def success(self):
+        with self._lock:
+            if self.opened_at is not None:
+                logging.info("✅ Database circuit closed")
+            self.failures = 0
+            self.opened_at = None
+
+    def failure(self):
+        with self._lock:
+            self.failures += 1
+            if self.failures >= self.threshold and self.opened_at is None:
+                logging.error(f"❌ Database circuit opened after {self.failures} failures")
+            if self.failures >= self.threshold:
+                self.opened_at = time.monotonic()
+
+
+db_breaker = CircuitBreaker(DB_BREAKER_THRESHOLD, DB_BREAKER_COOLDOWN)
+
+
+# ================= CONNECTION POOL =================
+class PooledConnection(psycopg2.extensions.connection):
+    """
+    close() 会把连接归还给所属连接池，池满或连接异常时才真正关闭
+    """
+    pool = None
+    replica_lag = 0.0
+
+    # 读取结果是否包含该群组全部已提交的写入 (主库永远为 True)
+    fresh = True
+
+    @property
+    def prepared(self):
+        # 当前会话中已 PREPARE 的语句名
+        if "_prepared" not in self.__dict__:
+            self._prepared = set()
+        return self._prepared
+
+    def close(self):
+        if self.pool is not None and not self.closed and self.pool.release(self):
+            return
+        super().close()
+
+
+class ReplicaConnection(PooledConnection):
+    """
+    副本连接，replica_lag 为最近一次测得的复制延迟 (秒)
+    fresh 为本次取出时是否已回放到所需的 LSN
+    """
+
+
+class ConnectionPool:
+
+    def __init__(self, maxsize, max_idle=DB_POOL_MAX_IDLE):
+        self.maxsize = maxsize
+        self.max_idle = max_idle
+        self._idle = []
+        self._lock = threading.Lock()
+
+    def acquire(self):
+        now = time.monotonic()
+
+        while True:
+            with self._lock:
+                if not self._idle:
+                    return None
+                conn, released_at = self._idle.pop()
+
+            # 空闲太久的连接可能已被服务端断开，直接丢弃
+            if conn.closed or now - released_at > self.max_idle:
+                self._discard(conn)
+                continue
+
+            return conn
+
+    def release(self, conn):
+        try:
+            if conn.get_transaction_status() != psycopg2.extensions.TRANSACTION_STATUS_IDLE:
+                conn.rollback()
+        except psycopg2.OperationalError:
+            # 连接已断开，计入熔断
+            db_breaker.failure()
+            return False
+        except Exception:
+            return False
+
+        with self._lock:
+            if len(self._idle) >= self.maxsize:
+                return False
+            self._idle.append((conn, time.monotonic()))
+            return True
+
+    def _discard(self, conn):
+        conn.pool = None
+        try:
+            conn.close()
+        except Exception:
+            pass
+
+
+_primary_pool = ConnectionPool(DB_POOL_SIZE)
+_replica_pool = ConnectionPool(DB_POOL_SIZE)
+
+
+# (检查时间, 延迟秒数)
+_replica_lag_state = (0.0, None)
+
+
+# ================= WRITE LSN TRACKING =================
+# chat_id -> 最近一次写入提交后的主库 LSN (整数)
+_write_lsns = OrderedDict()
+_write_lsns_lock = threading.Lock()
+
+# 未单独记录的群组要求副本至少回放到这里：
+# 启动时的主库 LSN，之后随被淘汰的记录上移
+_baseline_lsn = None
+
+# 所有已记录写入中最大的 LSN (不带 chat_id 的读取使用)
+_latest_lsn = None
+
+# 写入后未能取得 LSN：该群组的读取一律走主库
+_UNKNOWN_LSN = -1
+
+
+def _parse_lsn(text):
+    high, low = text.split("/")
+    return (int(high, 16) << 32) + int(low, 16)
+
+
+def _format_lsn(value):
+    return f"{value >> 32:X}/{value & 0xFFFFFFFF:X}"
+
+
+def _current_lsn(conn):
+    cursor = conn.cursor()
+    try:
+        cursor.execute("SELECT pg_current_wal_lsn()::text")
+        return _parse_lsn(cursor.fetchone()[0])
+    finally:
+        cursor.close()
+
+
+def record_write(conn, chat_id=None):
+    """
+    写入提交后记录主库当前 LSN，未配置副本时不做任何事
+    chat_id 为空 (用户期限、助手等) 时只推进全局位置
+    """
+    global _baseline_lsn, _latest_lsn
+
+    if not os.getenv("DATABASE_REPLICA_URL"):
+        return
+
+    # 写入已提交，这里出错不能再抛出；位置未知时该群组只读主库
+    try:
+        lsn = _current_lsn(conn)
+    except Exception as e:
+        logging.warning(f"⚠️ Write LSN lookup failed: {e}")
+        lsn = _UNKNOWN_LSN
+
+    with _write_lsns_lock:
+        if lsn != _UNKNOWN_LSN:
+            _latest_lsn = max(_latest_lsn or 0, lsn)
+
+        if chat_id is None:
+            return
+
+        _write_lsns[chat_id] = lsn
+        _write_lsns.move_to_end(chat_id)
+
+        while len(_write_lsns) > REPLICA_TRACKED_CHATS:
+            _, evicted = _write_lsns.popitem(last=False)
+            if evicted != _UNKNOWN_LSN:
+                _baseline_lsn = max(_baseline_lsn or 0, evicted)
+
+
+def _required_lsn(chat_id):
+    with _write_lsns_lock:
+        if chat_id is None:
+            candidates = (_baseline_lsn, _latest_lsn)
+        elif _write_lsns.get(chat_id) == _UNKNOWN_LSN:
+            return _UNKNOWN_LSN
+        else:
+            candidates = (_baseline_lsn, _write_lsns.get(chat_id))
+        candidates = [lsn for lsn in candidates if lsn is not None]
+        return max(candidates) if candidates else None
+
+
+def _set_baseline_lsn(conn):
+    global _baseline_lsn
+
+    lsn = _current_lsn(conn)
+    with _write_lsns_lock:
+        _baseline_lsn = max(_baseline_lsn or 0, lsn)
+
+
+def _normalize_url(database_url):
+    # Fix Heroku style URL
+    if database_url.startswith("postgres://"):
+        database_url = database_url.replace(
+            "postgres://",
+            "postgresql://",
+            1
+        )
+    return database_url
 
 
 # ================= DB CONNECTION =================
-def get_db_connection():
+def get_db_connection(readonly=False, chat_id=None):
+    """
+    readonly=True 时优先使用 DATABASE_REPLICA_URL (仅限报表查询)
+    副本尚未回放到该群组最近一次写入的 LSN 时回退到主库 (读己之写)
+    余额、撤销等账本关键读写必须使用默认的主库连接
+    """
+    if readonly and os.getenv("DATABASE_REPLICA_URL"):
+        conn = _get_replica_connection(chat_id)
+        if conn is not None:
+            return conn
+
     try:
         database_url = os.getenv("DATABASE_URL")
 
@@ -12,38 +297,251 @@ def get_db_connection():
             logging.error("❌ DATABASE_URL not found")
             return None
 
-        # Fix Heroku style URL
-        if database_url.startswith("postgres://"):
-            database_url = database_url.replace(
-                "postgres://",
-                "postgresql://",
-                1
-            )
+        # 熔断打开时直接返回 None，不等待连接超时
+        if not db_breaker.allow():
+            return None
+
+        conn = _primary_pool.acquire()
+        if conn is not None:
+            return conn
 
         conn = psycopg2.connect(
-            database_url,
-            sslmode="require"
+            _normalize_url(database_url),
+            sslmode=DATABASE_SSLMODE,
+            options=DATABASE_OPTIONS,
+            connect_timeout=DB_CONNECT_TIMEOUT,
+            connection_factory=PooledConnection
         )
+        conn.pool = _primary_pool
+        db_breaker.success()
 
         return conn
 
     except Exception as e:
+        db_breaker.failure()
         logging.error(f"❌ Database Connection Error: {e}")
         return None
 
 
+def _get_replica_connection(chat_id=None):
+    global _replica_lag_state
+
+    conn = _replica_pool.acquire()
+
+    if conn is None:
+        try:
+            conn = psycopg2.connect(
+                _normalize_url(os.getenv("DATABASE_REPLICA_URL")),
+                sslmode=DATABASE_SSLMODE,
+                options=DATABASE_OPTIONS,
+                connect_timeout=DB_CONNECT_TIMEOUT,
+                connection_factory=ReplicaConnection
+            )
+            conn.pool = _replica_pool
+        except Exception as e:
+            logging.warning(f"⚠️ Replica Connection Error, using primary: {e}")
+            return None
+
+    checked_at, lag = _replica_lag_state
+    now = time.monotonic()
+
+    # 延迟检测结果缓存几秒，避免每次连接都多一次查询
+    if now - checked_at > REPLICA_LAG_CHECK_INTERVAL:
+        try:
+            cursor = conn.cursor()
+            cursor.execute("""
+                SELECT CASE
+                    WHEN NOT pg_is_in_recovery() THEN 0
+                    WHEN pg_last_wal_receive_lsn() = pg_last_wal_replay_lsn() THEN 0
+                    ELSE EXTRACT(EPOCH FROM now() - pg_last_xact_replay_timestamp())
+                END
+            """)
+            row = cursor.fetchone()
+            cursor.close()
+            conn.rollback()
+            lag = float(row[0]) if row[0] is not None else None
+        except Exception as e:
+            logging.warning(f"⚠️ Replica lag check failed: {e}")
+            lag = None
+
+        _replica_lag_state = (now, lag)
+
+    if lag is None or lag > REPLICA_MAX_LAG_SECONDS:
+        logging.warning(f"⚠️ Replica lag too high ({lag}s), using primary")
+        conn.close()
+        return None
+
+    # 延迟阈值只挡住严重落后的副本；是否包含该群组的写入按 LSN 判断
+    required = _required_lsn(chat_id)
+    fresh = False
+
+    if required == _UNKNOWN_LSN:
+        conn.close()
+        return None
+
+    if required is not None:
+        try:
+            cursor = conn.cursor()
+            cursor.execute("""
+                SELECT CASE
+                    WHEN pg_is_in_recovery() THEN pg_last_wal_replay_lsn()
+                    ELSE pg_current_wal_lsn()
+                END >= %s::pg_lsn
+            """, (_format_lsn(required),))
+            fresh = bool(cursor.fetchone()[0])
+            cursor.close()
+            conn.rollback()
+        except Exception as e:
+            logging.warning(f"⚠️ Replica LSN check failed: {e}")
+            conn.close()
+            return None
+
+        if not fresh:
+            conn.close()
+            return None
+
+    conn.replica_lag = lag
+    conn.fresh = fresh
+    return conn
+
+
+def replica_lag(conn):
+    """
+    连接的复制延迟 (秒)，主库连接永远为 0
+    """
+    return getattr(conn, "replica_lag", 0.0)
+
+
+def is_fresh(conn):
+    """
+    读取结果是否已确认包含该群组的全部写入 (主库，或已回放到所需 LSN 的副本)
+    """
+    return getattr(conn, "fresh", True)
+
+
+# ================= PREPARED STATEMENTS =================
+# 高频查询：每个连接只 PREPARE 一次，之后按名称 EXECUTE，省去重复解析/规划
+PREPARED_STATEMENTS = {
+    "owner_expiry": """
+        SELECT expire_date FROM users WHERE user_id = $1
+    """,
+    "assistant_exists": """
+        SELECT 1 FROM assistants WHERE chat_id = $1 AND assistant_id = $2
+    """,
+    "last_balance": """
+        SELECT balance_after FROM history
+        WHERE chat_id = $1 ORDER BY id DESC LIMIT 1
+    """,
+    "insert_entry": """
+        INSERT INTO history (chat_id, amount, description, balance_after, user_name)
+        VALUES ($1, $2, $3, $4, $5)
+        RETURNING id
+    """,
+    "insert_spooled_entry": """
+        INSERT INTO history (chat_id, amount, description, balance_after, user_name, timestamp, idempotency_key)
+        VALUES ($1, $2, $3, $4, $5, $6, $7)
+        ON CONFLICT (idempotency_key) DO NOTHING
+        RETURNING id
+    """,
+}
+
+
+def execute_prepared(cursor, name, params=()):
+    """
+    按名称执行 PREPARED_STATEMENTS 中的语句
+    """
+    prepared = cursor.connection.prepared
+
+    if name not in prepared:
+        cursor.execute(f"PREPARE {name} AS {PREPARED_STATEMENTS[name]}")
+        prepared.add(name)
+
+    if params:
+        placeholders = ", ".join(["%s"] * len(params))
+        cursor.execute(f"EXECUTE {name} ({placeholders})", params)
+    else:
+        cursor.execute(f"EXECUTE {name}")
+
+
+def prepare_statements(cursor):
+    """
+    在当前连接上预先 PREPARE 全部高频语句
+    """
+    prepared = cursor.connection.prepared
+
+    for name, sql in PREPARED_STATEMENTS.items():
+        if name not in prepared:
+            cursor.execute(f"PREPARE {name} AS {sql}")
+            prepared.add(name)
+
+
+def warm_pool(count=DB_POOL_WARM):
+    """
+    启动时建立连接并预编译语句，首批消息不再等待握手
+    返回成功建立的连接数
+    """
+    conns = []
+
+    try:
+        for _ in range(count):
+            conn = get_db_connection()
+            if conn is None:
+                break
+            conns.append(conn)
+
+            cursor = conn.cursor()
+            prepare_statements(cursor)
+            cursor.close()
+            conn.commit()
+
+        # 启动前的写入没有单独记录，副本至少要回放到此刻的主库位置
+        if conns and os.getenv("DATABASE_REPLICA_URL"):
+            _set_baseline_lsn(conns[0])
+            conns[0].commit()
+
+    except Exception as e:
+        logging.warning(f"⚠️ Warm pool failed: {e}")
+
+    finally:
+        for conn in conns:
+            conn.close()
+
+    return len(conns)
+
+
 # ================= INIT DATABASE =================
-def init_db():
+def _current_schema_version(cursor):
+    # 只有一次查询；表不存在 (首次部署) 时返回 None
+    try:
+        cursor.execute("SELECT MAX(version) FROM schema_version")
+        return cursor.fetchone()[0]
+    except psycopg2.errors.UndefinedTable:
+        cursor.connection.rollback()
+        return None
+
 
+def init_db():
+    """
+    schema_version 与 SCHEMA_VERSION 一致时直接返回，否则执行全部建表/迁移
+    返回 True 表示表结构可用
+    """
     conn = get_db_connection()
 
     if conn is None:
         logging.error("❌ Cannot initialize DB")
-        return
+        return False
 
     try:
         cursor = conn.cursor()
 
+        version = _current_schema_version(cursor)
+        if version == SCHEMA_VERSION:
+            conn.commit()
+            cursor.close()
+            conn.close()
+            logging.info(f"✅ Database schema v{version} up to date")
+            return True
+
         # ===== users =====
         cursor.execute("""
             CREATE TABLE IF NOT EXISTS users (
@@ -52,6 +550,16 @@ def init_db():
             )
         """)
 
+        # 最近一次到期通知，避免重启后重复发送
+        cursor.execute("""
+            ALTER TABLE users ADD COLUMN IF NOT EXISTS notice_state TEXT
+        """)
+
+        # 最近一次修改使用期限的时间 (UTC)，定时同步只读取变化的行
+        cursor.execute("""
+            ALTER TABLE users ADD COLUMN IF NOT EXISTS updated_at TIMESTAMP
+        """)
+
         # ===== history =====
         cursor.execute("""
             CREATE TABLE IF NOT EXISTS history (
@@ -65,6 +573,11 @@ def init_db():
             )
         """)
 
+        # 本地暂存记录回放时的幂等键
+        cursor.execute("""
+            ALTER TABLE history ADD COLUMN IF NOT EXISTS idempotency_key TEXT
+        """)
+
         # ===== assistants =====
         cursor.execute("""
             CREATE TABLE IF NOT EXISTS assistants (
@@ -76,6 +589,97 @@ def init_db():
             )
         """)
 
+        # ===== chat_settings (群组设置) =====
+        cursor.execute("""
+            CREATE TABLE IF NOT EXISTS chat_settings (
+                chat_id BIGINT PRIMARY KEY,
+                timezone TEXT
+            )
+        """)
+
+        # 未设置时区的群组为 NULL (使用 DEFAULT_TIMEZONE)
+        cursor.execute("""
+            ALTER TABLE chat_settings
+            ALTER COLUMN timezone DROP NOT NULL,
+            ALTER COLUMN timezone DROP DEFAULT
+        """)
+
+        # 每日报告时间 "HH:MM"，重启后自动恢复
+        cursor.execute("""
+            ALTER TABLE chat_settings ADD COLUMN IF NOT EXISTS report_time TEXT
+        """)
+
+        # ===== history_breakdown (按月操作人/分类汇总) =====
+        # month 为 UTC 月份，与群组时区无关；/summary 中的操作人/分类统计按 UTC 月份显示
+        cursor.execute("SELECT to_regclass('history_breakdown')")
+        breakdown_exists = cursor.fetchone()[0] is not None
+
+        cursor.execute("""
+            CREATE TABLE IF NOT EXISTS history_breakdown (
+                chat_id BIGINT NOT NULL,
+                kind TEXT NOT NULL,
+                month DATE NOT NULL,
+                label TEXT NOT NULL,
+                entries INTEGER NOT NULL DEFAULT 0,
+                income BIGINT NOT NULL DEFAULT 0,
+                expense BIGINT NOT NULL DEFAULT 0,
+                PRIMARY KEY (chat_id, kind, month, label)
+            )
+        """)
+
+        # 新建汇总表时用已有记录回填
+        if not breakdown_exists:
+            rebuild_breakdown(cursor)
+
+        # ===== balance_checkpoints (按月余额检查点) =====
+        # month 同样按 UTC 划分；只用于累计余额 (balance_as_of 会补齐边界两侧的明细)，
+        # 按群组本地时间分组的报表不读取这张表
+        cursor.execute("SELECT to_regclass('balance_checkpoints')")
+        checkpoints_exist = cursor.fetchone()[0] is not None
+
+        cursor.execute("""
+            CREATE TABLE IF NOT EXISTS balance_checkpoints (
+                chat_id BIGINT NOT NULL,
+                month DATE NOT NULL,
+                balance BIGINT NOT NULL,
+                income BIGINT NOT NULL,
+                expense BIGINT NOT NULL,
+                last_id INTEGER NOT NULL,
+                PRIMARY KEY (chat_id, month)
+            )
+        """)
+
+        if not checkpoints_exist:
+            rebuild_checkpoints(cursor)
+
+        # ===== chat_stats / daily_stats (全局统计，/dashboard 使用) =====
+        cursor.execute("SELECT to_regclass('chat_stats')")
+        stats_exist = cursor.fetchone()[0] is not None
+
+        cursor.execute("""
+            CREATE TABLE IF NOT EXISTS chat_stats (
+                chat_id BIGINT PRIMARY KEY,
+                entries INTEGER NOT NULL DEFAULT 0,
+                balance BIGINT NOT NULL DEFAULT 0,
+                last_entry_at TIMESTAMP
+            )
+        """)
+
+        # 每个群组每天一行，不同群组写入不会争用同一行
+        cursor.execute("""
+            CREATE TABLE IF NOT EXISTS daily_stats (
+                day DATE NOT NULL,
+                chat_id BIGINT NOT NULL,
+                entries INTEGER NOT NULL DEFAULT 0,
+                income BIGINT NOT NULL DEFAULT 0,
+                expense BIGINT NOT NULL DEFAULT 0,
+                PRIMARY KEY (day, chat_id)
+            )
+        """)
+
+        if not stats_exist:
+            rebuild_stats(cursor)
+
         # ===== INDEX =====
         cursor.execute("""
             CREATE INDEX IF NOT EXISTS idx_history_chat_id
@@ -92,14 +696,461 @@ def init_db():
             ON users(user_id)
         """)
 
+        cursor.execute("""
+            CREATE INDEX IF NOT EXISTS idx_users_updated_at
+            ON users(updated_at)
+        """)
+
+        cursor.execute("""
+            CREATE UNIQUE INDEX IF NOT EXISTS idx_history_idempotency_key
+            ON history(idempotency_key)
+        """)
+
+        # 按群组时间范围查询 (日/月/年报表)
+        cursor.execute("""
+            CREATE INDEX IF NOT EXISTS idx_history_chat_timestamp
+            ON history(chat_id, timestamp)
+        """)
+
+        # 按群组倒序分页 (/find 翻页、最后余额)
+        cursor.execute("""
+            CREATE INDEX IF NOT EXISTS idx_history_chat_id_id
+            ON history(chat_id, id)
+        """)
+
+        # /dashboard：活跃群组、最大账本
+        cursor.execute("""
+            CREATE INDEX IF NOT EXISTS idx_chat_stats_last_entry_at
+            ON chat_stats(last_entry_at)
+        """)
+
+        cursor.execute("""
+            CREATE INDEX IF NOT EXISTS idx_chat_stats_entries
+            ON chat_stats(entries)
+        """)
+
+        # ===== 备注搜索 (pg_trgm) =====
+        # 扩展不可用时跳过，/find 退化为按群组索引扫描
+        # 少于 3 个字符的关键词无法使用三元组索引，见 postgres_storage.TRGM_MIN_LENGTH
+        cursor.execute("SAVEPOINT search_index")
+        try:
+            cursor.execute("CREATE EXTENSION IF NOT EXISTS pg_trgm")
+            cursor.execute("CREATE EXTENSION IF NOT EXISTS btree_gin")
+            cursor.execute("""
+                CREATE INDEX IF NOT EXISTS idx_history_chat_description_trgm
+                ON history USING gin (chat_id, description gin_trgm_ops)
+            """)
+            cursor.execute("RELEASE SAVEPOINT search_index")
+        except Exception as e:
+            cursor.execute("ROLLBACK TO SAVEPOINT search_index")
+            logging.warning(f"⚠️ Trigram search index unavailable: {e}")
+
+        # ===== schema_version =====
+        cursor.execute("""
+            CREATE TABLE IF NOT EXISTS schema_version (
+                version INTEGER NOT NULL,
+                applied_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+            )
+        """)
+        cursor.execute("DELETE FROM schema_version")
+        cursor.execute("INSERT INTO schema_version (version) VALUES (%s)", (SCHEMA_VERSION,))
+
         conn.commit()
 
         cursor.close()
         conn.close()
 
-        logging.info("✅ Database initialized successfully")
+        logging.info(f"✅ Database initialized successfully (schema v{SCHEMA_VERSION})")
+        return True
 
     except Exception as e:
         logging.error(f"❌ Database Init Error: {e}")
         conn.rollback()
         conn.close()
+        return False
+
+
+# ================= BREAKDOWN AGGREGATES =================
+# history_breakdown 随记账/撤销/清空同步维护，操作人与分类报表只读这张小表
+_BREAKDOWN_UPSERT = """
+    INSERT INTO history_breakdown (chat_id, kind, month, label, entries, income, expense)
+    VALUES
+        (%(chat_id)s, 'user', %(month)s, %(user)s, %(entries)s, %(income)s, %(expense)s),
+        (%(chat_id)s, 'tag', %(month)s, %(tag)s, %(entries)s, %(income)s, %(expense)s)
+    ON CONFLICT (chat_id, kind, month, label) DO UPDATE SET
+        entries = history_breakdown.entries + EXCLUDED.entries,
+        income = history_breakdown.income + EXCLUDED.income,
+        expense = history_breakdown.expense + EXCLUDED.expense
+"""
+
+
+def description_tag(description):
+    """
+    分类标签 = 备注的第一个词，例如 "房租 三月" -> "房租"
+    (与 rebuild_breakdown 中的 split_part 保持一致)
+    """
+    return (description or "").split(" ")[0]
+
+
+def _breakdown_params(chat_id, amount, description, user_name, timestamp, sign):
+    return {
+        "chat_id": chat_id,
+        "month": timestamp.replace(day=1).date() if timestamp else None,
+        "user": user_name or "未知",
+        "tag": description_tag(description),
+        "entries": sign,
+        "income": sign * amount if amount > 0 else 0,
+        "expense": sign * amount if amount < 0 else 0,
+    }
+
+
+def record_entry_aggregates(cursor, chat_id, entry_id, amount, description, balance_after, user_name, timestamp=None):
+    """
+    新增记录后调用 (与 INSERT 在同一事务中)；timestamp 为空表示当前时间
+    """
+    params = _breakdown_params(chat_id, amount, description, user_name, timestamp, 1)
+    if params["month"] is None:
+        cursor.execute("SELECT date_trunc('month', LOCALTIMESTAMP)::date")
+        params["month"] = cursor.fetchone()[0]
+    cursor.execute(_BREAKDOWN_UPSERT, params)
+
+    _record_checkpoint(cursor, chat_id, params["month"], entry_id, amount, balance_after)
+    _record_stats(cursor, chat_id, amount, balance_after, timestamp)
+
+
+def remove_entry_aggregates(cursor, chat_id, entry_id, amount, description, user_name, timestamp):
+    """
+    撤销记录后调用 (与 DELETE 在同一事务中)
+    """
+    params = _breakdown_params(chat_id, amount, description, user_name, timestamp, -1)
+    cursor.execute(_BREAKDOWN_UPSERT, params)
+    cursor.execute("""
+        DELETE FROM history_breakdown
+        WHERE chat_id = %s AND month = %s AND entries <= 0
+    """, (chat_id, params["month"]))
+
+    _recompute_checkpoint(cursor, chat_id, params["month"])
+    _remove_stats(cursor, chat_id, amount, timestamp)
+
+
+def clear_entry_aggregates(cursor, chat_id):
+    cursor.execute("DELETE FROM history_breakdown WHERE chat_id = %s", (chat_id,))
+    cursor.execute("DELETE FROM balance_checkpoints WHERE chat_id = %s", (chat_id,))
+    cursor.execute("DELETE FROM chat_stats WHERE chat_id = %s", (chat_id,))
+    cursor.execute("DELETE FROM daily_stats WHERE chat_id = %s", (chat_id,))
+
+
+def rebuild_breakdown(cursor, chat_id=None):
+    """
+    从 history 重新生成汇总 (chat_id 为空时重建全部群组)
+    """
+    chat_filter = "WHERE chat_id = %(chat_id)s" if chat_id is not None else ""
+
+    cursor.execute(f"DELETE FROM history_breakdown {chat_filter}", {"chat_id": chat_id})
+
+    for kind, label_sql in (
+        ("user", "COALESCE(user_name, '未知')"),
+        ("tag", "split_part(COALESCE(description, ''), ' ', 1)"),
+    ):
+        cursor.execute(f"""
+            INSERT INTO history_breakdown (chat_id, kind, month, label, entries, income, expense)
+            SELECT chat_id, %(kind)s, date_trunc('month', timestamp)::date, {label_sql},
+                   COUNT(*),
+                   COALESCE(SUM(CASE WHEN amount > 0 THEN amount END), 0),
+                   COALESCE(SUM(CASE WHEN amount < 0 THEN amount END), 0)
+            FROM history
+            {chat_filter}
+            GROUP BY 1, 2, 3, 4
+        """, {"kind": kind, "chat_id": chat_id})
+
+
+# ================= BALANCE CHECKPOINTS =================
+# 每个群组每月一行 (UTC 月份)：截至月末的余额与累计收入/支出
+# last_id = 月末之前最后写入的记录 (按 id)，余额取该记录的 balance_after
+# 查询某日余额 = 上月检查点 + 当月 (chat_id, timestamp) 索引范围扫描
+
+_EXPECTED_CHECKPOINTS_CTE = """
+    months AS (
+        SELECT chat_id,
+               date_trunc('month', timestamp)::date AS month,
+               COALESCE(SUM(CASE WHEN amount > 0 THEN amount END), 0) AS income,
+               COALESCE(SUM(CASE WHEN amount < 0 THEN amount END), 0) AS expense,
+               MAX(id) AS last_id
+        FROM history
+        {chat_filter}
+        GROUP BY 1, 2
+    ),
+    cumulative AS (
+        SELECT chat_id, month,
+               (SUM(income) OVER w)::bigint AS income,
+               (SUM(expense) OVER w)::bigint AS expense,
+               MAX(last_id) OVER w AS last_id
+        FROM months
+        WINDOW w AS (PARTITION BY chat_id ORDER BY month)
+    ),
+    expected AS (
+        SELECT c.chat_id, c.month, h.balance_after AS balance,
+               c.income, c.expense, c.last_id
+        FROM cumulative c
+        JOIN history h ON h.id = c.last_id
+    )
+"""
+
+
+def _latest_checkpoint(cursor, chat_id, before_month=None):
+    if before_month is None:
+        cursor.execute("""
+            SELECT month, balance, income, expense, last_id
+            FROM balance_checkpoints
+            WHERE chat_id = %s
+            ORDER BY month DESC LIMIT 1
+        """, (chat_id,))
+    else:
+        cursor.execute("""
+            SELECT month, balance, income, expense, last_id
+            FROM balance_checkpoints
+            WHERE chat_id = %s AND month < %s
+            ORDER BY month DESC LIMIT 1
+        """, (chat_id, before_month))
+    return cursor.fetchone()
+
+
+def _record_checkpoint(cursor, chat_id, month, entry_id, amount, balance_after):
+
+    latest = _latest_checkpoint(cursor, chat_id)
+
+    # 记录落在更早的月份 (例如回放暂存记录)，后续检查点全部重算
+    if latest and latest[0] > month:
+        rebuild_checkpoints(cursor, chat_id)
+        return
+
+    income = amount if amount > 0 else 0
+    expense = amount if amount < 0 else 0
+
+    if latest and latest[0] == month:
+        cursor.execute("""
+            UPDATE balance_checkpoints
+            SET balance = %s, income = income + %s, expense = expense + %s, last_id = %s
+            WHERE chat_id = %s AND month = %s
+        """, (balance_after, income, expense, entry_id, chat_id, month))
+    else:
+        cursor.execute("""
+            INSERT INTO balance_checkpoints (chat_id, month, balance, income, expense, last_id)
+            VALUES (%s, %s, %s, %s, %s, %s)
+        """, (
+            chat_id, month, balance_after,
+            (latest[2] if latest else 0) + income,
+            (latest[3] if latest else 0) + expense,
+            entry_id
+        ))
+
+
+def _recompute_checkpoint(cursor, chat_id, month):
+    """
+    撤销后只重算该月的检查点 (只扫描一个月的记录)
+    """
+    latest = _latest_checkpoint(cursor, chat_id)
+    if latest and latest[0] > month:
+        rebuild_checkpoints(cursor, chat_id)
+        return
+
+    prev = _latest_checkpoint(cursor, chat_id, before_month=month)
+
+    cursor.execute("DELETE FROM balance_checkpoints WHERE chat_id = %s AND month = %s", (chat_id, month))
+    cursor.execute("""
+        WITH m AS (
+            SELECT COUNT(*) AS entries,
+                   COALESCE(SUM(CASE WHEN amount > 0 THEN amount END), 0) AS income,
+                   COALESCE(SUM(CASE WHEN amount < 0 THEN amount END), 0) AS expense,
+                   GREATEST(MAX(id), %(prev_id)s) AS last_id
+            FROM history
+            WHERE chat_id = %(chat_id)s
+            AND timestamp >= %(month)s AND timestamp < %(month)s + INTERVAL '1 month'
+        )
+        INSERT INTO balance_checkpoints (chat_id, month, balance, income, expense, last_id)
+        SELECT %(chat_id)s, %(month)s, h.balance_after,
+               %(income)s + m.income, %(expense)s + m.expense, m.last_id
+        FROM m
+        JOIN history h ON h.id = m.last_id
+        WHERE m.entries > 0
+    """, {
+        "chat_id": chat_id,
+        "month": month,
+        "income": prev[2] if prev else 0,
+        "expense": prev[3] if prev else 0,
+        "prev_id": prev[4] if prev else None,
+    })
+
+
+def rebuild_checkpoints(cursor, chat_id=None):
+    """
+    从 history 重新生成检查点 (chat_id 为空时重建全部群组)
+    """
+    chat_filter = "WHERE chat_id = %(chat_id)s" if chat_id is not None else ""
+
+    cursor.execute(f"DELETE FROM balance_checkpoints {chat_filter}", {"chat_id": chat_id})
+    cursor.execute(f"""
+        WITH {_EXPECTED_CHECKPOINTS_CTE.format(chat_filter=chat_filter)}
+        INSERT INTO balance_checkpoints (chat_id, month, balance, income, expense, last_id)
+        SELECT chat_id, month, balance, income, expense, last_id FROM expected
+    """, {"chat_id": chat_id})
+
+
+def checkpoint_drift(cursor, chat_id=None):
+    """
+    对比已存检查点与按 history 重新计算的结果
+    返回 [(chat_id, month, 已存 (balance, income, expense, last_id), 应为 (...))]
+    """
+    chat_filter = "WHERE chat_id = %(chat_id)s" if chat_id is not None else ""
+
+    cursor.execute(f"""
+        WITH {_EXPECTED_CHECKPOINTS_CTE.format(chat_filter=chat_filter)},
+        stored AS (
+            SELECT chat_id, month, balance, income, expense, last_id
+            FROM balance_checkpoints
+            {chat_filter}
+        )
+        SELECT COALESCE(s.chat_id, e.chat_id), COALESCE(s.month, e.month),
+               s.balance, s.income, s.expense, s.last_id,
+               e.balance, e.income, e.expense, e.last_id
+        FROM stored s
+        FULL OUTER JOIN expected e ON e.chat_id = s.chat_id AND e.month = s.month
+        WHERE (s.balance, s.income, s.expense, s.last_id)
+              IS DISTINCT FROM (e.balance, e.income, e.expense, e.last_id)
+        ORDER BY 1, 2
+    """, {"chat_id": chat_id})
+
+    return [
+        (row[0], row[1], tuple(row[2:6]), tuple(row[6:10]))
+        for row in cursor.fetchall()
+    ]
+
+
+def balance_as_of(cursor, chat_id, boundary):
+    """
+    截至 boundary (UTC，不含) 的 (余额, 累计收入, 累计支出)
+    余额 = boundary 之前最后写入 (按 id) 的记录的 balance_after
+    """
+    cursor.execute("SELECT date_trunc('month', %s::timestamp)::date", (boundary,))
+    month_start = cursor.fetchone()[0]
+
+    # boundary 恰好是月初时整月都已结束，直接使用上月检查点
+    checkpoint = _latest_checkpoint(cursor, chat_id, before_month=month_start)
+    _, balance, income, expense, last_id = checkpoint if checkpoint else (None, 0, 0, 0, 0)
+
+    cursor.execute("""
+        SELECT COALESCE(SUM(CASE WHEN amount > 0 THEN amount END), 0),
+               COALESCE(SUM(CASE WHEN amount < 0 THEN amount END), 0),
+               (ARRAY_AGG(ARRAY[id, balance_after] ORDER BY id DESC))[1:1]
+        FROM history
+        WHERE chat_id = %s
+        AND timestamp >= %s AND timestamp < %s
+    """, (chat_id, month_start, boundary))
+    month_income, month_expense, month_last = cursor.fetchone()
+
+    if month_last and month_last[0][0] > last_id:
+        balance = month_last[0][1]
+
+    return balance, income + month_income, expense + month_expense
+
+
+# ================= GLOBAL STATS =================
+# chat_stats: 每个群组一行 (记录数、当前余额、最后记账时间)
+# daily_stats: 每个群组每天一行 (UTC 日期)
+# 与其它汇总一起在写入事务中维护，/dashboard 只读这两张表
+
+def _record_stats(cursor, chat_id, amount, balance_after, timestamp):
+    params = {
+        "chat_id": chat_id,
+        "balance": balance_after,
+        "timestamp": timestamp,
+        "income": amount if amount > 0 else 0,
+        "expense": amount if amount < 0 else 0,
+    }
+
+    # 新记录的 id 最大，balance_after 就是当前余额 (回放的旧记录也一样)
+    cursor.execute("""
+        INSERT INTO chat_stats (chat_id, entries, balance, last_entry_at)
+        VALUES (%(chat_id)s, 1, %(balance)s, COALESCE(%(timestamp)s, LOCALTIMESTAMP))
+        ON CONFLICT (chat_id) DO UPDATE SET
+            entries = chat_stats.entries + 1,
+            balance = EXCLUDED.balance,
+            last_entry_at = GREATEST(chat_stats.last_entry_at, EXCLUDED.last_entry_at)
+    """, params)
+
+    cursor.execute("""
+        INSERT INTO daily_stats (day, chat_id, entries, income, expense)
+        VALUES (COALESCE(%(timestamp)s, LOCALTIMESTAMP)::date, %(chat_id)s, 1, %(income)s, %(expense)s)
+        ON CONFLICT (day, chat_id) DO UPDATE SET
+            entries = daily_stats.entries + 1,
+            income = daily_stats.income + EXCLUDED.income,
+            expense = daily_stats.expense + EXCLUDED.expense
+    """, params)
+
+
+def _remove_stats(cursor, chat_id, amount, timestamp):
+    params = {
+        "chat_id": chat_id,
+        "day": timestamp.date(),
+        "income": amount if amount > 0 else 0,
+        "expense": amount if amount < 0 else 0,
+    }
+
+    # 撤销的是最后一条记录，余额与最后时间取剩余记录 (走 chat_id 索引)
+    cursor.execute("""
+        UPDATE chat_stats SET
+            entries = entries - 1,
+            balance = COALESCE((
+                SELECT balance_after FROM history
+                WHERE chat_id = %(chat_id)s ORDER BY id DESC LIMIT 1
+            ), 0),
+            last_entry_at = (
+                SELECT MAX(timestamp) FROM history WHERE chat_id = %(chat_id)s
+            )
+        WHERE chat_id = %(chat_id)s
+    """, params)
+    cursor.execute("DELETE FROM chat_stats WHERE chat_id = %(chat_id)s AND entries <= 0", params)
+
+    cursor.execute("""
+        UPDATE daily_stats SET
+            entries = entries - 1,
+            income = income - %(income)s,
+            expense = expense - %(expense)s
+        WHERE day = %(day)s AND chat_id = %(chat_id)s
+    """, params)
+    cursor.execute("""
+        DELETE FROM daily_stats
+        WHERE day = %(day)s AND chat_id = %(chat_id)s AND entries <= 0
+    """, params)
+
+
+def rebuild_stats(cursor, chat_id=None):
+    """
+    从 history 重新生成全局统计 (chat_id 为空时重建全部群组)
+    """
+    chat_filter = "WHERE chat_id = %(chat_id)s" if chat_id is not None else ""
+
+    cursor.execute(f"DELETE FROM chat_stats {chat_filter}", {"chat_id": chat_id})
+    cursor.execute(f"DELETE FROM daily_stats {chat_filter}", {"chat_id": chat_id})
+
+    cursor.execute(f"""
+        INSERT INTO chat_stats (chat_id, entries, balance, last_entry_at)
+        SELECT h.chat_id, s.entries, h.balance_after, s.last_entry_at
+        FROM (
+            SELECT chat_id, COUNT(*) AS entries, MAX(id) AS last_id, MAX(timestamp) AS last_entry_at
+            FROM history
+            {chat_filter}
+            GROUP BY chat_id
+        ) s
+        JOIN history h ON h.id = s.last_id
+    """, {"chat_id": chat_id})
+
+    cursor.execute(f"""
+        INSERT INTO daily_stats (day, chat_id, entries, income, expense)
+        SELECT timestamp::date, chat_id, COUNT(*),
+               COALESCE(SUM(CASE WHEN amount > 0 THEN amount END), 0),
+               COALESCE(SUM(CASE WHEN amount < 0 THEN amount END), 0)
+        FROM history
+        {chat_filter}
+        GROUP BY 1, 2
+    """, {"chat_id": chat_id})
@@ -0,0 +1,66 @@
+import os
+from collections import OrderedDict
+
+
+# ================= CONFIG =================
+RENDER_CACHE_SIZE = int(os.getenv("RENDER_CACHE_SIZE", "2048"))
+SUMMARY_CACHE_SIZE = int(os.getenv("SUMMARY_CACHE_SIZE", "4096"))
+
+
+# ================= LRU CACHE =================
+class LRUCache:
+
+    def __init__(self, maxsize):
+        self.maxsize = maxsize
+        self._data = OrderedDict()
+
+    def get(self, key, default=None):
+        if key not in self._data:
+            return default
+        self._data.move_to_end(key)
+        return self._data[key]
+
+    def put(self, key, value):
+        self._data[key] = value
+        self._data.move_to_end(key)
+        while len(self._data) > self.maxsize:
+            self._data.popitem(last=False)
+
+    def __len__(self):
+        return len(self._data)
+
+
+# ================= LEDGER VERSION =================
+# 每个群组的账本版本号；撤销/清空会改写历史记录，版本号 +1 后旧缓存自动失效
+_ledger_versions = {}
+
+
+def ledger_version(chat_id):
+    return _ledger_versions.get(chat_id, 0)
+
+
+def bump_ledger_version(chat_id):
+    _ledger_versions[chat_id] = _ledger_versions.get(chat_id, 0) + 1
+    note_ledger_write(chat_id)
+
+
+# 每个群组的写入版本号；任何新增/撤销/清空都会 +1
+_write_versions = {}
+
+
+def write_version(chat_id):
+    return _write_versions.get(chat_id, 0)
+
+
+def note_ledger_write(chat_id):
+    _write_versions[chat_id] = _write_versions.get(chat_id, 0) + 1
+
+
+# ================= MONTH RENDER CACHE =================
+# (chat_id, tz_name, ledger_version, 本月起点) -> ([已结束月份文本], 本月之前的余额)
+month_render_cache = LRUCache(RENDER_CACHE_SIZE)
+
+
+# ================= SUMMARY RESPONSE CACHE =================
+# (chat_id, callback_data) -> (write_version, text, reply_markup)
+summary_response_cache = LRUCache(SUMMARY_CACHE_SIZE)
@@ -1,7 +1,9 @@
 import os
 import re
 import logging
+from io import BytesIO
 from datetime import datetime, timedelta
+from zoneinfo import ZoneInfo
 from telegram import Update, InlineKeyboardMarkup, InlineKeyboardButton
 from telegram.ext import (
     Application,
@@ -11,7 +13,35 @@ from telegram.ext import (
     filters,
     ContextTypes,
 )
-from database import init_db, get_db_connection
+from storage import get_storage, run_storage, StorageUnavailable
+from update_processor import ChatOrderedUpdateProcessor, ENTRY_PATTERN, MAX_ENTRY_AMOUNT
+from sharding import SHARD_WORKERS, run_sharded, shard_for, current_shard
+from startup import startup_state
+from timezones import (
+    chat_timezone,
+    cached_chat_timezone,
+    set_chat_timezone,
+    set_report_time,
+    preload_chat_settings,
+    is_valid_timezone,
+    period_bounds,
+    local_today,
+    next_month,
+    to_local,
+)
+from subscriptions import subscription_scheduler
+from spool import get_ledger_spool, SPOOL_REPLAY_INTERVAL
+from rate_limit import rate_limiter, RATE_LIMIT_LOG_INTERVAL
+from dashboard import dashboard, DASHBOARD_REFRESH_SECONDS
+from profiler import profiler, PROFILE_SECONDS, PROFILE_OUTPUT_DIR, PROFILE_MAX_SECONDS
+from ledger_cache import (
+    month_render_cache,
+    summary_response_cache,
+    ledger_version,
+    bump_ledger_version,
+    write_version,
+    note_ledger_write,
+)
 
 # ---------------- CONFIG ----------------
 logging.basicConfig(
@@ -31,33 +61,54 @@ async def is_owner(chat_id, user_id):
     if str(user_id) == str(MASTER_ADMIN):
         return True
 
-    conn = get_db_connection()
-    cursor = conn.cursor()
-    cursor.execute(
-        "SELECT expire_date FROM users WHERE user_id=%s",
-        (user_id,)
-    )
-    row = cursor.fetchone()
-    cursor.close()
-    conn.close()
-
-    return True if row and row[0] and row[0] > datetime.utcnow() else False
+    # 使用期限已由 subscription_scheduler 载入内存；尚未载入时会访问数据库
+    return await subscription_scheduler.check_active(user_id)
 
 
 # ================= ASSISTANT =================
+# 已确认的助手 (chat_id, assistant_id)，数据库不可用时仍可识别
+# 启动时批量载入后以内存为准 (增删助手会同步更新)，不再逐条查询
+assistant_cache = set()
+assistants_preloaded = False
+
+
+def preload_assistants():
+    global assistants_preloaded
+
+    try:
+        assistant_cache.update(get_storage().load_assistants())
+    except StorageUnavailable:
+        return False
+
+    assistants_preloaded = True
+    return True
+
+
 async def is_assistant(chat_id, user_id):
 
-    conn = get_db_connection()
-    cursor = conn.cursor()
-    cursor.execute(
-        "SELECT 1 FROM assistants WHERE chat_id=%s AND assistant_id=%s",
-        (chat_id, user_id)
-    )
-    row = cursor.fetchone()
-    cursor.close()
-    conn.close()
+    if assistants_preloaded:
+        return (chat_id, user_id) in assistant_cache
+
+    try:
+        exists = await run_storage(get_storage().assistant_exists, chat_id, user_id)
+    except StorageUnavailable:
+        return (chat_id, user_id) in assistant_cache
+
+    if exists:
+        assistant_cache.add((chat_id, user_id))
+    else:
+        assistant_cache.discard((chat_id, user_id))
+
+    return exists
 
-    return True if row else False
+
+# ================= CHAT TIMEZONE =================
+async def get_chat_timezone(chat_id):
+    # 缓存未命中时 chat_timezone 会查询数据库，放到存储线程中执行
+    tz_name = cached_chat_timezone(chat_id)
+    if tz_name is None:
+        tz_name = await run_storage(chat_timezone, chat_id)
+    return tz_name
 
 
 # ================= ROLE CHECK =================
@@ -76,6 +127,24 @@ async def check_permission(update: Update):
     return None
 
 
+# ================= RATE LIMIT =================
+RATE_LIMITED_TEXT = "⚠️ 操作过于频繁，请稍后再试"
+
+
+async def check_rate_limit(update: Update, kind):
+
+    allowed, notify = rate_limiter.check(
+        kind,
+        update.effective_chat.id,
+        update.effective_user.id
+    )
+
+    if not allowed and notify:
+        await update.message.reply_text(RATE_LIMITED_TEXT)
+
+    return allowed
+
+
 # ================= ADD ASSISTANT =================
 async def add_assistant(update: Update, context: ContextTypes.DEFAULT_TYPE):
 
@@ -92,16 +161,13 @@ async def add_assistant(update: Update, context: ContextTypes.DEFAULT_TYPE):
 
     assistant_id = update.message.reply_to_message.from_user.id
 
-    conn = get_db_connection()
-    cursor = conn.cursor()
-    cursor.execute("""
-        INSERT INTO assistants (chat_id, owner_id, assistant_id)
-        VALUES (%s,%s,%s)
-        ON CONFLICT DO NOTHING
-    """, (chat_id, user_id, assistant_id))
-    conn.commit()
-    cursor.close()
-    conn.close()
+    try:
+        await run_storage(get_storage().add_assistant, chat_id, user_id, assistant_id)
+    except StorageUnavailable:
+        await update.message.reply_text("❌ 数据库连接失败")
+        return
+
+    assistant_cache.add((chat_id, assistant_id))
 
     await update.message.reply_text("✅ 助手添加成功")
 
@@ -122,15 +188,13 @@ async def remove_assistant(update: Update, context: ContextTypes.DEFAULT_TYPE):
 
     assistant_id = update.message.reply_to_message.from_user.id
 
-    conn = get_db_connection()
-    cursor = conn.cursor()
-    cursor.execute("""
-        DELETE FROM assistants
-        WHERE chat_id=%s AND assistant_id=%s
-    """, (chat_id, assistant_id))
-    conn.commit()
-    cursor.close()
-    conn.close()
+    try:
+        await run_storage(get_storage().remove_assistant, chat_id, assistant_id)
+    except StorageUnavailable:
+        await update.message.reply_text("❌ 数据库连接失败")
+        return
+
+    assistant_cache.discard((chat_id, assistant_id))
 
     await update.message.reply_text("✅ 助手已移除")
 # ---------------- CHECK STATUS ----------------
@@ -149,33 +213,22 @@ async def check_status(update: Update, context: ContextTypes.DEFAULT_TYPE):
         )
         return
 
-    conn = get_db_connection()
-    if not conn:
-        await update.message.reply_text("❌ 数据库连接错误")
-        return
-
-    cursor = conn.cursor()
+    storage = get_storage()
 
-    # 查使用期限
-    cursor.execute(
-        "SELECT expire_date FROM users WHERE user_id = %s",
-        (user_id,)
-    )
-    user_row = cursor.fetchone()
+    def read_status():
+        with storage.read_batch():
+            # 查使用期限 / 查 Assistant
+            return storage.owner_expiry(user_id), storage.assistant_exists(chat_id, user_id)
 
-    # 查 Assistant
-    cursor.execute(
-        "SELECT 1 FROM assistants WHERE chat_id=%s AND assistant_id=%s",
-        (chat_id, user_id)
-    )
-    assistant_row = cursor.fetchone()
-
-    cursor.close()
-    conn.close()
+    try:
+        expire_date, assistant_row = await run_storage(read_status)
+    except StorageUnavailable:
+        await update.message.reply_text("❌ 数据库连接错误")
+        return
 
         # ===== Owner =====
-    if user_row and user_row[0]:
-        remaining = user_row[0] - datetime.utcnow() 
+    if expire_date:
+        remaining = expire_date - datetime.utcnow() 
         
         if remaining.total_seconds() > 0: 
             days = remaining.days 
@@ -228,24 +281,18 @@ async def add_days(update: Update, context: ContextTypes.DEFAULT_TYPE):
         await update.message.reply_text("❌ 参数格式错误")
         return
 
-    conn = get_db_connection()
-    if not conn:
+    storage = get_storage()
+    try:
+        current_expire = await run_storage(storage.owner_expiry, target_id)
+    except StorageUnavailable:
         await update.message.reply_text("❌ 数据库连接失败")
         return
 
-    cursor = conn.cursor()
-
-    cursor.execute(
-        "SELECT expire_date FROM users WHERE user_id=%s",
-        (target_id,)
-    )
-    row = cursor.fetchone()
-
     now = datetime.utcnow()
 
     # ===== 计算新时间 =====
-    if row and row[0] and row[0] > now:
-        base_time = row[0]
+    if current_expire and current_expire > now:
+        base_time = current_expire
     else:
         base_time = now
 
@@ -255,16 +302,13 @@ async def add_days(update: Update, context: ContextTypes.DEFAULT_TYPE):
     if new_expire < now:
         new_expire = now
 
-    cursor.execute("""
-        INSERT INTO users (user_id, expire_date)
-        VALUES (%s, %s)
-        ON CONFLICT (user_id)
-        DO UPDATE SET expire_date=%s
-    """, (target_id, new_expire, new_expire))
+    try:
+        await run_storage(storage.set_owner_expiry, target_id, new_expire)
+    except StorageUnavailable:
+        await update.message.reply_text("❌ 数据库连接失败")
+        return
 
-    conn.commit()
-    cursor.close()
-    conn.close()
+    subscription_scheduler.update(target_id, new_expire)
 
     # ===== 剩余时间计算 =====
     remaining = new_expire - now
@@ -297,9 +341,18 @@ async def help_cmd(update: Update, context: ContextTypes.DEFAULT_TYPE):
         "📈 /summary\n"
         "查看统计报表（总汇总 / 最近30天 / 最近12个月）\n\n"
 
+        "🔍 /find 关键词 [开始日期] [结束日期]\n"
+        "搜索账目备注，例如 /find 房租 2024-01-01 2024-03-31\n\n"
+
+        "💰 /balance 日期\n"
+        "查询指定日期结束时的余额，例如 /balance 2024-03-31\n\n"
+
         "↩️ /undo\n"
         "撤销最后一条记录\n\n"
 
+        "🕒 /timezone 时区\n"
+        "设置群组时区，日/月/年统计按本地时间划分（仅 Owner）\n\n"
+
         "🗑️ /reset\n"
         "清空当前群组所有记录（仅 Owner）\n\n"
 
@@ -325,6 +378,12 @@ async def help_cmd(update: Update, context: ContextTypes.DEFAULT_TYPE):
         "/adddays 123456789 30\n"
         "增加 30 天使用期限\n\n"
 
+        "/dashboard\n"
+        "查看全局看板（活跃群组 / 每日记账 / 即将到期 Owner）\n\n"
+
+        "/profile 秒数\n"
+        "采样分析指定时间内的处理耗时，结果以文件发送\n\n"
+
         "━━━━━━━━━━━━━━━━━━\n"
         "📌 系统说明\n"
         "• 数据按群组独立存储\n"
@@ -341,118 +400,207 @@ async def help_cmd(update: Update, context: ContextTypes.DEFAULT_TYPE):
 
 from collections import defaultdict
 
-async def send_monthly_formatted_messages(update: Update, rows, current_balance, title="📒 **全部账目汇总**"):
+def render_month_block(month_key, month_rows, tz_name="UTC"):
     """
-    按月份分段发送账目记录 (ภาษาจีน)
+    生成单个月份的账单文本，返回 (text, 本月收款, 本月支付)
     """
-    if not rows:
-        await update.message.reply_text("📭 暂无账目记录")
-        return
+    year, month = month_key
+
+    # 转换月份显示格式，例如 "2024年 03月"
+    month_display = f"{year}年 {month:02d}月"
+
+    plus_sum = sum(r[1] for r in month_rows if r[1] > 0)
+    minus_sum = sum(r[1] for r in month_rows if r[1] < 0)
+
+    text_reply = f" {month_display}**\n"
+    text_reply += "-------------------------------------------------------------------\n"
+
+    for r in month_rows:
+        # 1. จัดรูปแบบวันที่ให้เป็น "3月9日" (ตัดเลข 0 นำหน้าออก)
+        local = to_local(r[3], tz_name)
+        dt_str = f"{local.month}月{local.day}日"
+
+        # 2. จัดรูปแบบจำนวนเงิน
+        amt_str = f"{'+' if r[1] > 0 else ''}{r[1]:,}"
 
-    # 1. 按月份分组数据: { '2024-01': [rows], '2024-02': [rows] }
+        # 3. ดึงคำอธิบายรายการ
+        desc = r[0]
+
+        # 4. รวมข้อความเป็นบรรทัดเดียวตามรูปแบบที่ต้องการ
+        # ผลลัพธ์: 3月9日 备用资金 +10,000
+        text_reply += f"{dt_str} {desc} {amt_str}\n"
+
+    # 月度小结
+    text_reply += "-------------------------------------------------------------------\n"
+    text_reply += f"本月收款: {plus_sum:,}\n"
+    text_reply += f"本月支付: {abs(minus_sum):,}\n"
+    text_reply += f"本月余额: {plus_sum + minus_sum:,}\n"
+
+    return text_reply, plus_sum, minus_sum
+
+
+def render_past_months(rows, tz_name):
+    """
+    已结束月份的账单文本 (从旧到新)，返回 ([text], 这些记录之后的余额)
+    """
+    # 按群组本地月份分组数据: { (2024, 1): [rows], (2024, 2): [rows] }
+    # 只在跨越月份边界时做一次时区换算
     monthly_data = defaultdict(list)
+    start = end = None
     for r in rows:
-        month_key = r[3].strftime('%Y-%m') 
+        if start is None or not (start <= r[3] < end):
+            local = to_local(r[3], tz_name)
+            month_key = (local.year, local.month)
+            start, end = period_bounds(tz_name, f"{local.year}-{local.month:02d}")
         monthly_data[month_key].append(r)
 
-    # 2. 发送主标题
+    blocks = [
+        render_month_block(month_key, monthly_data[month_key], tz_name)[0]
+        for month_key in sorted(monthly_data.keys())
+    ]
+
+    # rows 按 id 排序，最后一条即最后写入的记录
+    return blocks, (rows[-1][2] if rows else 0)
+
+
+async def send_monthly_formatted_messages(update: Update, title="📒 **全部账目汇总**"):
+    """
+    按月份分段发送账目记录 (ภาษาจีน)
+    已结束的月份整体缓存，命中时只读取本月 (群组本地日历月) 的记录
+    """
+    chat_id = update.effective_chat.id
+    tz_name = await get_chat_timezone(chat_id)
+
+    today = local_today(tz_name)
+    current_month = (int(today[:4]), int(today[5:7]))
+    month_start = period_bounds(tz_name, today[:7])[0]
+
+    # 撤销/清空/回放会改写历史 (版本号 +1)，新增记录只会落在本月
+    cache_key = (chat_id, tz_name, ledger_version(chat_id), month_start)
+    past = month_render_cache.get(cache_key)
+    storage = get_storage()
+
+    try:
+        if past is None:
+            rows = await run_storage(storage.ledger_rows, chat_id)
+            past = render_past_months([r for r in rows if r[3] < month_start], tz_name)
+            month_render_cache.put(cache_key, past)
+            current_rows = [r for r in rows if r[3] >= month_start]
+        else:
+            current_rows = await run_storage(storage.ledger_rows, chat_id, since=month_start)
+    except StorageUnavailable:
+        await update.message.reply_text("❌ 数据库连接失败")
+        return
+
+    past_blocks, past_balance = past
+
+    if not past_blocks and not current_rows:
+        await update.message.reply_text("📭 暂无账目记录")
+        return
+
+    # 1. 发送主标题
     await update.message.reply_text(title, parse_mode='Markdown')
 
-    # 3. 按月份循环发送 (从旧到新)
-    sorted_months = sorted(monthly_data.keys())
-    
-    for month_key in sorted_months:
-        month_rows = monthly_data[month_key]
-        # 转换月份显示格式，例如 "2024年 03月"
-        month_display = month_rows[0][3].strftime('%Y年 %m月')
-        
-        plus_sum = sum(r[1] for r in month_rows if r[1] > 0)
-        minus_sum = sum(r[1] for r in month_rows if r[1] < 0)
-        
-        text_reply = f" {month_display}**\n"
-        text_reply += "-------------------------------------------------------------------\n"
-
-        for r in month_rows:
-            # 1. จัดรูปแบบวันที่ให้เป็น "3月9日" (ตัดเลข 0 นำหน้าออก)
-            month_val = r[3].strftime('%m').lstrip('0')
-            day_val = r[3].strftime('%d').lstrip('0')
-            dt_str = f"{month_val}月{day_val}日"
-            
-            # 2. จัดรูปแบบจำนวนเงิน
-            amt_str = f"{'+' if r[1] > 0 else ''}{r[1]:,}"
-            
-            # 3. ดึงคำอธิบายรายการ
-            desc = r[0]
-            
-            # 4. รวมข้อความเป็นบรรทัดเดียวตามรูปแบบที่ต้องการ
-            # ผลลัพธ์: 3月9日 备用资金 +10,000
-            text_reply += f"{dt_str} {desc} {amt_str}\n"
-            
-
-        # 月度小结
-        text_reply += "-------------------------------------------------------------------\n"
-        text_reply += f"本月收款: {plus_sum:,}\n"
-        text_reply += f"本月支付: {abs(minus_sum):,}\n"
-        text_reply += f"本月余额: {plus_sum + minus_sum:,}\n"
-        
-        # 发送该月份账单
+    # 2. 按月份循环发送 (从旧到新)，本月每次重新生成
+    for text_reply in past_blocks:
+        await update.message.reply_text(text_reply, parse_mode='Markdown')
+
+    if current_rows:
+        text_reply, _, _ = render_month_block(current_month, current_rows, tz_name)
         await update.message.reply_text(text_reply, parse_mode='Markdown')
 
-    # 4. 发送最终总余额
+    # 3. 发送最终总余额
+    current_balance = current_rows[-1][2] if current_rows else past_balance
     footer = f"-------------------------------------------------------------------\n**当前总余额: {current_balance:,}**"
     await update.message.reply_text(footer, parse_mode='Markdown')
 
 # ---------------- HANDLE MESSAGE ----------------
+# 只回复了简短确认、还欠一份完整汇总的群组: chat_id -> 最近一次成功记账的 update
+_render_owed = {}
+
+ENTRY_SUMMARY_TITLE = "**账目已更新并生成月度汇总**"
+
+
 async def handle_msg(update: Update, context: ContextTypes.DEFAULT_TYPE):
     if not update.message or not update.message.text:
         return
 
-    role = await check_permission(update)
-    if not role: return
-
     text = update.message.text.strip()
-    match = re.match(r'^([+-])(\d+)\s*(.*)$', text)
-    if not match: return
+    match = ENTRY_PATTERN.match(text)
 
-    sign, amount_str, description = match.groups()
-    amount = int(amount_str)
-    description = description if description else "未备注项目"
-    if sign == '-': amount = -amount
+    try:
+        role = await check_permission(update)
+        if not role: return
 
-    chat_id = update.effective_chat.id
-    user_name = update.effective_user.first_name
+        if not match: return
 
-    conn = get_db_connection()
-    if not conn: return
-    cursor = conn.cursor()
+        # 权限检查只读内存；无权限的消息不占用群组的记账限额，超额时不访问数据库
+        if not await check_rate_limit(update, "write"):
+            return
 
-    try:
-        # 获取最后余额
-        cursor.execute("SELECT balance_after FROM history WHERE chat_id = %s ORDER BY id DESC LIMIT 1", (chat_id,))
-        last = cursor.fetchone()
-        last_balance = last[0] if last else 0
-        new_balance = last_balance + amount
-
-        # 插入新记录
-        cursor.execute("""
-            INSERT INTO history (chat_id, amount, description, balance_after, user_name)
-            VALUES (%s, %s, %s, %s, %s)
-        """, (chat_id, amount, description, new_balance, user_name))
-        conn.commit()
-
-        # 获取所有历史记录按顺序排列
-        cursor.execute("""
-            SELECT description, amount, balance_after, timestamp
-            FROM history WHERE chat_id = %s ORDER BY id ASC
-        """, (chat_id,))
-        rows = cursor.fetchall()
+        sign, amount_str, description = match.groups()
+        amount = int(amount_str)
+        if amount > MAX_ENTRY_AMOUNT:
+            await update.message.reply_text(f"❌ 金额超出范围 (单笔最多 {MAX_ENTRY_AMOUNT:,})")
+            return
 
-        # 调用月度格式化发送函数
-        await send_monthly_formatted_messages(update, rows, new_balance, title="**账目已更新并生成月度汇总**")
+        description = description if description else "未备注项目"
+        if sign == '-': amount = -amount
+
+        chat_id = update.effective_chat.id
+        user_name = update.effective_user.first_name
+
+        spool = get_ledger_spool()
+
+        # 该群组还有暂存记录时先回放，保证入账顺序
+        if spool.has_pending(chat_id):
+            replayed = await run_storage(spool.replay)
+            for replayed_chat in replayed:
+                bump_ledger_version(replayed_chat)
+
+        storage = get_storage()
+        written = None
+
+        if not spool.has_pending(chat_id):
+            try:
+                written = await run_storage(storage.add_entry, chat_id, amount, description, user_name)
+            except StorageUnavailable:
+                pass
+
+        # 数据库不可用：写入本地暂存文件，恢复后自动入账
+        if written is None:
+            await run_storage(spool.append, chat_id, amount, description, user_name)
+            await update.message.reply_text(
+                f"⏳ 数据库暂时不可用，记录已排队：{description} {'+' if amount > 0 else ''}{amount:,}\n"
+                "恢复后将自动按顺序入账"
+            )
+            return
+
+        _, new_balance = written
+        note_ledger_write(chat_id)
+
+        # 同一群组后面还有记账在排队：只回复简短确认，汇总留给后面的记账消息
+        if context.application.update_processor.pending_writes(chat_id):
+            _render_owed[chat_id] = update
+            await update.message.reply_text(
+                f"✅ 已记录：{description} {'+' if amount > 0 else ''}{amount:,}\n"
+                f"当前余额：{new_balance:,}"
+            )
+            return
 
+        _render_owed.pop(chat_id, None)
+
+        # 调用月度格式化发送函数
+        await send_monthly_formatted_messages(update, title=ENTRY_SUMMARY_TITLE)
     finally:
-        cursor.close()
-        conn.close()
+        # 后面排队的记账消息可能没有入账 (无权限/被限流/已暂存)，
+        # 同群最后一条记账消息处理完时补发欠下的汇总
+        if match:
+            chat_id = update.effective_chat.id
+            owed = _render_owed.get(chat_id)
+            if owed is not None and not context.application.update_processor.pending_writes(chat_id):
+                del _render_owed[chat_id]
+                await send_monthly_formatted_messages(owed, title=ENTRY_SUMMARY_TITLE)
 
 
 # ---------------- summary ----------------
@@ -462,10 +610,15 @@ async def summary_cmd(update: Update, context: ContextTypes.DEFAULT_TYPE):
     if not role:
         return
 
+    if not await check_rate_limit(update, "report"):
+        return
+
     keyboard = [
         [InlineKeyboardButton("📊 全部统计", callback_data="summary_all")],
         [InlineKeyboardButton("📅 按月份查看", callback_data="summary_month_select")],
-        [InlineKeyboardButton("📆 按年份查看", callback_data="summary_year_select")]
+        [InlineKeyboardButton("📆 按年份查看", callback_data="summary_year_select")],
+        [InlineKeyboardButton("👥 操作人统计", callback_data="summary_breakdown:user")],
+        [InlineKeyboardButton("🏷️ 分类统计", callback_data="summary_breakdown:tag")]
     ]
 
     await update.message.reply_text(
@@ -478,63 +631,69 @@ async def summary_cmd(update: Update, context: ContextTypes.DEFAULT_TYPE):
 async def summary_callback(update: Update, context: ContextTypes.DEFAULT_TYPE):
 
     query = update.callback_query
-    await query.answer()
 
     chat_id = query.message.chat.id
     action = query.data
+    version = write_version(chat_id)
+
+    # 账本未变化时直接返回缓存结果，不访问数据库 (也不计入限流)
+    cached = summary_response_cache.get((chat_id, action))
+    if cached and cached[0] == version:
+        await query.answer()
+        _, text, reply_markup = cached
+        await query.edit_message_text(text, reply_markup=reply_markup)
+        return
 
-    conn = get_db_connection()
-    cursor = conn.cursor()
+    allowed, _ = rate_limiter.check("report", chat_id, query.from_user.id)
+    if not allowed:
+        await query.answer(RATE_LIMITED_TEXT)
+        return
+
+    await query.answer()
+    tz_name = await get_chat_timezone(chat_id)
+
+    storage = get_storage()
+
+    def read_summary():
+        # 同一页的几次统计在同一个快照中完成；
+        # last_read_stale 按线程记录，须在执行查询的线程内读取
+        with storage.read_batch(chat_id):
+            text, reply_markup = summary_text(storage, chat_id, tz_name, action)
+        return text, reply_markup, storage.last_read_stale
+
+    try:
+        text, reply_markup, stale = await run_storage(read_summary)
+    except StorageUnavailable:
+        await query.edit_message_text("❌ 数据库连接失败")
+        return
+
+    if text is None:
+        return
+
+    # 只缓存来自主库、或副本已确认回放到本群组最近写入的结果
+    if not stale:
+        summary_response_cache.put((chat_id, action), (version, text, reply_markup))
+    await query.edit_message_text(text, reply_markup=reply_markup)
+
+
+def summary_text(storage, chat_id, tz_name, action):
+    """
+    生成 /summary 各按钮的 (文本, 按钮)；未知按钮返回 (None, None)
+    """
+    text = None
+    reply_markup = None
 
     # ================= 全部统计 =================
     if action == "summary_all":
 
-        cursor.execute("""
-            SELECT 
-                COALESCE(SUM(CASE WHEN amount > 0 THEN amount END),0),
-                COALESCE(SUM(CASE WHEN amount < 0 THEN amount END),0)
-            FROM history
-            WHERE chat_id = %s
-        """, (chat_id,))
-        income, expense = cursor.fetchone()
+        income, expense = storage.totals(chat_id)
         expense_abs = abs(expense)
         net = income + expense
 
-        # 按日
-        cursor.execute("""
-            SELECT DATE(timestamp),
-                   COALESCE(SUM(CASE WHEN amount > 0 THEN amount END),0),
-                   COALESCE(SUM(CASE WHEN amount < 0 THEN amount END),0)
-            FROM history
-            WHERE chat_id = %s
-            GROUP BY DATE(timestamp)
-            ORDER BY DATE(timestamp) DESC
-        """, (chat_id,))
-        daily = cursor.fetchall()
-
-        # 按月
-        cursor.execute("""
-            SELECT TO_CHAR(timestamp,'YYYY-MM'),
-                   COALESCE(SUM(CASE WHEN amount > 0 THEN amount END),0),
-                   COALESCE(SUM(CASE WHEN amount < 0 THEN amount END),0)
-            FROM history
-            WHERE chat_id = %s
-            GROUP BY TO_CHAR(timestamp,'YYYY-MM')
-            ORDER BY 1 DESC
-        """, (chat_id,))
-        monthly = cursor.fetchall()
-
-        # 按年
-        cursor.execute("""
-            SELECT TO_CHAR(timestamp,'YYYY'),
-                   COALESCE(SUM(CASE WHEN amount > 0 THEN amount END),0),
-                   COALESCE(SUM(CASE WHEN amount < 0 THEN amount END),0)
-            FROM history
-            WHERE chat_id = %s
-            GROUP BY TO_CHAR(timestamp,'YYYY')
-            ORDER BY 1 DESC
-        """, (chat_id,))
-        yearly = cursor.fetchall()
+        # 按日 / 按月 / 按年
+        daily = storage.grouped_totals(chat_id, tz_name, "day", descending=True)
+        monthly = storage.grouped_totals(chat_id, tz_name, "month", descending=True)
+        yearly = storage.grouped_totals(chat_id, tz_name, "year", descending=True)
 
         text = "📊 全部统计\n━━━━━━━━━━━━━━━\n\n"
         text += f"收入: {income:,}\n"
@@ -553,62 +712,34 @@ async def summary_callback(update: Update, context: ContextTypes.DEFAULT_TYPE):
         for y, inc, exp in yearly:
             text += f"{y} | 收入 {inc:,} | 支出 {abs(exp):,} | 净额 {(inc+exp):,}\n"
 
-        await query.edit_message_text(text)
-
     # ================= 选择月份 =================
     elif action == "summary_month_select":
 
-        cursor.execute("""
-            SELECT DISTINCT TO_CHAR(timestamp,'YYYY-MM')
-            FROM history
-            WHERE chat_id = %s
-            ORDER BY 1 DESC
-            LIMIT 12
-        """, (chat_id,))
-        months = cursor.fetchall()
+        months = storage.periods(chat_id, tz_name, "month", limit=12)
 
         keyboard = []
         for m in months:
             keyboard.append([
                 InlineKeyboardButton(
-                    m[0],
-                    callback_data=f"summary_month:{m[0]}"
+                    m,
+                    callback_data=f"summary_month:{m}"
                 )
             ])
 
-        await query.edit_message_text(
-            "📅 请选择月份：",
-            reply_markup=InlineKeyboardMarkup(keyboard)
-        )
+        text = "📅 请选择月份："
+        reply_markup = InlineKeyboardMarkup(keyboard)
 
     # ================= 查看具体月份 =================
     elif action.startswith("summary_month:"):
 
         month = action.split(":")[1]
+        start, end = period_bounds(tz_name, month)
 
-        cursor.execute("""
-            SELECT 
-                COALESCE(SUM(CASE WHEN amount > 0 THEN amount END),0),
-                COALESCE(SUM(CASE WHEN amount < 0 THEN amount END),0)
-            FROM history
-            WHERE chat_id=%s
-            AND TO_CHAR(timestamp,'YYYY-MM')=%s
-        """, (chat_id, month))
-        income, expense = cursor.fetchone()
+        income, expense = storage.totals(chat_id, start, end)
         expense_abs = abs(expense)
         net = income + expense
 
-        cursor.execute("""
-            SELECT DATE(timestamp),
-                   COALESCE(SUM(CASE WHEN amount > 0 THEN amount END),0),
-                   COALESCE(SUM(CASE WHEN amount < 0 THEN amount END),0)
-            FROM history
-            WHERE chat_id=%s
-            AND TO_CHAR(timestamp,'YYYY-MM')=%s
-            GROUP BY DATE(timestamp)
-            ORDER BY DATE(timestamp)
-        """, (chat_id, month))
-        daily = cursor.fetchall()
+        daily = storage.grouped_totals(chat_id, tz_name, "day", start, end)
 
         text = f"📅 {month} 月统计\n━━━━━━━━━━━━━━━\n\n"
         text += f"收入: {income:,}\n"
@@ -618,61 +749,34 @@ async def summary_callback(update: Update, context: ContextTypes.DEFAULT_TYPE):
         for d, inc, exp in daily:
             text += f"{d} | 收入 {inc:,} | 支出 {abs(exp):,} | 净额 {(inc+exp):,}\n"
 
-        await query.edit_message_text(text)
-
     # ================= 选择年份 =================
     elif action == "summary_year_select":
 
-        cursor.execute("""
-            SELECT DISTINCT TO_CHAR(timestamp,'YYYY')
-            FROM history
-            WHERE chat_id = %s
-            ORDER BY 1 DESC
-        """, (chat_id,))
-        years = cursor.fetchall()
+        years = storage.periods(chat_id, tz_name, "year")
 
         keyboard = []
         for y in years:
             keyboard.append([
                 InlineKeyboardButton(
-                    y[0],
-                    callback_data=f"summary_year:{y[0]}"
+                    y,
+                    callback_data=f"summary_year:{y}"
                 )
             ])
 
-        await query.edit_message_text(
-            "📆 请选择年份：",
-            reply_markup=InlineKeyboardMarkup(keyboard)
-        )
+        text = "📆 请选择年份："
+        reply_markup = InlineKeyboardMarkup(keyboard)
 
     # ================= 查看具体年份 =================
     elif action.startswith("summary_year:"):
 
         year = action.split(":")[1]
+        start, end = period_bounds(tz_name, year)
 
-        cursor.execute("""
-            SELECT 
-                COALESCE(SUM(CASE WHEN amount > 0 THEN amount END),0),
-                COALESCE(SUM(CASE WHEN amount < 0 THEN amount END),0)
-            FROM history
-            WHERE chat_id=%s
-            AND TO_CHAR(timestamp,'YYYY')=%s
-        """, (chat_id, year))
-        income, expense = cursor.fetchone()
+        income, expense = storage.totals(chat_id, start, end)
         expense_abs = abs(expense)
         net = income + expense
 
-        cursor.execute("""
-            SELECT TO_CHAR(timestamp,'YYYY-MM'),
-                   COALESCE(SUM(CASE WHEN amount > 0 THEN amount END),0),
-                   COALESCE(SUM(CASE WHEN amount < 0 THEN amount END),0)
-            FROM history
-            WHERE chat_id=%s
-            AND TO_CHAR(timestamp,'YYYY')=%s
-            GROUP BY TO_CHAR(timestamp,'YYYY-MM')
-            ORDER BY 1
-        """, (chat_id, year))
-        monthly = cursor.fetchall()
+        monthly = storage.grouped_totals(chat_id, tz_name, "month", start, end)
 
         text = f"📆 {year} 年统计\n━━━━━━━━━━━━━━━\n\n"
         text += f"收入: {income:,}\n"
@@ -682,67 +786,303 @@ async def summary_callback(update: Update, context: ContextTypes.DEFAULT_TYPE):
         for m, inc, exp in monthly:
             text += f"{m} | 收入 {inc:,} | 支出 {abs(exp):,} | 净额 {(inc+exp):,}\n"
 
-        await query.edit_message_text(text)
+    # ================= 操作人/分类 选择时间段 =================
+    elif action.startswith("summary_breakdown:") and action.count(":") == 1:
+
+        kind = action.split(":")[1]
+
+        months = storage.breakdown_months(chat_id, kind)
+
+        keyboard = [[
+            InlineKeyboardButton("📊 全部", callback_data=f"summary_breakdown:{kind}:all")
+        ]]
+        for y in sorted({m.year for m in months}, reverse=True):
+            keyboard.append([
+                InlineKeyboardButton(f"{y}", callback_data=f"summary_breakdown:{kind}:{y}")
+            ])
+        for m in months[:12]:
+            keyboard.append([
+                InlineKeyboardButton(
+                    m.strftime('%Y-%m'),
+                    callback_data=f"summary_breakdown:{kind}:{m.strftime('%Y-%m')}"
+                )
+            ])
+
+        # 操作人/分类汇总按 UTC 月份预先累计 (history_breakdown)，不跟随群组时区
+        text = "📅 请选择统计时间段 (UTC)："
+        reply_markup = InlineKeyboardMarkup(keyboard)
+
+    # ================= 操作人/分类 排行 =================
+    elif action.startswith("summary_breakdown:"):
+
+        _, kind, period = action.split(":")
+        if kind not in ("user", "tag"):
+            return None, None
+
+        start = end = None
+        if period != "all":
+            if len(period) == 4:
+                start = datetime(int(period), 1, 1)
+                end = datetime(int(period) + 1, 1, 1)
+            else:
+                year, month = map(int, period.split("-"))
+                start = datetime(year, month, 1)
+                end = datetime(*next_month(year, month), 1)
+
+        rows = storage.breakdown_top(chat_id, kind, start, end, limit=10)
+
+        title = "👥 操作人统计" if kind == "user" else "🏷️ 分类统计"
+        text = f"{title} ({'全部' if period == 'all' else period + ' UTC'})\n━━━━━━━━━━━━━━━\n\n"
+
+        if not rows:
+            text += "暂无记录"
+
+        for i, (label, entries, inc, exp) in enumerate(rows, 1):
+            text += f"{i}. {label or '未备注'} | {entries} 笔 | 收入 {inc:,} | 支出 {abs(exp):,}\n"
+
+    return text, reply_markup
+
+# ---------------- find ----------------
+FIND_PAGE_SIZE = 10
+
+# 1–2 个字的关键词 (常见于中文) 无法使用三元组索引，小计只统计最近这么多条记录，
+# 避免每次搜索都扫描群组的全部历史；分页本身不受影响
+FIND_SHORT_KEYWORD_LENGTH = 3
+FIND_TOTALS_SCAN_LIMIT = int(os.getenv("FIND_TOTALS_SCAN_LIMIT", "5000"))
+
+
+async def send_find_page(search, page, reply):
+    """
+    按 id 倒序 keyset 分页，search["cursors"][page] 为该页的起始 id
+    """
+    storage = get_storage()
+    chat_id, keyword = search["chat_id"], search["keyword"]
+    scan_limit = FIND_TOTALS_SCAN_LIMIT if len(keyword) < FIND_SHORT_KEYWORD_LENGTH else None
+
+    def read_page():
+        with storage.read_batch(chat_id):
+            # 首次搜索时统计全部匹配的小计
+            totals = search["totals"]
+            if totals is None:
+                totals = storage.find_totals(
+                    chat_id, keyword, search["start"], search["end"], scan_limit
+                )
+
+            rows = storage.find_page(
+                chat_id, keyword, search["start"], search["end"],
+                search["cursors"][page], FIND_PAGE_SIZE + 1
+            )
+        return totals, rows
+
+    try:
+        search["totals"], rows = await run_storage(read_page)
+    except StorageUnavailable:
+        await reply("❌ 数据库连接失败")
+        return
+
+    count, income, expense = search["totals"]
+
+    # 小计有上限时，更早的记录可能仍有匹配
+    if not rows:
+        await reply(f"🔍 未找到包含「{search['keyword']}」的记录")
+        return
+
+    has_next = len(rows) > FIND_PAGE_SIZE
+    rows = rows[:FIND_PAGE_SIZE]
+
+    text = f"🔍 搜索: {search['keyword']}\n"
+    if search["range_text"]:
+        text += f"📅 {search['range_text']}\n"
+    text += "━━━━━━━━━━━━━━━\n"
+    if scan_limit is not None:
+        text += f"最近 {scan_limit:,} 条记录中：\n"
+    text += f"共 {count} 条 | 收入 {income:,} | 支出 {abs(expense):,} | 净额 {(income + expense):,}\n\n"
+
+    for _, desc, amount, ts in rows:
+        ts = to_local(ts, search["tz_name"])
+        text += f"{ts.year}年{ts.month}月{ts.day}日 {desc} {'+' if amount > 0 else ''}{amount:,}\n"
+
+    text += f"\n第 {page + 1} 页"
+
+    buttons = []
+    if page > 0:
+        buttons.append(InlineKeyboardButton("◀️ 上一页", callback_data=f"find_page:{page - 1}"))
+    if has_next:
+        if len(search["cursors"]) == page + 1:
+            search["cursors"].append(rows[-1][0])
+        buttons.append(InlineKeyboardButton("下一页 ▶️", callback_data=f"find_page:{page + 1}"))
+
+    reply_markup = InlineKeyboardMarkup([buttons]) if buttons else None
+    await reply(text, reply_markup=reply_markup)
+
+
+async def find_cmd(update: Update, context: ContextTypes.DEFAULT_TYPE):
+
+    role = await check_permission(update)
+    if not role:
+        return
+
+    if not await check_rate_limit(update, "report"):
+        return
+
+    # 末尾最多两个 YYYY-MM-DD 为日期，其余部分 (可含空格) 为关键词
+    args = list(context.args or [])
+    date_args = []
+    while args and len(date_args) < 2 and re.fullmatch(r'\d{4}-\d{1,2}-\d{1,2}', args[-1]):
+        date_args.insert(0, args.pop())
+
+    keyword = " ".join(args)
+    if not keyword:
+        await update.message.reply_text(
+            "用法: /find 关键词 [开始日期] [结束日期]\n"
+            "例如: /find 房租 2024-01-01 2024-03-31"
+        )
+        return
+
+    tz_name = await get_chat_timezone(update.effective_chat.id)
+
+    try:
+        dates = [datetime.strptime(d, "%Y-%m-%d").strftime("%Y-%m-%d") for d in date_args]
+    except ValueError:
+        await update.message.reply_text("❌ 日期格式错误，请使用 YYYY-MM-DD")
+        return
+
+    # 日期按群组时区换算为 UTC 范围
+    start = period_bounds(tz_name, dates[0])[0] if len(dates) > 0 else None
+    end = period_bounds(tz_name, dates[1])[1] if len(dates) > 1 else None
+
+    range_text = ""
+    if start:
+        range_text = f"{dates[0]} ~ {dates[1] if end else '至今'}"
+
+    # 搜索条件保存在 chat_data，翻页按钮只携带页码
+    search = {
+        "chat_id": update.effective_chat.id,
+        "keyword": keyword,
+        "start": start,
+        "end": end,
+        "tz_name": tz_name,
+        "range_text": range_text,
+        "totals": None,
+        "cursors": [None],
+    }
+    context.chat_data["find"] = search
+
+    await send_find_page(search, 0, update.message.reply_text)
+
+
+# ---------------- find callback ----------------
+async def find_callback(update: Update, context: ContextTypes.DEFAULT_TYPE):
+
+    query = update.callback_query
+
+    allowed, _ = rate_limiter.check("report", query.message.chat.id, query.from_user.id)
+    if not allowed:
+        await query.answer(RATE_LIMITED_TEXT)
+        return
+
+    await query.answer()
+
+    search = context.chat_data.get("find")
+    page = int(query.data.split(":")[1])
+
+    if not search or page >= len(search["cursors"]):
+        await query.edit_message_text("⌛ 搜索已过期，请重新使用 /find")
+        return
+
+    await send_find_page(search, page, query.edit_message_text)
+
+
+# ---------------- balance ----------------
+async def balance_cmd(update: Update, context: ContextTypes.DEFAULT_TYPE):
+
+    role = await check_permission(update)
+    if not role:
+        return
+
+    if not await check_rate_limit(update, "report"):
+        return
+
+    if not context.args or len(context.args) != 1:
+        await update.message.reply_text(
+            "用法: /balance 日期\n"
+            "例如: /balance 2024-03-31"
+        )
+        return
+
+    try:
+        date = datetime.strptime(context.args[0], "%Y-%m-%d").strftime("%Y-%m-%d")
+    except ValueError:
+        await update.message.reply_text("❌ 日期格式错误，请使用 YYYY-MM-DD")
+        return
+
+    chat_id = update.effective_chat.id
+    tz_name = await get_chat_timezone(chat_id)
+
+    # 当天结束 (群组本地时间) 对应的 UTC 时间
+    boundary = period_bounds(tz_name, date)[1]
+
+    try:
+        balance, income, expense = await run_storage(get_storage().balance_as_of, chat_id, boundary)
+    except StorageUnavailable:
+        await update.message.reply_text("❌ 数据库连接失败")
+        return
+
+    await update.message.reply_text(
+        f"💰 {date} 结束时余额\n"
+        "━━━━━━━━━━━━━━━\n\n"
+        f"累计收入: {income:,}\n"
+        f"累计支出: {abs(expense):,}\n"
+        f"余额: {balance:,}"
+    )
+
 
-    cursor.close()
-    conn.close()
 # ---------------- undo ----------------
 async def undo_cmd(update: Update, context: ContextTypes.DEFAULT_TYPE):
     role = await check_permission(update)
     if not role: return
 
+    if not await check_rate_limit(update, "write"):
+        return
+
     chat_id = update.effective_chat.id
-    conn = get_db_connection()
-    if not conn: 
-        await update.message.reply_text("❌ 数据库连接失败")
+    storage = get_storage()
+
+    # 与记账相同：先回放该群组的暂存记录，否则会撤销到更早的一条
+    spool = get_ledger_spool()
+    if spool.has_pending(chat_id):
+        for replayed_chat in await run_storage(spool.replay):
+            bump_ledger_version(replayed_chat)
+
+    if spool.has_pending(chat_id):
+        await update.message.reply_text("⏳ 还有记录排队等待入账，请稍后再撤销")
         return
-        
-    cursor = conn.cursor()
 
     try:
-        # 1. ค้นหาและดึงข้อมูลรายการล่าสุด "ก่อนที่จะลบ" เพื่อนำมาแสดง
-        cursor.execute("""
-            SELECT id, description, amount, timestamp 
-            FROM history WHERE chat_id = %s 
-            ORDER BY id DESC LIMIT 1
-        """, (chat_id,))
-        last_row_data = cursor.fetchone()
-
+        # 1. ค้นหาและลบรายการล่าสุด (คืนข้อมูล "ก่อนที่จะลบ" เพื่อนำมาแสดง)
+        last_row_data = await run_storage(storage.undo_last, chat_id)
         if not last_row_data:
             await update.message.reply_text("📭 暂无记录可撤销")
             return
 
-        last_id, last_desc, last_amt, last_time = last_row_data
+    except StorageUnavailable:
+        await update.message.reply_text("❌ 数据库连接失败")
+        return
 
-        # 2. ทำการลบรายการ
-        cursor.execute("DELETE FROM history WHERE id = %s", (last_id,))
-        conn.commit()
+    _, last_desc, last_amt, last_time, _ = last_row_data
+    bump_ledger_version(chat_id)
 
-        # 3. ดึงข้อมูลที่เหลือทั้งหมดเพื่อสรุปผลใหม่
-        cursor.execute("""
-            SELECT description, amount, balance_after, timestamp
-            FROM history WHERE chat_id = %s ORDER BY id ASC
-        """, (chat_id,))
-        rows = cursor.fetchall()
-        
-        current_balance = rows[-1][2] if rows else 0
+    # 2. สร้างข้อความแจ้งรายการที่ถูกลบออกไป
+    local_time = to_local(last_time, await get_chat_timezone(chat_id))
+    del_time_str = f"{local_time.month}月{local_time.day}日"
+    del_amt_str = f"{'+' if last_amt > 0 else ''}{last_amt:,}"
 
-        # 4. สร้างข้อความแจ้งรายการที่ถูกลบออกไป
-        m_del = last_time.strftime('%m').lstrip('0')
-        d_del = last_time.strftime('%d').lstrip('0')
-        del_time_str = f"{m_del}月{d_del}日"
-        del_amt_str = f"{'+' if last_amt > 0 else ''}{last_amt:,}"
-        
-        undo_title = f"↩️ **已撤销以下记录：**\n🗑️删除 `{del_time_str} {last_desc} {del_amt_str}`\n"
-        undo_title += "━━━━━━━━━━━━━━━━━━\n"
-        undo_title += "📒 **更新后的汇总如下：**"
-
-        # 5. ส่งแสดงผลสรุปรายเดือนแบบใหม่
-        await send_monthly_formatted_messages(update, rows, current_balance, title=undo_title)
+    undo_title = f"↩️ **已撤销以下记录：**\n🗑️删除 `{del_time_str} {last_desc} {del_amt_str}`\n"
+    undo_title += "━━━━━━━━━━━━━━━━━━\n"
+    undo_title += "📒 **更新后的汇总如下：**"
 
-    finally:
-        cursor.close()
-        conn.close()
+    # 3. ส่งแสดงผลสรุปรายเดือนแบบใหม่
+    await send_monthly_formatted_messages(update, title=undo_title)
 
 
 
@@ -804,28 +1144,27 @@ async def reset_callback(update: Update, context: ContextTypes.DEFAULT_TYPE):
         return
 
     if action == "confirm_reset":
-        conn = get_db_connection()
-        if not conn:
-            await query.edit_message_text("❌ 数据库连接失败")
+        # 与 /undo 相同：先回放暂存记录，否则清空之后它们又会入账
+        spool = get_ledger_spool()
+        if spool.has_pending(chat_id):
+            for replayed_chat in await run_storage(spool.replay):
+                bump_ledger_version(replayed_chat)
+
+        if spool.has_pending(chat_id):
+            await query.edit_message_text("⏳ 还有记录排队等待入账，请稍后再清空")
             return
 
         try:
-            cursor = conn.cursor()
-            cursor.execute(
-                "DELETE FROM history WHERE chat_id = %s",
-                (chat_id,)
-            )
-            conn.commit()
+            await run_storage(get_storage().reset, chat_id)
+            bump_ledger_version(chat_id)
+        except StorageUnavailable:
+            await query.edit_message_text("❌ 数据库连接失败")
+            return
         except Exception as e:
-            conn.rollback()
+            logging.error(f"❌ Reset failed: {e}")
             await query.edit_message_text("❌ 清空失败，请稍后重试")
-            cursor.close()
-            conn.close()
             return
 
-        cursor.close()
-        conn.close()
-
         await query.edit_message_text(
             "🗑️ 已清空所有记录\n\n💰 当前余额: 0"
         )
@@ -850,24 +1189,14 @@ async def daily_report(context: ContextTypes.DEFAULT_TYPE):
 
     chat_id = context.job.chat_id
 
-    conn = get_db_connection()
-    if not conn:
-        return
+    # 群组本地 "今天" 对应的 UTC 时间范围
+    tz_name = await get_chat_timezone(chat_id)
+    start, end = period_bounds(tz_name, local_today(tz_name))
 
-    cursor = conn.cursor()
-
-    cursor.execute("""
-        SELECT 
-            COALESCE(SUM(CASE WHEN amount > 0 THEN amount END),0),
-            COALESCE(SUM(CASE WHEN amount < 0 THEN amount END),0)
-        FROM history
-        WHERE chat_id = %s
-        AND DATE(timestamp) = CURRENT_DATE
-    """, (chat_id,))
-
-    income, expense = cursor.fetchone()
-    cursor.close()
-    conn.close()
+    try:
+        income, expense = await run_storage(get_storage().totals, chat_id, start, end)
+    except StorageUnavailable:
+        return
 
     if income == 0 and expense == 0:
         text = "📅 今日统计\n━━━━━━━━━━━━━━━\n\n今天没有记录"
@@ -883,6 +1212,23 @@ async def daily_report(context: ContextTypes.DEFAULT_TYPE):
 
     await context.bot.send_message(chat_id=chat_id, text=text)
 
+# ---------------- schedule_daily_report ----------------
+def schedule_daily_report(job_queue, chat_id, report_time, tz_name):
+    """
+    按群组时区注册每日报告 (report_time 为 "HH:MM")
+    """
+    time_of_day = datetime.strptime(report_time, "%H:%M").time().replace(
+        tzinfo=ZoneInfo(tz_name)
+    )
+
+    job_queue.run_daily(
+        daily_report,
+        time=time_of_day,
+        chat_id=chat_id,
+        name=str(chat_id),
+        data=report_time
+    )
+
 # ---------------- set_daily_report ----------------
 async def set_daily_report(update: Update, context: ContextTypes.DEFAULT_TYPE):
 
@@ -907,12 +1253,11 @@ async def set_daily_report(update: Update, context: ContextTypes.DEFAULT_TYPE):
     for job in current_jobs:
         job.schedule_removal()
 
-    context.job_queue.run_daily(
-        daily_report,
-        time=datetime.strptime(context.args[0], "%H:%M").time(),
-        chat_id=chat_id,
-        name=str(chat_id)
-    )
+    schedule_daily_report(context.job_queue, chat_id, context.args[0], await get_chat_timezone(chat_id))
+
+    # 保存到 chat_settings，重启后自动恢复
+    if not await run_storage(set_report_time, chat_id, context.args[0]):
+        await update.message.reply_text("⚠️ 数据库连接失败，本次设置在重启后失效")
 
     await update.message.reply_text(
         f"✅ 每日自动报告已设置为 {context.args[0]}"
@@ -935,26 +1280,276 @@ async def stop_daily_report(update: Update, context: ContextTypes.DEFAULT_TYPE):
     for job in jobs:
         job.schedule_removal()
 
+    await run_storage(set_report_time, chat_id, None)
+
     await update.message.reply_text("✅ 已关闭每日自动报告")
 
-# ---------------- MAIN ----------------
-if __name__ == '__main__':
-    init_db()
+# ---------------- timezone ----------------
+async def timezone_cmd(update: Update, context: ContextTypes.DEFAULT_TYPE):
+
+    role = await check_permission(update)
+    if not role:
+        return
+
+    chat_id = update.effective_chat.id
+    user_id = update.effective_user.id
+
+    if not context.args:
+        await update.message.reply_text(
+            f"🕒 当前群组时区: {await get_chat_timezone(chat_id)}\n"
+            "用法: /timezone 时区\n例如: /timezone Asia/Shanghai"
+        )
+        return
+
+    if not await is_owner(chat_id, user_id):
+        await update.message.reply_text("❌ 仅 Owner 可以修改时区")
+        return
+
+    tz_name = context.args[0]
+    if not is_valid_timezone(tz_name):
+        await update.message.reply_text("❌ 无效的时区，例如: Asia/Shanghai, Asia/Bangkok, UTC")
+        return
+
+    if not await run_storage(set_chat_timezone, chat_id, tz_name):
+        await update.message.reply_text("❌ 数据库连接失败")
+        return
+
+    # 月份划分已改变，旧的渲染/统计缓存全部失效
+    bump_ledger_version(chat_id)
+
+    # 已设置的每日报告按新时区重新注册
+    for job in context.job_queue.get_jobs_by_name(str(chat_id)):
+        job.schedule_removal()
+        schedule_daily_report(context.job_queue, chat_id, job.data, tz_name)
+
+    await update.message.reply_text(f"✅ 群组时区已设置为 {tz_name}")
+
+# ---------------- replay_spool ----------------
+async def replay_spool(context: ContextTypes.DEFAULT_TYPE):
+
+    spool = get_ledger_spool()
+
+    # 熔断冷却期间跳过；冷却结束后由回放 / 重试启动载入完成半开试探
+    if get_storage().is_down:
+        return
+
+    if startup_state.ready_at is None:
+        await finish_startup(context.application)
+
+    if not spool.has_pending():
+        return
+
+    for chat_id in await run_storage(spool.replay):
+        # 回放记录可能落在已结束的月份，旧缓存全部失效
+        bump_ledger_version(chat_id)
+
+# ---------------- DASHBOARD (MASTER ONLY) ----------------
+async def dashboard_cmd(update: Update, context: ContextTypes.DEFAULT_TYPE):
+
+    user_id = update.effective_user.id
+
+    # ===== MASTER ONLY =====
+    if str(user_id) != str(MASTER_ADMIN):
+        await update.message.reply_text("❌ 仅 MASTER 可使用此命令")
+        return
+
+    # 后台任务尚未完成第一次刷新
+    if dashboard.snapshot is None and not await run_storage(dashboard.refresh):
+        await update.message.reply_text("❌ 数据库连接失败")
+        return
+
+    await update.message.reply_text(dashboard.render())
+
+
+# ---------------- PROFILE (MASTER ONLY) ----------------
+async def profile_cmd(update: Update, context: ContextTypes.DEFAULT_TYPE):
+
+    user_id = update.effective_user.id
+
+    # ===== MASTER ONLY =====
+    if str(user_id) != str(MASTER_ADMIN):
+        await update.message.reply_text("❌ 仅 MASTER 可使用此命令")
+        return
+
+    try:
+        seconds = int(context.args[0]) if context.args else 30
+    except ValueError:
+        seconds = 0
+
+    if not 1 <= seconds <= PROFILE_MAX_SECONDS:
+        await update.message.reply_text(
+            f"用法: /profile 秒数 (1-{PROFILE_MAX_SECONDS})\n例如: /profile 60"
+        )
+        return
+
+    if not profiler.start(seconds):
+        await update.message.reply_text("⚠️ 性能采样正在进行中")
+        return
+
+    context.job_queue.run_once(
+        finish_profile,
+        when=seconds,
+        chat_id=update.effective_chat.id,
+        name="profile"
+    )
+
+    await update.message.reply_text(f"🔬 已开始性能采样，{seconds} 秒后发送结果")
+
+
+async def finish_profile(context: ContextTypes.DEFAULT_TYPE):
+
+    profiler.stop()
+
+    # 环境变量触发的采样没有目标群组，只写本地文件
+    if PROFILE_OUTPUT_DIR or context.job.chat_id is None:
+        profiler.write_report(PROFILE_OUTPUT_DIR or ".")
+
+    if context.job.chat_id is None:
+        return
 
-    app = Application.builder().token(BOT_TOKEN).build()
+    report = profiler.report().encode("utf-8")
+    busy = profiler.samples - profiler.idle
+
+    await context.bot.send_document(
+        chat_id=context.job.chat_id,
+        document=BytesIO(report),
+        filename=f"profile-{profiler.started_at:%Y%m%d-%H%M%S}.txt",
+        caption=f"🔬 采样 {profiler.samples} 次，其中处理中 {busy} 次"
+    )
+
+
+# ---------------- POST INIT ----------------
+# 启动载入的结果；数据库在启动时不可用则由 replay_spool 定时重试，全部成功后才标记就绪
+warmed_connections = 0
+reports_restored = None
+
+
+def restore_daily_reports(job_queue, schedules):
+    """
+    重新注册已保存的每日报告 (多进程模式下只注册本 worker 负责的群组)
+    """
+    index, count = current_shard()
+    restored = 0
+
+    for chat_id, report_time in schedules:
+        if shard_for(chat_id, count) != index:
+            continue
+        # 重试载入前已经用 /setreport 重新设置过的群组，保留新的设置
+        if job_queue.get_jobs_by_name(str(chat_id)):
+            continue
+        try:
+            # 时区已随 chat_settings 一起载入内存
+            schedule_daily_report(job_queue, chat_id, report_time, chat_timezone(chat_id))
+            restored += 1
+        except ValueError:
+            logging.warning(f"⚠️ Invalid report time for {chat_id}: {report_time!r}")
+
+    return restored
+
+
+async def restore_chat_settings(job_queue):
+    global reports_restored
+
+    schedules = await run_storage(preload_chat_settings)
+    if schedules is None:
+        return False
+
+    reports_restored = restore_daily_reports(job_queue, schedules)
+    return True
+
+
+async def finish_startup(app: Application):
+    """
+    补做启动时因数据库不可用而失败的载入，全部成功后标记就绪
+    """
+    if not assistants_preloaded:
+        await run_storage(preload_assistants)
+    if reports_restored is None:
+        await restore_chat_settings(app.job_queue)
+
+    if not assistants_preloaded or reports_restored is None:
+        return False
+
+    startup_state.mark_ready(
+        pool=warmed_connections,
+        assistants=len(assistant_cache),
+        reports=reports_restored,
+    )
+    return True
+
+
+async def post_init(app: Application):
+    global warmed_connections
+
+    # ===== 启动流程：连接池预热 + 批量载入权限/时区/报告 =====
+    warmed_connections = await run_storage(get_storage().warm)
+    startup_state.step("warm_pool")
+
+    await run_storage(preload_assistants)
+    startup_state.step("assistants")
+
+    await restore_chat_settings(app.job_queue)
+    startup_state.step("chat_settings")
+
+    await subscription_scheduler.start(app.job_queue)
+    startup_state.step("subscriptions")
+
+    app.job_queue.run_repeating(
+        replay_spool,
+        interval=SPOOL_REPLAY_INTERVAL,
+        first=1,
+        name="spool_replay"
+    )
+
+    app.job_queue.run_repeating(
+        rate_limiter.log_stats,
+        interval=RATE_LIMIT_LOG_INTERVAL,
+        name="rate_limit_stats"
+    )
+
+    app.job_queue.run_repeating(
+        dashboard.refresh_job,
+        interval=DASHBOARD_REFRESH_SECONDS,
+        first=1,
+        name="dashboard_refresh"
+    )
+
+    # 环境变量开启：启动后采样一段时间并写入本地文件
+    if PROFILE_SECONDS > 0 and profiler.start(PROFILE_SECONDS):
+        app.job_queue.run_once(finish_profile, when=PROFILE_SECONDS, name="profile")
+
+    if not await finish_startup(app):
+        logging.warning("⚠️ Startup preload incomplete, will retry when the database recovers")
+
+
+# ---------------- BUILD APPLICATION ----------------
+def build_application():
+
+    app = (
+        Application.builder()
+        .token(BOT_TOKEN)
+        .concurrent_updates(ChatOrderedUpdateProcessor())
+        .post_init(post_init)
+        .build()
+    )
 
     # ===== 基础命令 =====
     app.add_handler(CommandHandler(["start", "help"], help_cmd))
     app.add_handler(CommandHandler("check", check_status))
     
     app.add_handler(CommandHandler("summary", summary_cmd))
+    app.add_handler(CommandHandler("find", find_cmd))
+    app.add_handler(CommandHandler("balance", balance_cmd))
     app.add_handler(CommandHandler("undo", undo_cmd))
     app.add_handler(CommandHandler("reset", reset_cmd))
     app.add_handler(CommandHandler("setreport", set_daily_report))
     app.add_handler(CommandHandler("stopreport", stop_daily_report))
+    app.add_handler(CommandHandler("timezone", timezone_cmd))
 
     # ===== Owner 管理命令 =====
     app.add_handler(CommandHandler("adddays", add_days))
+    app.add_handler(CommandHandler("dashboard", dashboard_cmd))
+    app.add_handler(CommandHandler("profile", profile_cmd))
     app.add_handler(CommandHandler("addassistant", add_assistant))
     app.add_handler(CommandHandler("removeassistant", remove_assistant))
 
@@ -971,6 +1566,12 @@ if __name__ == '__main__':
             pattern="^summary_"
         )
     )
+    app.add_handler(
+        CallbackQueryHandler(
+            find_callback,
+            pattern="^find_page:"
+        )
+    )
 
     # ===== 普通文本记账 =====
     app.add_handler(
@@ -983,7 +1584,21 @@ if __name__ == '__main__':
     # ===== 全局错误处理 =====
     app.add_error_handler(error_handler)
 
-    logging.info("🚀 Expense Bot Running...")
-    app.run_polling(
-        drop_pending_updates=True
-    )
+    return app
+
+
+# ---------------- MAIN ----------------
+if __name__ == '__main__':
+    # 表结构版本一致时只有一次查询
+    get_storage().init_schema()
+    startup_state.step("schema")
+
+    if SHARD_WORKERS > 1:
+        run_sharded(BOT_TOKEN, SHARD_WORKERS, build_application)
+    else:
+        app = build_application()
+
+        logging.info("🚀 Expense Bot Running...")
+        app.run_polling(
+            drop_pending_updates=True
+        )
@@ -0,0 +1,499 @@
+import logging
+import threading
+from datetime import timedelta
+from contextlib import contextmanager
+
+import psycopg2
+
+from storage import LedgerStorage, StorageUnavailable
+from database import (
+    init_db,
+    warm_pool,
+    get_db_connection,
+    ReplicaConnection,
+    db_breaker,
+    is_fresh,
+    record_write,
+    execute_prepared,
+    record_entry_aggregates,
+    remove_entry_aggregates,
+    clear_entry_aggregates,
+    balance_as_of,
+    checkpoint_drift,
+    rebuild_checkpoints,
+)
+
+
+# 群组本地时间的分组标签
+_PERIOD_FORMATS = {"day": "YYYY-MM-DD", "month": "YYYY-MM", "year": "YYYY"}
+
+
+def _like_pattern(keyword):
+    escaped = keyword.replace("\\", "\\\\").replace("%", "\\%").replace("_", "\\_")
+    return f"%{escaped}%"
+
+
+# pg_trgm 只能用少于 3 个字符的模式提取出空的三元组集合，GIN 索引对这类
+# 关键词等于全量扫描该群组的索引项。短关键词改写成索引无法匹配的表达式，
+# 让分页查询沿 idx_history_chat_id_id (chat_id, id) 倒序扫描，取满一页即停止
+TRGM_MIN_LENGTH = 3
+
+
+def _description_filter(keyword):
+    if len(keyword) < TRGM_MIN_LENGTH:
+        return "(description || '') ILIKE %s"
+    return "description ILIKE %s"
+
+
+def _range_filter(where, params, start, end):
+    if start:
+        where += " AND timestamp >= %s"
+        params.append(start)
+    if end:
+        where += " AND timestamp < %s"
+        params.append(end)
+    return where, params
+
+
+def _rollback_quietly(conn):
+    # 连接已断开时 rollback 本身也会失败，不能掩盖原来的异常
+    try:
+        conn.rollback()
+    except Exception:
+        pass
+
+
+# 分类按支出排行 (expense 为负数，升序即支出最多的在前)；
+# 操作人按经手金额排行 (收入 + 支出绝对值)
+_BREAKDOWN_ORDER = {
+    "tag": "SUM(expense) ASC, SUM(income) DESC, label",
+    "user": "SUM(income) - SUM(expense) DESC, label",
+}
+
+
+# ================= POSTGRES STORAGE =================
+class PostgresStorage(LedgerStorage):
+    """
+    PostgreSQL 后端：连接池、熔断、只读副本、预编译语句见 database.py
+    """
+
+    name = "postgres"
+
+    def __init__(self):
+        # read_batch 期间的游标、最近一次读取是否可能过时 (按线程隔离)
+        self._local = threading.local()
+
+    @property
+    def last_read_stale(self):
+        return getattr(self._local, "last_read_stale", False)
+
+    @contextmanager
+    def _cursor(self, readonly=False, chat_id=None):
+        """
+        chat_id: 写入后记录该群组的主库 LSN；只读时据此判断副本是否已包含这些写入
+        """
+        batch = getattr(self._local, "batch", None)
+        if readonly and batch is not None:
+            yield batch
+            return
+
+        conn = get_db_connection(readonly=readonly, chat_id=chat_id)
+        if conn is None:
+            raise StorageUnavailable()
+
+        cursor = conn.cursor()
+        try:
+            yield cursor
+            if not readonly:
+                conn.commit()
+                record_write(conn, chat_id)
+
+            # 试探成功 (包括复用池中的连接)：关闭熔断
+            if db_breaker.is_open and not isinstance(conn, ReplicaConnection):
+                db_breaker.success()
+        except (psycopg2.OperationalError, psycopg2.InterfaceError) as e:
+            # 连接中途断开：计入熔断，按数据库不可用处理 (记账会写入暂存文件)
+            db_breaker.failure()
+            logging.error(f"❌ Database connection lost: {e}")
+            _rollback_quietly(conn)
+            raise StorageUnavailable() from e
+        except Exception:
+            _rollback_quietly(conn)
+            raise
+        finally:
+            if readonly:
+                self._local.last_read_stale = not is_fresh(conn)
+            cursor.close()
+            conn.close()
+
+    @contextmanager
+    def read_batch(self, chat_id=None):
+        if getattr(self._local, "batch", None) is not None:
+            yield self
+            return
+
+        with self._cursor(readonly=True, chat_id=chat_id) as cursor:
+            # 必须是事务中的第一条语句：之后的查询看到同一个快照
+            cursor.execute("SET TRANSACTION ISOLATION LEVEL REPEATABLE READ READ ONLY")
+            self._local.batch = cursor
+            try:
+                yield self
+            finally:
+                self._local.batch = None
+
+    # ---------- 生命周期 ----------
+    def init_schema(self):
+        return init_db()
+
+    def warm(self):
+        return warm_pool()
+
+    @property
+    def is_down(self):
+        # 冷却结束后允许一次试探，此时不算 "不可用"
+        return db_breaker.is_open and not db_breaker.probe_due
+
+    # ---------- 权限 ----------
+    def load_assistants(self):
+        with self._cursor() as cursor:
+            cursor.execute("SELECT chat_id, assistant_id FROM assistants")
+            return cursor.fetchall()
+
+    def assistant_exists(self, chat_id, user_id):
+        with self._cursor(readonly=True) as cursor:
+            execute_prepared(cursor, "assistant_exists", (chat_id, user_id))
+            return cursor.fetchone() is not None
+
+    def add_assistant(self, chat_id, owner_id, assistant_id):
+        with self._cursor() as cursor:
+            cursor.execute("""
+                INSERT INTO assistants (chat_id, owner_id, assistant_id)
+                VALUES (%s,%s,%s)
+                ON CONFLICT DO NOTHING
+            """, (chat_id, owner_id, assistant_id))
+
+    def remove_assistant(self, chat_id, assistant_id):
+        with self._cursor() as cursor:
+            cursor.execute("""
+                DELETE FROM assistants
+                WHERE chat_id=%s AND assistant_id=%s
+            """, (chat_id, assistant_id))
+
+    def owner_expiry(self, user_id):
+        with self._cursor(readonly=True) as cursor:
+            execute_prepared(cursor, "owner_expiry", (user_id,))
+            row = cursor.fetchone()
+            return row[0] if row else None
+
+    def set_owner_expiry(self, user_id, expire):
+        with self._cursor() as cursor:
+            cursor.execute("""
+                INSERT INTO users (user_id, expire_date, updated_at)
+                VALUES (%s, %s, LOCALTIMESTAMP)
+                ON CONFLICT (user_id)
+                DO UPDATE SET expire_date=%s, updated_at=LOCALTIMESTAMP
+            """, (user_id, expire, expire))
+
+    def load_subscriptions(self, expire_after=None, updated_after=None):
+        where = "expire_date IS NOT NULL"
+        params = []
+        if expire_after:
+            where += " AND expire_date >= %s"
+            params.append(expire_after)
+        if updated_after:
+            where += " AND updated_at > %s"
+            params.append(updated_after)
+
+        with self._cursor() as cursor:
+            cursor.execute(f"""
+                SELECT user_id, expire_date, notice_state, updated_at
+                FROM users
+                WHERE {where}
+            """, params)
+            return cursor.fetchall()
+
+    def set_notice_state(self, user_id, notice):
+        with self._cursor() as cursor:
+            cursor.execute(
+                "UPDATE users SET notice_state = %s WHERE user_id = %s",
+                (notice, user_id)
+            )
+
+    # ---------- 群组设置 ----------
+    def chat_settings(self, chat_id):
+        with self._cursor() as cursor:
+            cursor.execute(
+                "SELECT timezone, report_time FROM chat_settings WHERE chat_id = %s",
+                (chat_id,)
+            )
+            return cursor.fetchone()
+
+    def load_chat_settings(self):
+        with self._cursor() as cursor:
+            cursor.execute("SELECT chat_id, timezone, report_time FROM chat_settings")
+            return cursor.fetchall()
+
+    def set_chat_timezone(self, chat_id, tz_name):
+        with self._cursor() as cursor:
+            cursor.execute("""
+                INSERT INTO chat_settings (chat_id, timezone)
+                VALUES (%s, %s)
+                ON CONFLICT (chat_id)
+                DO UPDATE SET timezone = EXCLUDED.timezone
+            """, (chat_id, tz_name))
+
+    def set_report_time(self, chat_id, report_time):
+        with self._cursor() as cursor:
+            cursor.execute("""
+                INSERT INTO chat_settings (chat_id, report_time)
+                VALUES (%s, %s)
+                ON CONFLICT (chat_id)
+                DO UPDATE SET report_time = EXCLUDED.report_time
+            """, (chat_id, report_time))
+
+    # ---------- 记账 ----------
+    def add_entry(self, chat_id, amount, description, user_name):
+        with self._cursor(chat_id=chat_id) as cursor:
+            # 获取最后余额
+            execute_prepared(cursor, "last_balance", (chat_id,))
+            last = cursor.fetchone()
+            new_balance = (last[0] if last else 0) + amount
+
+            # 插入新记录
+            execute_prepared(
+                cursor,
+                "insert_entry",
+                (chat_id, amount, description, new_balance, user_name)
+            )
+            entry_id = cursor.fetchone()[0]
+            record_entry_aggregates(cursor, chat_id, entry_id, amount, description, new_balance, user_name)
+
+        return entry_id, new_balance
+
+    def add_spooled_entry(self, chat_id, amount, description, user_name, timestamp, key):
+        with self._cursor(chat_id=chat_id) as cursor:
+            execute_prepared(cursor, "last_balance", (chat_id,))
+            last = cursor.fetchone()
+            new_balance = (last[0] if last else 0) + amount
+
+            execute_prepared(cursor, "insert_spooled_entry", (
+                chat_id, amount, description, new_balance, user_name, timestamp, key
+            ))
+
+            # 没有返回 id 表示此前已回放过
+            inserted = cursor.fetchone()
+            if inserted:
+                record_entry_aggregates(
+                    cursor, chat_id, inserted[0], amount,
+                    description, new_balance, user_name, timestamp
+                )
+
+        return inserted is not None
+
+    def undo_last(self, chat_id):
+        with self._cursor(chat_id=chat_id) as cursor:
+            cursor.execute("""
+                SELECT id, description, amount, timestamp, user_name
+                FROM history WHERE chat_id = %s
+                ORDER BY id DESC LIMIT 1
+            """, (chat_id,))
+            row = cursor.fetchone()
+
+            if row:
+                entry_id, description, amount, timestamp, user_name = row
+                cursor.execute("DELETE FROM history WHERE id = %s", (entry_id,))
+                remove_entry_aggregates(cursor, chat_id, entry_id, amount, description, user_name, timestamp)
+
+        return row
+
+    def reset(self, chat_id):
+        with self._cursor(chat_id=chat_id) as cursor:
+            cursor.execute(
+                "DELETE FROM history WHERE chat_id = %s",
+                (chat_id,)
+            )
+            clear_entry_aggregates(cursor, chat_id)
+
+    # ---------- 查询 ----------
+    def ledger_rows(self, chat_id, since=None):
+        where, params = _range_filter("chat_id = %s", [chat_id], since, None)
+
+        with self._cursor() as cursor:
+            cursor.execute(f"""
+                SELECT description, amount, balance_after, timestamp
+                FROM history WHERE {where} ORDER BY id ASC
+            """, params)
+            return cursor.fetchall()
+
+    def totals(self, chat_id, start=None, end=None):
+        where, params = _range_filter("chat_id = %s", [chat_id], start, end)
+
+        with self._cursor(readonly=True, chat_id=chat_id) as cursor:
+            cursor.execute(f"""
+                SELECT
+                    COALESCE(SUM(CASE WHEN amount > 0 THEN amount END),0),
+                    COALESCE(SUM(CASE WHEN amount < 0 THEN amount END),0)
+                FROM history
+                WHERE {where}
+            """, params)
+            return cursor.fetchone()
+
+    def grouped_totals(self, chat_id, tz_name, unit, start=None, end=None, descending=False):
+        where, params = _range_filter("chat_id = %s", [chat_id], start, end)
+
+        with self._cursor(readonly=True, chat_id=chat_id) as cursor:
+            cursor.execute(f"""
+                SELECT TO_CHAR(timestamp AT TIME ZONE 'UTC' AT TIME ZONE %s, '{_PERIOD_FORMATS[unit]}'),
+                       COALESCE(SUM(CASE WHEN amount > 0 THEN amount END),0),
+                       COALESCE(SUM(CASE WHEN amount < 0 THEN amount END),0)
+                FROM history
+                WHERE {where}
+                GROUP BY 1
+                ORDER BY 1 {'DESC' if descending else ''}
+            """, [tz_name] + params)
+            return cursor.fetchall()
+
+    def periods(self, chat_id, tz_name, unit, limit=None):
+        with self._cursor(readonly=True, chat_id=chat_id) as cursor:
+            cursor.execute(f"""
+                SELECT DISTINCT TO_CHAR(timestamp AT TIME ZONE 'UTC' AT TIME ZONE %s, '{_PERIOD_FORMATS[unit]}')
+                FROM history
+                WHERE chat_id = %s
+                ORDER BY 1 DESC
+                LIMIT %s
+            """, (tz_name, chat_id, limit))
+            return [r[0] for r in cursor.fetchall()]
+
+    def breakdown_months(self, chat_id, kind):
+        with self._cursor(readonly=True, chat_id=chat_id) as cursor:
+            cursor.execute("""
+                SELECT DISTINCT month
+                FROM history_breakdown
+                WHERE chat_id = %s AND kind = %s
+                ORDER BY month DESC
+            """, (chat_id, kind))
+            return [r[0] for r in cursor.fetchall()]
+
+    def breakdown_top(self, chat_id, kind, start=None, end=None, limit=10):
+        where = "chat_id = %s AND kind = %s"
+        params = [chat_id, kind]
+
+        if start:
+            where += " AND month >= %s AND month < %s"
+            params += [start, end]
+
+        with self._cursor(readonly=True, chat_id=chat_id) as cursor:
+            cursor.execute(f"""
+                SELECT label, SUM(entries), SUM(income), SUM(expense)
+                FROM history_breakdown
+                WHERE {where}
+                GROUP BY label
+                ORDER BY {_BREAKDOWN_ORDER[kind]}
+                LIMIT %s
+            """, params + [limit])
+            return cursor.fetchall()
+
+    def find_totals(self, chat_id, keyword, start=None, end=None, scan_limit=None):
+        # 短关键词 (少于 TRGM_MIN_LENGTH) 无法使用三元组索引，合计需扫描该群组全部记录；
+        # 调用方用 scan_limit 限定为沿 (chat_id, timestamp) 索引倒序读取的最近若干条
+        if scan_limit is not None:
+            where, params = _range_filter("chat_id = %s", [chat_id], start, end)
+            source = f"""(
+                SELECT amount, description FROM history
+                WHERE {where}
+                ORDER BY chat_id DESC, timestamp DESC
+                LIMIT %s
+            ) recent"""
+            where = _description_filter(keyword)
+            params += [scan_limit, _like_pattern(keyword)]
+        else:
+            source = "history"
+            where, params = _range_filter(
+                "chat_id = %s AND " + _description_filter(keyword),
+                [chat_id, _like_pattern(keyword)],
+                start, end
+            )
+
+        with self._cursor(readonly=True, chat_id=chat_id) as cursor:
+            cursor.execute(f"""
+                SELECT COUNT(*),
+                       COALESCE(SUM(CASE WHEN amount > 0 THEN amount END),0),
+                       COALESCE(SUM(CASE WHEN amount < 0 THEN amount END),0)
+                FROM {source}
+                WHERE {where}
+            """, params)
+            return cursor.fetchone()
+
+    def find_page(self, chat_id, keyword, start, end, before_id, limit):
+        where, params = _range_filter(
+            "chat_id = %s AND " + _description_filter(keyword),
+            [chat_id, _like_pattern(keyword)],
+            start, end
+        )
+        if before_id is not None:
+            where += " AND id < %s"
+            params.append(before_id)
+
+        with self._cursor(readonly=True, chat_id=chat_id) as cursor:
+            cursor.execute(f"""
+                SELECT id, description, amount, timestamp
+                FROM history
+                WHERE {where}
+                ORDER BY chat_id DESC, id DESC
+                LIMIT %s
+            """, params + [limit])
+            return cursor.fetchall()
+
+    def balance_as_of(self, chat_id, boundary):
+        with self._cursor(readonly=True, chat_id=chat_id) as cursor:
+            return balance_as_of(cursor, chat_id, boundary)
+
+    # ---------- 维护 / 看板 ----------
+    def checkpoint_drift(self, chat_id=None):
+        with self._cursor() as cursor:
+            return checkpoint_drift(cursor, chat_id)
+
+    def rebuild_checkpoints(self, chat_id=None):
+        with self._cursor(chat_id=chat_id) as cursor:
+            rebuild_checkpoints(cursor, chat_id)
+
+    def dashboard_stats(self, now, days, top):
+        with self._cursor(readonly=True) as cursor:
+            cursor.execute("SELECT COUNT(*), COALESCE(SUM(entries), 0) FROM chat_stats")
+            chats, entries = cursor.fetchone()
+
+            # last_entry_at 有索引，只扫描活跃群组
+            cursor.execute("""
+                SELECT
+                    COUNT(*) FILTER (WHERE last_entry_at >= %s),
+                    COUNT(*)
+                FROM chat_stats
+                WHERE last_entry_at >= %s
+            """, (now - timedelta(days=1), now - timedelta(days=7)))
+            active_1d, active_7d = cursor.fetchone()
+
+            cursor.execute("""
+                SELECT day, SUM(entries), COUNT(*)
+                FROM daily_stats
+                WHERE day > %s
+                GROUP BY day
+                ORDER BY day DESC
+            """, (now.date() - timedelta(days=days),))
+            daily = cursor.fetchall()
+
+            cursor.execute("""
+                SELECT chat_id, entries, balance, last_entry_at
+                FROM chat_stats
+                ORDER BY entries DESC
+                LIMIT %s
+            """, (top,))
+            largest = cursor.fetchall()
+
+        return {
+            "chats": chats,
+            "entries": entries,
+            "active_1d": active_1d,
+            "active_7d": active_7d,
+            "daily": daily,
+            "largest": largest,
+        }
@@ -0,0 +1,168 @@
+import os
+import sys
+import time
+import logging
+import threading
+from collections import Counter
+from datetime import datetime
+
+from sharding import current_shard
+
+
+# ================= CONFIG =================
+# 启动后自动采样的秒数 (0 = 关闭)，结果写入 PROFILE_OUTPUT_DIR
+PROFILE_SECONDS = int(os.getenv("PROFILE_SECONDS", "0"))
+PROFILE_OUTPUT_DIR = os.getenv("PROFILE_OUTPUT_DIR", "")
+
+# 采样间隔 (毫秒)，单次采样只读取一次事件循环线程的栈
+PROFILE_INTERVAL_MS = float(os.getenv("PROFILE_INTERVAL_MS", "5"))
+PROFILE_MAX_SECONDS = int(os.getenv("PROFILE_MAX_SECONDS", "300"))
+
+PROFILE_TOP_FUNCTIONS = 30
+
+# 事件循环空闲 (等待网络) 时停留的函数
+_IDLE_FRAMES = {("selectors.py", "select"), ("selectors.py", "poll")}
+
+
+# ================= SAMPLING PROFILER =================
+class SamplingProfiler:
+    """
+    采样分析器：后台线程定时读取事件循环线程的调用栈并累计次数
+    不修改被分析代码，也不使用 sys.setprofile，开销只与采样频率有关
+    """
+
+    def __init__(self, interval_ms=PROFILE_INTERVAL_MS):
+        self.interval = interval_ms / 1000
+
+        self._thread = None
+        self._stop = threading.Event()
+        self._target = None
+
+        self.started_at = None
+        self.stopped_at = None
+        self.samples = 0
+        self.idle = 0
+
+        # 折叠后的调用栈 "a;b;c" -> 次数
+        self.stacks = Counter()
+
+    @property
+    def running(self):
+        return self._thread is not None and self._thread.is_alive()
+
+    def start(self, seconds):
+        """
+        在事件循环线程中调用，最多采样 seconds 秒
+        """
+        if self.running:
+            return False
+
+        self._target = threading.get_ident()
+        self._stop.clear()
+        self.stacks = Counter()
+        self.samples = 0
+        self.idle = 0
+        self.started_at = datetime.utcnow()
+        self.stopped_at = None
+
+        deadline = time.monotonic() + seconds
+        self._thread = threading.Thread(
+            target=self._run, args=(deadline,), name="profiler", daemon=True
+        )
+        self._thread.start()
+
+        logging.info(f"🔬 Profiler started for {seconds}s")
+        return True
+
+    def stop(self):
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join()
+            self._thread = None
+
+    def _run(self, deadline):
+        while not self._stop.is_set() and time.monotonic() < deadline:
+            frame = sys._current_frames().get(self._target)
+            if frame is not None:
+                self._sample(frame)
+            self._stop.wait(self.interval)
+
+        self.stopped_at = datetime.utcnow()
+
+    def _sample(self, frame):
+        self.samples += 1
+
+        code = frame.f_code
+        if (os.path.basename(code.co_filename), code.co_name) in _IDLE_FRAMES:
+            self.idle += 1
+            return
+
+        stack = []
+        while frame is not None:
+            code = frame.f_code
+            stack.append(f"{os.path.basename(code.co_filename)}:{code.co_name}:{code.co_firstlineno}")
+            frame = frame.f_back
+
+        self.stacks[";".join(reversed(stack))] += 1
+
+    # ---------- 报告 ----------
+    def collapsed(self):
+        """
+        flamegraph.pl / speedscope 可直接读取的折叠栈格式
+        """
+        return "\n".join(
+            f"{stack} {count}" for stack, count in self.stacks.most_common()
+        ) + "\n"
+
+    def top_functions(self, limit=PROFILE_TOP_FUNCTIONS):
+        own = Counter()
+        total = Counter()
+
+        for stack, count in self.stacks.items():
+            frames = stack.split(";")
+            own[frames[-1]] += count
+            # 递归调用只计一次
+            for name in set(frames):
+                total[name] += count
+
+        busy = sum(self.stacks.values()) or 1
+        lines = [f"{'self%':>7} {'total%':>7} {'samples':>8}  function"]
+        for name, count in own.most_common(limit):
+            lines.append(
+                f"{count * 100 / busy:6.1f}% {total[name] * 100 / busy:6.1f}% {count:8d}  {name}"
+            )
+        return "\n".join(lines) + "\n"
+
+    def report(self):
+        index, count = current_shard()
+        busy = self.samples - self.idle
+        stopped_at = self.stopped_at or datetime.utcnow()
+
+        header = (
+            f"# profile {self.started_at:%Y-%m-%d %H:%M:%S} ~ {stopped_at:%H:%M:%S} UTC"
+            f" shard {index}/{count} pid {os.getpid()}\n"
+            f"# samples {self.samples}, busy {busy}, idle {self.idle},"
+            f" interval {self.interval * 1000:g}ms\n"
+        )
+
+        return (
+            header
+            + "\n# ---------------- top functions ----------------\n"
+            + self.top_functions()
+            + "\n# ---------------- collapsed stacks ----------------\n"
+            + self.collapsed()
+        )
+
+    def write_report(self, directory=PROFILE_OUTPUT_DIR):
+        os.makedirs(directory, exist_ok=True)
+        path = os.path.join(
+            directory, f"profile-{self.started_at:%Y%m%d-%H%M%S}-{os.getpid()}.txt"
+        )
+        with open(path, "w", encoding="utf-8") as f:
+            f.write(self.report())
+
+        logging.info(f"🔬 Profile written to {path}")
+        return path
+
+
+profiler = SamplingProfiler()
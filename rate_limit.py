@@ -0,0 +1,109 @@
+import os
+import time
+import logging
+from collections import Counter, OrderedDict
+
+
+# ================= CONFIG =================
+# 格式 "次数/秒数"，例如 "30/60" = 每 60 秒最多 30 次 (允许突发)
+def _parse_limit(value):
+    count, seconds = value.split("/")
+    return float(count), float(seconds)
+
+
+RATE_LIMITS = {
+    ("write", "user"): _parse_limit(os.getenv("RATE_LIMIT_WRITE_USER", "30/60")),
+    ("write", "chat"): _parse_limit(os.getenv("RATE_LIMIT_WRITE_CHAT", "120/60")),
+    ("report", "user"): _parse_limit(os.getenv("RATE_LIMIT_REPORT_USER", "20/60")),
+    ("report", "chat"): _parse_limit(os.getenv("RATE_LIMIT_REPORT_CHAT", "60/60")),
+}
+
+RATE_LIMIT_TABLE_SIZE = int(os.getenv("RATE_LIMIT_TABLE_SIZE", "50000"))
+RATE_LIMIT_LOG_INTERVAL = int(os.getenv("RATE_LIMIT_LOG_INTERVAL", "300"))
+
+
+# ================= TOKEN BUCKET =================
+class TokenBucket:
+
+    __slots__ = ("tokens", "updated", "notified")
+
+    def __init__(self, capacity, now):
+        self.tokens = capacity
+        self.updated = now
+        self.notified = 0.0
+
+    def refill(self, capacity, period, now):
+        self.tokens = min(capacity, self.tokens + (now - self.updated) * capacity / period)
+        self.updated = now
+
+
+# ================= RATE LIMITER =================
+class RateLimiter:
+    """
+    按用户、按群组的令牌桶限流，全部在内存中完成，不访问数据库
+    """
+
+    def __init__(self, limits=RATE_LIMITS, table_size=RATE_LIMIT_TABLE_SIZE):
+        self.limits = limits
+        self.table_size = table_size
+
+        # (kind, scope, id) -> TokenBucket
+        self._buckets = OrderedDict()
+
+        # (kind, scope) -> 被限流次数
+        self.hits = Counter()
+
+    def _bucket(self, key, capacity, now):
+        bucket = self._buckets.get(key)
+
+        if bucket is None:
+            bucket = TokenBucket(capacity, now)
+            self._buckets[key] = bucket
+            if len(self._buckets) > self.table_size:
+                self._buckets.popitem(last=False)
+        else:
+            self._buckets.move_to_end(key)
+
+        return bucket
+
+    def check(self, kind, chat_id, user_id):
+        """
+        返回 (是否允许, 是否需要提示用户)
+        同一个桶每个周期只提示一次，避免限流提示本身刷屏
+        """
+        now = time.monotonic()
+        buckets = []
+
+        for scope, ident in (("user", user_id), ("chat", chat_id)):
+            capacity, period = self.limits[(kind, scope)]
+            bucket = self._bucket((kind, scope, ident), capacity, now)
+            bucket.refill(capacity, period, now)
+
+            if bucket.tokens < 1:
+                self.hits[(kind, scope)] += 1
+
+                notify = now - bucket.notified >= period
+                if notify:
+                    bucket.notified = now
+                return False, notify
+
+            buckets.append(bucket)
+
+        # 两个桶都有余量时才同时扣减
+        for bucket in buckets:
+            bucket.tokens -= 1
+
+        return True, False
+
+    def stats(self):
+        return dict(self.hits)
+
+    async def log_stats(self, context):
+        if self.hits:
+            logging.info(
+                "📉 Rate limit hits: "
+                + ", ".join(f"{kind}/{scope}={count}" for (kind, scope), count in sorted(self.hits.items()))
+            )
+
+
+rate_limiter = RateLimiter()
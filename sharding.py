@@ -0,0 +1,181 @@
+import os
+import zlib
+import asyncio
+import logging
+import multiprocessing
+from queue import Full
+
+from telegram import Bot, Update
+
+
+# ================= CONFIG =================
+SHARD_WORKERS = int(os.getenv("SHARD_WORKERS", "1"))
+SHARD_QUEUE_SIZE = int(os.getenv("SHARD_QUEUE_SIZE", "1000"))
+POLL_TIMEOUT = 30
+
+# 队列满时每等待这么久检查一次 worker 是否还活着
+SHARD_PUT_TIMEOUT = float(os.getenv("SHARD_PUT_TIMEOUT", "5"))
+
+
+# ================= SHARD ROUTING =================
+def shard_for(chat_id, worker_count):
+    """
+    按 chat_id 稳定哈希分配 worker (重启后结果不变)
+    """
+    if worker_count <= 1:
+        return 0
+    return zlib.crc32(str(chat_id).encode()) % worker_count
+
+
+def current_shard():
+    """
+    当前进程的 (shard_index, shard_count)，单进程模式为 (0, 1)
+    """
+    return (
+        int(os.getenv("SHARD_INDEX", "0")),
+        int(os.getenv("SHARD_COUNT", "1"))
+    )
+
+
+# ================= WORKER =================
+def _worker_main(index, worker_count, queue, build_application):
+
+    os.environ["SHARD_INDEX"] = str(index)
+    os.environ["SHARD_COUNT"] = str(worker_count)
+
+    logging.basicConfig(
+        format=f'%(asctime)s - worker{index} - %(name)s - %(levelname)s - %(message)s',
+        level=logging.INFO
+    )
+
+    try:
+        asyncio.run(_worker_loop(queue, build_application()))
+    except KeyboardInterrupt:
+        pass
+
+
+async def _worker_loop(queue, app):
+
+    loop = asyncio.get_running_loop()
+
+    async with app:
+        if app.post_init:
+            await app.post_init(app)
+
+        await app.start()
+        logging.info(f"🚀 Shard worker {os.getenv('SHARD_INDEX')} running")
+
+        try:
+            while True:
+                data = await loop.run_in_executor(None, queue.get)
+                if data is None:
+                    break
+                await app.update_queue.put(Update.de_json(data, app.bot))
+        finally:
+            await app.stop()
+
+
+# ================= FRONT PROCESS =================
+class ShardSupervisor:
+    """
+    前端进程：拉取更新 -> 按群组路由到 worker，并在 worker 退出时自动重启
+    """
+
+    def __init__(self, token, worker_count, build_application):
+        self.token = token
+        self.worker_count = worker_count
+        self.build_application = build_application
+
+        self._ctx = multiprocessing.get_context("spawn")
+        self.queues = [
+            self._ctx.Queue(maxsize=SHARD_QUEUE_SIZE)
+            for _ in range(worker_count)
+        ]
+        self.processes = [None] * worker_count
+
+    def _start_worker(self, index):
+        proc = self._ctx.Process(
+            target=_worker_main,
+            args=(index, self.worker_count, self.queues[index], self.build_application),
+            name=f"shard-worker-{index}",
+            daemon=True
+        )
+        proc.start()
+        self.processes[index] = proc
+        logging.info(f"✅ Shard worker {index} started (pid={proc.pid})")
+
+    def supervise(self):
+        for index, proc in enumerate(self.processes):
+            if proc is None:
+                self._start_worker(index)
+            elif not proc.is_alive():
+                logging.error(f"❌ Shard worker {index} exited ({proc.exitcode}), restarting")
+                self._start_worker(index)
+
+    async def route(self, update):
+        chat = update.effective_chat
+        index = shard_for(chat.id if chat else 0, self.worker_count)
+
+        data = update.to_dict()
+
+        # 队列满时阻塞，形成背压；超时说明 worker 可能已退出，检查并重启后继续等待
+        while True:
+            try:
+                await asyncio.to_thread(self.queues[index].put, data, True, SHARD_PUT_TIMEOUT)
+                return
+            except Full:
+                logging.warning(f"⚠️ Shard worker {index} queue full")
+                self.supervise()
+
+    async def run(self):
+
+        self.supervise()
+
+        async with Bot(self.token) as bot:
+            await bot.delete_webhook(drop_pending_updates=True)
+
+            offset = None
+            while True:
+                self.supervise()
+
+                try:
+                    updates = await bot.get_updates(
+                        offset=offset,
+                        timeout=POLL_TIMEOUT,
+                        read_timeout=POLL_TIMEOUT + 10,
+                        allowed_updates=Update.ALL_TYPES
+                    )
+                except Exception as e:
+                    logging.error(f"❌ get_updates failed: {e}")
+                    await asyncio.sleep(1)
+                    continue
+
+                for update in updates:
+                    offset = update.update_id + 1
+                    await self.route(update)
+
+    def stop(self):
+        for queue in self.queues:
+            try:
+                queue.put_nowait(None)
+            except Exception:
+                pass
+
+        for proc in self.processes:
+            if proc is not None:
+                proc.join(timeout=10)
+                if proc.is_alive():
+                    proc.terminate()
+
+
+def run_sharded(token, worker_count, build_application):
+
+    supervisor = ShardSupervisor(token, worker_count, build_application)
+
+    logging.info(f"🚀 Expense Bot Running with {worker_count} shard workers...")
+    try:
+        asyncio.run(supervisor.run())
+    except KeyboardInterrupt:
+        pass
+    finally:
+        supervisor.stop()
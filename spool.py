@@ -0,0 +1,158 @@
+import os
+import json
+import uuid
+import logging
+import threading
+from datetime import datetime
+
+from storage import get_storage, StorageUnavailable
+from sharding import current_shard
+
+
+# ================= CONFIG =================
+SPOOL_PATH = os.getenv("SPOOL_PATH", "ledger_spool.jsonl")
+SPOOL_REPLAY_INTERVAL = int(os.getenv("SPOOL_REPLAY_INTERVAL", "15"))
+
+# 永久失败 (数据库拒绝该记录) 的暂存记录移到这里，不再阻塞后面的回放
+DEAD_LETTER_SUFFIX = ".dead"
+
+
+# ================= LEDGER SPOOL =================
+class LedgerSpool:
+    """
+    数据库不可用时的本地追加写文件 (每行一条 JSON)
+    数据库恢复后按写入顺序回放，idempotency_key 保证不会重复入账
+    """
+
+    def __init__(self, path):
+        self.path = path
+
+        # 追加与回放可能同时在不同的存储线程中执行
+        self._lock = threading.RLock()
+
+        # 有待回放记录的群组
+        self._pending_chats = set(entry["chat_id"] for entry in self._read())
+
+    def _read(self):
+        if not os.path.exists(self.path):
+            return []
+
+        entries = []
+        with open(self.path, encoding="utf-8") as f:
+            for line in f:
+                try:
+                    entries.append(json.loads(line))
+                except ValueError:
+                    # 崩溃时写了一半的最后一行
+                    logging.warning(f"⚠️ Skipping corrupt spool line: {line!r}")
+        return entries
+
+    def has_pending(self, chat_id=None):
+        if chat_id is None:
+            return bool(self._pending_chats)
+        return chat_id in self._pending_chats
+
+    def append(self, chat_id, amount, description, user_name):
+        entry = {
+            "key": uuid.uuid4().hex,
+            "chat_id": chat_id,
+            "amount": amount,
+            "description": description,
+            "user_name": user_name,
+            "timestamp": datetime.utcnow().isoformat(),
+        }
+
+        with self._lock:
+            with open(self.path, "a", encoding="utf-8") as f:
+                f.write(json.dumps(entry, ensure_ascii=False) + "\n")
+                f.flush()
+                os.fsync(f.fileno())
+
+            self._pending_chats.add(chat_id)
+        return entry
+
+    def replay(self):
+        """
+        回放全部暂存记录，返回已入账的 chat_id 集合
+        数据库不可用时停止，剩余记录保留在文件中等待下次回放；
+        其它错误视为该记录本身无法入账，移到死信文件后继续
+        """
+        with self._lock:
+            return self._replay()
+
+    def _replay(self):
+        entries = self._read()
+        if not entries:
+            self._pending_chats.clear()
+            return set()
+
+        storage = get_storage()
+        done = 0
+        dead = []
+        replayed_chats = set()
+
+        for entry in entries:
+            try:
+                # key 已存在表示此前已回放过，不重复入账
+                storage.add_spooled_entry(
+                    entry["chat_id"],
+                    entry["amount"],
+                    entry["description"],
+                    entry["user_name"],
+                    datetime.fromisoformat(entry["timestamp"]),
+                    entry["key"],
+                )
+            except StorageUnavailable:
+                break
+            except Exception as e:
+                logging.error(f"❌ Spool entry {entry.get('key')} moved to dead letter: {e}")
+                dead.append(entry)
+            else:
+                replayed_chats.add(entry["chat_id"])
+            done += 1
+
+        if not done:
+            return set()
+
+        if dead:
+            self._write_dead(dead)
+
+        self._rewrite(entries[done:])
+        logging.info(f"✅ Spool replayed {done - len(dead)}/{len(entries)} entries")
+        return replayed_chats
+
+    def _write_dead(self, entries):
+        with open(self.path + DEAD_LETTER_SUFFIX, "a", encoding="utf-8") as f:
+            for entry in entries:
+                f.write(json.dumps(entry, ensure_ascii=False) + "\n")
+            f.flush()
+            os.fsync(f.fileno())
+
+    def _rewrite(self, remaining):
+        tmp_path = self.path + ".tmp"
+
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            for entry in remaining:
+                f.write(json.dumps(entry, ensure_ascii=False) + "\n")
+            f.flush()
+            os.fsync(f.fileno())
+
+        os.replace(tmp_path, self.path)
+        self._pending_chats = set(entry["chat_id"] for entry in remaining)
+
+
+def _shard_spool_path():
+    # 多进程模式下每个 worker 使用自己的暂存文件
+    index, count = current_shard()
+    return SPOOL_PATH if count <= 1 else f"{SPOOL_PATH}.{index}"
+
+
+_ledger_spool = None
+
+
+def get_ledger_spool():
+    # 延迟创建：worker 进程启动后才知道自己的 shard 编号
+    global _ledger_spool
+    if _ledger_spool is None:
+        _ledger_spool = LedgerSpool(_shard_spool_path())
+    return _ledger_spool
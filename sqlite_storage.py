@@ -0,0 +1,917 @@
+import os
+import logging
+import sqlite3
+import threading
+from functools import lru_cache
+from contextlib import contextmanager
+from datetime import date, datetime, timedelta, timezone
+from zoneinfo import ZoneInfo
+
+from storage import LedgerStorage, StorageUnavailable
+
+
+# ================= CONFIG =================
+SQLITE_PATH = os.getenv("SQLITE_PATH", "ledger.db")
+SQLITE_BUSY_TIMEOUT_MS = int(os.getenv("SQLITE_BUSY_TIMEOUT_MS", "5000"))
+
+# 与 database.SCHEMA_VERSION 含义相同，修改下方表结构时 +1
+SQLITE_SCHEMA_VERSION = 2
+
+
+# ================= TYPES =================
+# 时间统一存为定长 UTC 文本，字符串顺序即时间顺序，范围查询可走索引
+def _adapt_datetime(value):
+    return value.strftime("%Y-%m-%d %H:%M:%S.%f")
+
+
+def _convert_timestamp(value):
+    return datetime.fromisoformat(value.decode())
+
+
+def _convert_date(value):
+    return date.fromisoformat(value.decode()[:10])
+
+
+sqlite3.register_adapter(datetime, _adapt_datetime)
+sqlite3.register_adapter(date, date.isoformat)
+sqlite3.register_converter("TIMESTAMP", _convert_timestamp)
+sqlite3.register_converter("DATE", _convert_date)
+
+
+# ================= TIMEZONE FUNCTION =================
+# 代替 Postgres 的 AT TIME ZONE + TO_CHAR：UTC 文本 -> 群组本地日/月/年标签
+_PERIOD_FORMATS = {"day": "%Y-%m-%d", "month": "%Y-%m", "year": "%Y"}
+_PERIOD_LENGTHS = {"day": 10, "month": 7, "year": 4}
+
+
+@lru_cache(maxsize=None)
+def _zone(tz_name):
+    return ZoneInfo(tz_name)
+
+
+def _local_period(ts, tz_name, unit):
+    if ts is None:
+        return None
+    local = datetime.fromisoformat(ts).replace(tzinfo=timezone.utc).astimezone(_zone(tz_name))
+    return local.strftime(_PERIOD_FORMATS[unit])
+
+
+def _period_sql(tz_name, unit):
+    # UTC 群组直接截取字符串，不调用 Python 函数
+    if tz_name == "UTC":
+        return f"substr(timestamp, 1, {_PERIOD_LENGTHS[unit]})", []
+    return "local_period(timestamp, ?, ?)", [tz_name, unit]
+
+
+def _like_pattern(keyword):
+    escaped = keyword.replace("\\", "\\\\").replace("%", "\\%").replace("_", "\\_")
+    return f"%{escaped}%"
+
+
+def _range_filter(where, params, start, end):
+    if start:
+        where += " AND timestamp >= ?"
+        params.append(start)
+    if end:
+        where += " AND timestamp < ?"
+        params.append(end)
+    return where, params
+
+
+def _month_start(value):
+    return date(value.year, value.month, 1)
+
+
+def _next_month_start(month):
+    return date(month.year + 1, 1, 1) if month.month == 12 else date(month.year, month.month + 1, 1)
+
+
+def _rollback_quietly(conn):
+    # 出现 I/O 错误时 SQLite 可能已自动回滚，再次 ROLLBACK 会报错，不能掩盖原来的异常
+    try:
+        if conn.in_transaction:
+            conn.execute("ROLLBACK")
+    except sqlite3.Error:
+        pass
+
+
+# ================= SCHEMA =================
+# 与 database.init_db 相同的表与索引 (无 pg_trgm；/find 使用 LIKE)
+_SCHEMA = [
+    """
+    CREATE TABLE IF NOT EXISTS users (
+        user_id INTEGER PRIMARY KEY,
+        expire_date TIMESTAMP,
+        notice_state TEXT,
+        updated_at TIMESTAMP
+    )
+    """,
+    # AUTOINCREMENT：与 SERIAL 一样 id 不会被撤销后重用 (检查点与 /find 游标依赖)
+    """
+    CREATE TABLE IF NOT EXISTS history (
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        chat_id INTEGER NOT NULL,
+        amount INTEGER NOT NULL,
+        description TEXT,
+        balance_after INTEGER NOT NULL,
+        user_name TEXT,
+        timestamp TIMESTAMP NOT NULL,
+        idempotency_key TEXT
+    )
+    """,
+    """
+    CREATE TABLE IF NOT EXISTS assistants (
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        chat_id INTEGER NOT NULL,
+        owner_id INTEGER NOT NULL,
+        assistant_id INTEGER NOT NULL,
+        UNIQUE(chat_id, assistant_id)
+    )
+    """,
+    """
+    CREATE TABLE IF NOT EXISTS chat_settings (
+        chat_id INTEGER PRIMARY KEY,
+        timezone TEXT,
+        report_time TEXT
+    )
+    """,
+    """
+    CREATE TABLE IF NOT EXISTS history_breakdown (
+        chat_id INTEGER NOT NULL,
+        kind TEXT NOT NULL,
+        month DATE NOT NULL,
+        label TEXT NOT NULL,
+        entries INTEGER NOT NULL DEFAULT 0,
+        income INTEGER NOT NULL DEFAULT 0,
+        expense INTEGER NOT NULL DEFAULT 0,
+        PRIMARY KEY (chat_id, kind, month, label)
+    )
+    """,
+    """
+    CREATE TABLE IF NOT EXISTS balance_checkpoints (
+        chat_id INTEGER NOT NULL,
+        month DATE NOT NULL,
+        balance INTEGER NOT NULL,
+        income INTEGER NOT NULL,
+        expense INTEGER NOT NULL,
+        last_id INTEGER NOT NULL,
+        PRIMARY KEY (chat_id, month)
+    )
+    """,
+    """
+    CREATE TABLE IF NOT EXISTS chat_stats (
+        chat_id INTEGER PRIMARY KEY,
+        entries INTEGER NOT NULL DEFAULT 0,
+        balance INTEGER NOT NULL DEFAULT 0,
+        last_entry_at TIMESTAMP
+    )
+    """,
+    """
+    CREATE TABLE IF NOT EXISTS daily_stats (
+        day DATE NOT NULL,
+        chat_id INTEGER NOT NULL,
+        entries INTEGER NOT NULL DEFAULT 0,
+        income INTEGER NOT NULL DEFAULT 0,
+        expense INTEGER NOT NULL DEFAULT 0,
+        PRIMARY KEY (day, chat_id)
+    )
+    """,
+    "CREATE INDEX IF NOT EXISTS idx_assistants_chat_id ON assistants(chat_id)",
+    "CREATE UNIQUE INDEX IF NOT EXISTS idx_history_idempotency_key ON history(idempotency_key)",
+    "CREATE INDEX IF NOT EXISTS idx_history_chat_timestamp ON history(chat_id, timestamp)",
+    "CREATE INDEX IF NOT EXISTS idx_history_chat_id_id ON history(chat_id, id)",
+    "CREATE INDEX IF NOT EXISTS idx_chat_stats_last_entry_at ON chat_stats(last_entry_at)",
+    "CREATE INDEX IF NOT EXISTS idx_chat_stats_entries ON chat_stats(entries)",
+    """
+    CREATE TABLE IF NOT EXISTS schema_version (
+        version INTEGER NOT NULL,
+        applied_at TIMESTAMP
+    )
+    """,
+]
+
+
+_EXPECTED_CHECKPOINTS_SQL = """
+    WITH months AS (
+        SELECT chat_id,
+               substr(timestamp, 1, 7) || '-01' AS month,
+               COALESCE(SUM(CASE WHEN amount > 0 THEN amount END), 0) AS income,
+               COALESCE(SUM(CASE WHEN amount < 0 THEN amount END), 0) AS expense,
+               MAX(id) AS last_id
+        FROM history
+        {chat_filter}
+        GROUP BY 1, 2
+    ),
+    cumulative AS (
+        SELECT chat_id, month,
+               SUM(income) OVER w AS income,
+               SUM(expense) OVER w AS expense,
+               MAX(last_id) OVER w AS last_id
+        FROM months
+        WINDOW w AS (PARTITION BY chat_id ORDER BY month)
+    )
+    SELECT c.chat_id, c.month, h.balance_after, c.income, c.expense, c.last_id
+    FROM cumulative c
+    JOIN history h ON h.id = c.last_id
+"""
+
+
+# 分类按支出排行 (expense 为负数，升序即支出最多的在前)；
+# 操作人按经手金额排行 (收入 + 支出绝对值)
+_BREAKDOWN_ORDER = {
+    "tag": "SUM(expense) ASC, SUM(income) DESC, label",
+    "user": "SUM(income) - SUM(expense) DESC, label",
+}
+
+
+# ================= SQLITE STORAGE =================
+class SQLiteStorage(LedgerStorage):
+    """
+    嵌入式 SQLite 后端 (WAL 模式)，适合单机部署与本地测试
+    单个连接 + 锁；汇总表维护逻辑与 database.py 中的 Postgres 版本一致
+    """
+
+    name = "sqlite"
+
+    def __init__(self, path=SQLITE_PATH):
+        self.path = path
+        self._conn = None
+        self._lock = threading.RLock()
+
+    def _connection(self):
+        if self._conn is not None:
+            return self._conn
+
+        try:
+            conn = sqlite3.connect(
+                self.path,
+                isolation_level=None,
+                check_same_thread=False,
+                detect_types=sqlite3.PARSE_DECLTYPES | sqlite3.PARSE_COLNAMES,
+            )
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            conn.execute(f"PRAGMA busy_timeout={SQLITE_BUSY_TIMEOUT_MS}")
+            conn.create_function("local_period", 3, _local_period, deterministic=True)
+        except sqlite3.Error as e:
+            logging.error(f"❌ SQLite open failed: {e}")
+            raise StorageUnavailable() from e
+
+        self._conn = conn
+        return conn
+
+    @contextmanager
+    def _transaction(self):
+        with self._lock:
+            conn = self._connection()
+            cursor = conn.cursor()
+            try:
+                # 立即取得写锁，多进程同时写入时在 busy_timeout 内排队
+                cursor.execute("BEGIN IMMEDIATE")
+                yield cursor
+                cursor.execute("COMMIT")
+            except sqlite3.OperationalError as e:
+                # 等锁超时 (database is locked)、磁盘 I/O 错误等：与 Postgres 连接失败相同处理
+                logging.error(f"❌ SQLite unavailable: {e}")
+                _rollback_quietly(conn)
+                raise StorageUnavailable() from e
+            except Exception:
+                _rollback_quietly(conn)
+                raise
+            finally:
+                cursor.close()
+
+    @contextmanager
+    def _reader(self):
+        with self._lock:
+            cursor = self._connection().cursor()
+            try:
+                yield cursor
+            except sqlite3.OperationalError as e:
+                logging.error(f"❌ SQLite unavailable: {e}")
+                raise StorageUnavailable() from e
+            finally:
+                cursor.close()
+
+    @contextmanager
+    def read_batch(self, chat_id=None):
+        with self._lock:
+            conn = self._connection()
+            if conn.in_transaction:
+                yield self
+                return
+
+            # WAL 模式下读事务内的查询看到同一个快照
+            try:
+                conn.execute("BEGIN")
+            except sqlite3.OperationalError as e:
+                logging.error(f"❌ SQLite unavailable: {e}")
+                raise StorageUnavailable() from e
+
+            try:
+                yield self
+            finally:
+                # 只读事务：结束时 ROLLBACK 与 COMMIT 等价，且不会因 I/O 错误再抛异常
+                _rollback_quietly(conn)
+
+    def close(self):
+        with self._lock:
+            if self._conn is not None:
+                self._conn.close()
+                self._conn = None
+
+    # ---------- 生命周期 ----------
+    def init_schema(self):
+        with self._transaction() as cursor:
+            cursor.execute(
+                "SELECT name FROM sqlite_master WHERE type = 'table' AND name = 'schema_version'"
+            )
+            if cursor.fetchone():
+                cursor.execute("SELECT MAX(version) FROM schema_version")
+                if cursor.fetchone()[0] == SQLITE_SCHEMA_VERSION:
+                    logging.info(f"✅ SQLite schema v{SQLITE_SCHEMA_VERSION} up to date ({self.path})")
+                    return True
+
+            for ddl in _SCHEMA:
+                cursor.execute(ddl)
+
+            # v1 -> v2: users.updated_at (CREATE TABLE IF NOT EXISTS 不会给旧表加列)
+            cursor.execute("PRAGMA table_info(users)")
+            if "updated_at" not in {row[1] for row in cursor.fetchall()}:
+                cursor.execute("ALTER TABLE users ADD COLUMN updated_at TIMESTAMP")
+            cursor.execute("CREATE INDEX IF NOT EXISTS idx_users_updated_at ON users(updated_at)")
+
+            cursor.execute("DELETE FROM schema_version")
+            cursor.execute(
+                "INSERT INTO schema_version (version, applied_at) VALUES (?, ?)",
+                (SQLITE_SCHEMA_VERSION, datetime.utcnow())
+            )
+
+        logging.info(f"✅ SQLite initialized (schema v{SQLITE_SCHEMA_VERSION}, {self.path})")
+        return True
+
+    def warm(self):
+        self._connection()
+        return 1
+
+    # ---------- 权限 ----------
+    def load_assistants(self):
+        with self._reader() as cursor:
+            cursor.execute("SELECT chat_id, assistant_id FROM assistants")
+            return cursor.fetchall()
+
+    def assistant_exists(self, chat_id, user_id):
+        with self._reader() as cursor:
+            cursor.execute(
+                "SELECT 1 FROM assistants WHERE chat_id = ? AND assistant_id = ?",
+                (chat_id, user_id)
+            )
+            return cursor.fetchone() is not None
+
+    def add_assistant(self, chat_id, owner_id, assistant_id):
+        with self._transaction() as cursor:
+            cursor.execute("""
+                INSERT INTO assistants (chat_id, owner_id, assistant_id)
+                VALUES (?, ?, ?)
+                ON CONFLICT DO NOTHING
+            """, (chat_id, owner_id, assistant_id))
+
+    def remove_assistant(self, chat_id, assistant_id):
+        with self._transaction() as cursor:
+            cursor.execute(
+                "DELETE FROM assistants WHERE chat_id = ? AND assistant_id = ?",
+                (chat_id, assistant_id)
+            )
+
+    def owner_expiry(self, user_id):
+        with self._reader() as cursor:
+            cursor.execute("SELECT expire_date FROM users WHERE user_id = ?", (user_id,))
+            row = cursor.fetchone()
+            return row[0] if row else None
+
+    def set_owner_expiry(self, user_id, expire):
+        with self._transaction() as cursor:
+            cursor.execute("""
+                INSERT INTO users (user_id, expire_date, updated_at)
+                VALUES (?, ?, ?)
+                ON CONFLICT (user_id)
+                DO UPDATE SET expire_date = excluded.expire_date, updated_at = excluded.updated_at
+            """, (user_id, expire, datetime.utcnow()))
+
+    def load_subscriptions(self, expire_after=None, updated_after=None):
+        where = "expire_date IS NOT NULL"
+        params = []
+        if expire_after:
+            where += " AND expire_date >= ?"
+            params.append(expire_after)
+        if updated_after:
+            where += " AND updated_at > ?"
+            params.append(updated_after)
+
+        with self._reader() as cursor:
+            cursor.execute(f"""
+                SELECT user_id, expire_date, notice_state, updated_at
+                FROM users
+                WHERE {where}
+            """, params)
+            return cursor.fetchall()
+
+    def set_notice_state(self, user_id, notice):
+        with self._transaction() as cursor:
+            cursor.execute(
+                "UPDATE users SET notice_state = ? WHERE user_id = ?",
+                (notice, user_id)
+            )
+
+    # ---------- 群组设置 ----------
+    def chat_settings(self, chat_id):
+        with self._reader() as cursor:
+            cursor.execute(
+                "SELECT timezone, report_time FROM chat_settings WHERE chat_id = ?",
+                (chat_id,)
+            )
+            return cursor.fetchone()
+
+    def load_chat_settings(self):
+        with self._reader() as cursor:
+            cursor.execute("SELECT chat_id, timezone, report_time FROM chat_settings")
+            return cursor.fetchall()
+
+    def set_chat_timezone(self, chat_id, tz_name):
+        with self._transaction() as cursor:
+            cursor.execute("""
+                INSERT INTO chat_settings (chat_id, timezone)
+                VALUES (?, ?)
+                ON CONFLICT (chat_id)
+                DO UPDATE SET timezone = excluded.timezone
+            """, (chat_id, tz_name))
+
+    def set_report_time(self, chat_id, report_time):
+        with self._transaction() as cursor:
+            cursor.execute("""
+                INSERT INTO chat_settings (chat_id, report_time)
+                VALUES (?, ?)
+                ON CONFLICT (chat_id)
+                DO UPDATE SET report_time = excluded.report_time
+            """, (chat_id, report_time))
+
+    # ---------- 记账 ----------
+    def _insert_entry(self, cursor, chat_id, amount, description, user_name, timestamp, key=None):
+        cursor.execute(
+            "SELECT balance_after FROM history WHERE chat_id = ? ORDER BY id DESC LIMIT 1",
+            (chat_id,)
+        )
+        last = cursor.fetchone()
+        new_balance = (last[0] if last else 0) + amount
+
+        cursor.execute("""
+            INSERT INTO history (chat_id, amount, description, balance_after, user_name, timestamp, idempotency_key)
+            VALUES (?, ?, ?, ?, ?, ?, ?)
+            ON CONFLICT (idempotency_key) DO NOTHING
+        """, (chat_id, amount, description, new_balance, user_name, timestamp, key))
+
+        if not cursor.rowcount:
+            return None, new_balance
+
+        entry_id = cursor.lastrowid
+        _record_aggregates(cursor, chat_id, entry_id, amount, description, new_balance, user_name, timestamp)
+        return entry_id, new_balance
+
+    def add_entry(self, chat_id, amount, description, user_name):
+        with self._transaction() as cursor:
+            return self._insert_entry(
+                cursor, chat_id, amount, description, user_name, datetime.utcnow()
+            )
+
+    def add_spooled_entry(self, chat_id, amount, description, user_name, timestamp, key):
+        with self._transaction() as cursor:
+            entry_id, _ = self._insert_entry(
+                cursor, chat_id, amount, description, user_name, timestamp, key
+            )
+        return entry_id is not None
+
+    def undo_last(self, chat_id):
+        with self._transaction() as cursor:
+            cursor.execute("""
+                SELECT id, description, amount, timestamp, user_name
+                FROM history WHERE chat_id = ?
+                ORDER BY id DESC LIMIT 1
+            """, (chat_id,))
+            row = cursor.fetchone()
+
+            if row:
+                entry_id, description, amount, timestamp, user_name = row
+                cursor.execute("DELETE FROM history WHERE id = ?", (entry_id,))
+                _remove_aggregates(cursor, chat_id, amount, description, user_name, timestamp)
+
+        return row
+
+    def reset(self, chat_id):
+        with self._transaction() as cursor:
+            cursor.execute("DELETE FROM history WHERE chat_id = ?", (chat_id,))
+            for table in ("history_breakdown", "balance_checkpoints", "chat_stats", "daily_stats"):
+                cursor.execute(f"DELETE FROM {table} WHERE chat_id = ?", (chat_id,))
+
+    # ---------- 查询 ----------
+    def ledger_rows(self, chat_id, since=None):
+        where, params = _range_filter("chat_id = ?", [chat_id], since, None)
+
+        with self._reader() as cursor:
+            cursor.execute(f"""
+                SELECT description, amount, balance_after, timestamp
+                FROM history WHERE {where} ORDER BY id ASC
+            """, params)
+            return cursor.fetchall()
+
+    def totals(self, chat_id, start=None, end=None):
+        where, params = _range_filter("chat_id = ?", [chat_id], start, end)
+
+        with self._reader() as cursor:
+            cursor.execute(f"""
+                SELECT
+                    COALESCE(SUM(CASE WHEN amount > 0 THEN amount END),0),
+                    COALESCE(SUM(CASE WHEN amount < 0 THEN amount END),0)
+                FROM history
+                WHERE {where}
+            """, params)
+            return cursor.fetchone()
+
+    def grouped_totals(self, chat_id, tz_name, unit, start=None, end=None, descending=False):
+        label, label_params = _period_sql(tz_name, unit)
+        where, params = _range_filter("chat_id = ?", [chat_id], start, end)
+
+        with self._reader() as cursor:
+            cursor.execute(f"""
+                SELECT {label},
+                       COALESCE(SUM(CASE WHEN amount > 0 THEN amount END),0),
+                       COALESCE(SUM(CASE WHEN amount < 0 THEN amount END),0)
+                FROM history
+                WHERE {where}
+                GROUP BY 1
+                ORDER BY 1 {'DESC' if descending else ''}
+            """, label_params + params)
+            return cursor.fetchall()
+
+    def periods(self, chat_id, tz_name, unit, limit=None):
+        label, label_params = _period_sql(tz_name, unit)
+
+        with self._reader() as cursor:
+            cursor.execute(f"""
+                SELECT DISTINCT {label}
+                FROM history
+                WHERE chat_id = ?
+                ORDER BY 1 DESC
+                LIMIT ?
+            """, label_params + [chat_id, -1 if limit is None else limit])
+            return [r[0] for r in cursor.fetchall()]
+
+    def breakdown_months(self, chat_id, kind):
+        with self._reader() as cursor:
+            cursor.execute("""
+                SELECT DISTINCT month
+                FROM history_breakdown
+                WHERE chat_id = ? AND kind = ?
+                ORDER BY month DESC
+            """, (chat_id, kind))
+            return [r[0] for r in cursor.fetchall()]
+
+    def breakdown_top(self, chat_id, kind, start=None, end=None, limit=10):
+        where = "chat_id = ? AND kind = ?"
+        params = [chat_id, kind]
+
+        if start:
+            where += " AND month >= ? AND month < ?"
+            params += [start.date() if isinstance(start, datetime) else start,
+                       end.date() if isinstance(end, datetime) else end]
+
+        with self._reader() as cursor:
+            cursor.execute(f"""
+                SELECT label, SUM(entries), SUM(income), SUM(expense)
+                FROM history_breakdown
+                WHERE {where}
+                GROUP BY label
+                ORDER BY {_BREAKDOWN_ORDER[kind]}
+                LIMIT ?
+            """, params + [limit])
+            return cursor.fetchall()
+
+    def find_totals(self, chat_id, keyword, start=None, end=None, scan_limit=None):
+        if scan_limit is not None:
+            where, params = _range_filter("chat_id = ?", [chat_id], start, end)
+            source = f"""(
+                SELECT amount, description FROM history
+                WHERE {where}
+                ORDER BY timestamp DESC
+                LIMIT ?
+            )"""
+            where = "description LIKE ? ESCAPE '\\'"
+            params += [scan_limit, _like_pattern(keyword)]
+        else:
+            source = "history"
+            where, params = _range_filter(
+                "chat_id = ? AND description LIKE ? ESCAPE '\\'",
+                [chat_id, _like_pattern(keyword)],
+                start, end
+            )
+
+        with self._reader() as cursor:
+            cursor.execute(f"""
+                SELECT COUNT(*),
+                       COALESCE(SUM(CASE WHEN amount > 0 THEN amount END),0),
+                       COALESCE(SUM(CASE WHEN amount < 0 THEN amount END),0)
+                FROM {source}
+                WHERE {where}
+            """, params)
+            return cursor.fetchone()
+
+    def find_page(self, chat_id, keyword, start, end, before_id, limit):
+        where, params = _range_filter(
+            "chat_id = ? AND description LIKE ? ESCAPE '\\'",
+            [chat_id, _like_pattern(keyword)],
+            start, end
+        )
+        if before_id is not None:
+            where += " AND id < ?"
+            params.append(before_id)
+
+        with self._reader() as cursor:
+            cursor.execute(f"""
+                SELECT id, description, amount, timestamp
+                FROM history
+                WHERE {where}
+                ORDER BY id DESC
+                LIMIT ?
+            """, params + [limit])
+            return cursor.fetchall()
+
+    def balance_as_of(self, chat_id, boundary):
+        month_start = _month_start(boundary)
+
+        with self._reader() as cursor:
+            # boundary 恰好是月初时整月都已结束，直接使用上月检查点
+            checkpoint = _latest_checkpoint(cursor, chat_id, before_month=month_start)
+            _, balance, income, expense, last_id = checkpoint if checkpoint else (None, 0, 0, 0, 0)
+
+            start = datetime(month_start.year, month_start.month, 1)
+            cursor.execute("""
+                SELECT COALESCE(SUM(CASE WHEN amount > 0 THEN amount END), 0),
+                       COALESCE(SUM(CASE WHEN amount < 0 THEN amount END), 0)
+                FROM history
+                WHERE chat_id = ? AND timestamp >= ? AND timestamp < ?
+            """, (chat_id, start, boundary))
+            month_income, month_expense = cursor.fetchone()
+
+            cursor.execute("""
+                SELECT id, balance_after FROM history
+                WHERE chat_id = ? AND timestamp >= ? AND timestamp < ?
+                ORDER BY id DESC LIMIT 1
+            """, (chat_id, start, boundary))
+            month_last = cursor.fetchone()
+
+        if month_last and month_last[0] > last_id:
+            balance = month_last[1]
+
+        return balance, income + month_income, expense + month_expense
+
+    # ---------- 维护 / 看板 ----------
+    def checkpoint_drift(self, chat_id=None):
+        chat_filter = "WHERE chat_id = :chat_id" if chat_id is not None else ""
+
+        with self._reader() as cursor:
+            cursor.execute(_EXPECTED_CHECKPOINTS_SQL.format(chat_filter=chat_filter), {"chat_id": chat_id})
+            expected = {
+                (row[0], date.fromisoformat(row[1])): tuple(row[2:])
+                for row in cursor.fetchall()
+            }
+
+            cursor.execute(f"""
+                SELECT chat_id, month, balance, income, expense, last_id
+                FROM balance_checkpoints
+                {chat_filter}
+            """, {"chat_id": chat_id})
+            stored = {(row[0], row[1]): tuple(row[2:]) for row in cursor.fetchall()}
+
+        return [
+            (key[0], key[1], stored.get(key, (None,) * 4), expected.get(key, (None,) * 4))
+            for key in sorted(set(stored) | set(expected))
+            if stored.get(key) != expected.get(key)
+        ]
+
+    def rebuild_checkpoints(self, chat_id=None):
+        with self._transaction() as cursor:
+            _rebuild_checkpoints(cursor, chat_id)
+
+    def dashboard_stats(self, now, days, top):
+        with self._reader() as cursor:
+            cursor.execute("SELECT COUNT(*), COALESCE(SUM(entries), 0) FROM chat_stats")
+            chats, entries = cursor.fetchone()
+
+            cursor.execute("""
+                SELECT
+                    COALESCE(SUM(CASE WHEN last_entry_at >= ? THEN 1 END), 0),
+                    COUNT(*)
+                FROM chat_stats
+                WHERE last_entry_at >= ?
+            """, (now - timedelta(days=1), now - timedelta(days=7)))
+            active_1d, active_7d = cursor.fetchone()
+
+            cursor.execute("""
+                SELECT day AS "day [DATE]", SUM(entries), COUNT(*)
+                FROM daily_stats
+                WHERE day > ?
+                GROUP BY day
+                ORDER BY day DESC
+            """, (now.date() - timedelta(days=days),))
+            daily = cursor.fetchall()
+
+            cursor.execute("""
+                SELECT chat_id, entries, balance, last_entry_at
+                FROM chat_stats
+                ORDER BY entries DESC
+                LIMIT ?
+            """, (top,))
+            largest = cursor.fetchall()
+
+        return {
+            "chats": chats,
+            "entries": entries,
+            "active_1d": active_1d,
+            "active_7d": active_7d,
+            "daily": daily,
+            "largest": largest,
+        }
+
+
+# ================= AGGREGATES =================
+# 与 database.py 中 record/remove_entry_aggregates 相同的维护规则
+
+def _record_aggregates(cursor, chat_id, entry_id, amount, description, balance_after, user_name, timestamp):
+    month = _month_start(timestamp)
+    income = amount if amount > 0 else 0
+    expense = amount if amount < 0 else 0
+
+    _upsert_breakdown(cursor, chat_id, month, user_name, description, 1, income, expense)
+    _record_checkpoint(cursor, chat_id, month, entry_id, income, expense, balance_after)
+
+    # 新记录的 id 最大，balance_after 就是当前余额 (回放的旧记录也一样)
+    cursor.execute("""
+        INSERT INTO chat_stats (chat_id, entries, balance, last_entry_at)
+        VALUES (?, 1, ?, ?)
+        ON CONFLICT (chat_id) DO UPDATE SET
+            entries = entries + 1,
+            balance = excluded.balance,
+            last_entry_at = MAX(last_entry_at, excluded.last_entry_at)
+    """, (chat_id, balance_after, timestamp))
+
+    cursor.execute("""
+        INSERT INTO daily_stats (day, chat_id, entries, income, expense)
+        VALUES (?, ?, 1, ?, ?)
+        ON CONFLICT (day, chat_id) DO UPDATE SET
+            entries = entries + 1,
+            income = income + excluded.income,
+            expense = expense + excluded.expense
+    """, (timestamp.date(), chat_id, income, expense))
+
+
+def _remove_aggregates(cursor, chat_id, amount, description, user_name, timestamp):
+    month = _month_start(timestamp)
+    income = amount if amount > 0 else 0
+    expense = amount if amount < 0 else 0
+
+    _upsert_breakdown(cursor, chat_id, month, user_name, description, -1, -income, -expense)
+    cursor.execute(
+        "DELETE FROM history_breakdown WHERE chat_id = ? AND month = ? AND entries <= 0",
+        (chat_id, month)
+    )
+
+    _recompute_checkpoint(cursor, chat_id, month)
+
+    # 撤销的是最后一条记录，余额与最后时间取剩余记录
+    cursor.execute("""
+        UPDATE chat_stats SET
+            entries = entries - 1,
+            balance = COALESCE((
+                SELECT balance_after FROM history
+                WHERE chat_id = :chat_id ORDER BY id DESC LIMIT 1
+            ), 0),
+            last_entry_at = (
+                SELECT MAX(timestamp) FROM history WHERE chat_id = :chat_id
+            )
+        WHERE chat_id = :chat_id
+    """, {"chat_id": chat_id})
+    cursor.execute("DELETE FROM chat_stats WHERE chat_id = ? AND entries <= 0", (chat_id,))
+
+    cursor.execute("""
+        UPDATE daily_stats SET
+            entries = entries - 1,
+            income = income - ?,
+            expense = expense - ?
+        WHERE day = ? AND chat_id = ?
+    """, (income, expense, timestamp.date(), chat_id))
+    cursor.execute(
+        "DELETE FROM daily_stats WHERE day = ? AND chat_id = ? AND entries <= 0",
+        (timestamp.date(), chat_id)
+    )
+
+
+def _upsert_breakdown(cursor, chat_id, month, user_name, description, entries, income, expense):
+    # 分类标签 = 备注的第一个词 (与 database.description_tag 一致)
+    tag = (description or "").split(" ")[0]
+
+    for kind, label in (("user", user_name or "未知"), ("tag", tag)):
+        cursor.execute("""
+            INSERT INTO history_breakdown (chat_id, kind, month, label, entries, income, expense)
+            VALUES (?, ?, ?, ?, ?, ?, ?)
+            ON CONFLICT (chat_id, kind, month, label) DO UPDATE SET
+                entries = entries + excluded.entries,
+                income = income + excluded.income,
+                expense = expense + excluded.expense
+        """, (chat_id, kind, month, label, entries, income, expense))
+
+
+def _latest_checkpoint(cursor, chat_id, before_month=None):
+    cursor.execute("""
+        SELECT month, balance, income, expense, last_id
+        FROM balance_checkpoints
+        WHERE chat_id = ? AND month < ?
+        ORDER BY month DESC LIMIT 1
+    """, (chat_id, before_month or date.max))
+    return cursor.fetchone()
+
+
+def _record_checkpoint(cursor, chat_id, month, entry_id, income, expense, balance_after):
+
+    latest = _latest_checkpoint(cursor, chat_id)
+
+    # 记录落在更早的月份 (例如回放暂存记录)，后续检查点全部重算
+    if latest and latest[0] > month:
+        _rebuild_checkpoints(cursor, chat_id)
+        return
+
+    if latest and latest[0] == month:
+        cursor.execute("""
+            UPDATE balance_checkpoints
+            SET balance = ?, income = income + ?, expense = expense + ?, last_id = ?
+            WHERE chat_id = ? AND month = ?
+        """, (balance_after, income, expense, entry_id, chat_id, month))
+    else:
+        cursor.execute("""
+            INSERT INTO balance_checkpoints (chat_id, month, balance, income, expense, last_id)
+            VALUES (?, ?, ?, ?, ?, ?)
+        """, (
+            chat_id, month, balance_after,
+            (latest[2] if latest else 0) + income,
+            (latest[3] if latest else 0) + expense,
+            entry_id
+        ))
+
+
+def _recompute_checkpoint(cursor, chat_id, month):
+
+    latest = _latest_checkpoint(cursor, chat_id)
+    if latest and latest[0] > month:
+        _rebuild_checkpoints(cursor, chat_id)
+        return
+
+    prev = _latest_checkpoint(cursor, chat_id, before_month=month)
+    cursor.execute("DELETE FROM balance_checkpoints WHERE chat_id = ? AND month = ?", (chat_id, month))
+
+    start = datetime(month.year, month.month, 1)
+    end = datetime(*_next_month_start(month).timetuple()[:3])
+    cursor.execute("""
+        SELECT COUNT(*),
+               COALESCE(SUM(CASE WHEN amount > 0 THEN amount END), 0),
+               COALESCE(SUM(CASE WHEN amount < 0 THEN amount END), 0),
+               MAX(id)
+        FROM history
+        WHERE chat_id = ? AND timestamp >= ? AND timestamp < ?
+    """, (chat_id, start, end))
+    entries, income, expense, month_last_id = cursor.fetchone()
+
+    if not entries:
+        return
+
+    last_id = max(month_last_id, prev[4] if prev else 0)
+    cursor.execute("SELECT balance_after FROM history WHERE id = ?", (last_id,))
+    balance = cursor.fetchone()[0]
+
+    cursor.execute("""
+        INSERT INTO balance_checkpoints (chat_id, month, balance, income, expense, last_id)
+        VALUES (?, ?, ?, ?, ?, ?)
+    """, (
+        chat_id, month, balance,
+        (prev[2] if prev else 0) + income,
+        (prev[3] if prev else 0) + expense,
+        last_id
+    ))
+
+
+def _rebuild_checkpoints(cursor, chat_id=None):
+    chat_filter = "WHERE chat_id = :chat_id" if chat_id is not None else ""
+
+    cursor.execute(f"DELETE FROM balance_checkpoints {chat_filter}", {"chat_id": chat_id})
+    cursor.execute(
+        "INSERT INTO balance_checkpoints (chat_id, month, balance, income, expense, last_id) "
+        + _EXPECTED_CHECKPOINTS_SQL.format(chat_filter=chat_filter),
+        {"chat_id": chat_id}
+    )
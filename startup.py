@@ -0,0 +1,71 @@
+import os
+import json
+import time
+import logging
+
+from sharding import current_shard
+
+
+# ================= CONFIG =================
+# 就绪后写入的文件 (供部署脚本 / 健康检查判断)，为空则不写
+READY_FILE = os.getenv("READY_FILE", "")
+
+# 进程启动时间 (多进程模式下为各 worker 自己的启动时间)
+STARTED_AT = time.monotonic()
+
+
+# ================= READINESS =================
+class StartupState:
+    """
+    记录启动各阶段耗时、就绪时间与第一条更新的处理完成时间
+    """
+
+    def __init__(self):
+        self.steps = []
+        self.ready_at = None
+        self.first_update_at = None
+        self._step_started = STARTED_AT
+
+    def step(self, name):
+        now = time.monotonic()
+        self.steps.append((name, now - self._step_started))
+        self._step_started = now
+
+    def mark_ready(self, **details):
+        self.ready_at = time.monotonic()
+        elapsed = self.ready_at - STARTED_AT
+
+        timings = ", ".join(f"{name}={seconds * 1000:.0f}ms" for name, seconds in self.steps)
+        logging.info(f"✅ Ready in {elapsed:.2f}s ({timings})")
+
+        if READY_FILE:
+            self._write_ready_file(elapsed, details)
+
+    def _write_ready_file(self, elapsed, details):
+        index, count = current_shard()
+        path = READY_FILE if count <= 1 else f"{READY_FILE}.{index}"
+
+        with open(path, "w", encoding="utf-8") as f:
+            json.dump({
+                "pid": os.getpid(),
+                "shard": index,
+                "ready_seconds": round(elapsed, 3),
+                "steps": {name: round(seconds, 3) for name, seconds in self.steps},
+                **details,
+            }, f)
+
+    def note_update(self):
+        if self.first_update_at is not None:
+            return
+
+        self.first_update_at = time.monotonic()
+        since_ready = (
+            f", {self.first_update_at - self.ready_at:.2f}s after ready"
+            if self.ready_at is not None else ""
+        )
+        logging.info(
+            f"⏱️ First update handled {self.first_update_at - STARTED_AT:.2f}s after start{since_ready}"
+        )
+
+
+startup_state = StartupState()
@@ -0,0 +1,275 @@
+import os
+import asyncio
+import functools
+from abc import ABC, abstractmethod
+from contextlib import contextmanager
+from concurrent.futures import ThreadPoolExecutor
+
+
+# ================= CONFIG =================
+# postgres (默认，DATABASE_URL) 或 sqlite (单机部署，SQLITE_PATH)
+STORAGE_BACKEND = os.getenv("STORAGE_BACKEND", "postgres").lower()
+
+# 执行存储调用的线程数 (Postgres 部署不要超过 DB_POOL_SIZE)
+STORAGE_THREADS = int(os.getenv("STORAGE_THREADS", "8"))
+
+
+class StorageUnavailable(Exception):
+    """
+    存储暂时不可用 (无法连接 / 熔断打开)
+    调用方按原来 "❌ 数据库连接失败" 的方式处理
+    """
+
+
+# ================= STORAGE INTERFACE =================
+class LedgerStorage(ABC):
+    """
+    账本存储接口：处理函数只调用这些方法，不再直接写 SQL
+    时间参数与返回值均为 UTC naive datetime
+    """
+
+    name = None
+
+    # 当前线程最近一次只读查询是否可能缺少本群组已提交的写入 (是则结果不写入缓存)
+    last_read_stale = False
+
+    # ---------- 生命周期 ----------
+    @abstractmethod
+    def init_schema(self):
+        """
+        建表/迁移 (版本一致时跳过)，返回表结构是否可用
+        """
+        raise NotImplementedError
+
+    @abstractmethod
+    def warm(self):
+        """
+        启动预热，返回预先建立的连接数
+        """
+        raise NotImplementedError
+
+    @property
+    def is_down(self):
+        """
+        当前会直接拒绝连接 (熔断打开且冷却未结束)；冷却结束后返回 False，允许试探
+        """
+        return False
+
+    @contextmanager
+    def read_batch(self, chat_id=None):
+        """
+        其中的只读查询共用同一个连接和快照 (同一页报表的几次查询结果一致)
+        块内不能写入，也不能 await (连接在块结束前一直被占用)
+        """
+        yield self
+
+    # ---------- 权限 ----------
+    @abstractmethod
+    def load_assistants(self):
+        """
+        [(chat_id, assistant_id)]
+        """
+        raise NotImplementedError
+
+    @abstractmethod
+    def assistant_exists(self, chat_id, user_id):
+        raise NotImplementedError
+
+    @abstractmethod
+    def add_assistant(self, chat_id, owner_id, assistant_id):
+        raise NotImplementedError
+
+    @abstractmethod
+    def remove_assistant(self, chat_id, assistant_id):
+        raise NotImplementedError
+
+    @abstractmethod
+    def owner_expiry(self, user_id):
+        raise NotImplementedError
+
+    @abstractmethod
+    def set_owner_expiry(self, user_id, expire):
+        raise NotImplementedError
+
+    @abstractmethod
+    def load_subscriptions(self, expire_after=None, updated_after=None):
+        """
+        [(user_id, expire_date, notice_state, updated_at)]
+        expire_after: 只返回在此之后到期的行
+        updated_after: 只返回在此之后修改过期限的行
+        """
+        raise NotImplementedError
+
+    @abstractmethod
+    def set_notice_state(self, user_id, notice):
+        raise NotImplementedError
+
+    # ---------- 群组设置 ----------
+    @abstractmethod
+    def chat_settings(self, chat_id):
+        """
+        (timezone, report_time) 或 None
+        """
+        raise NotImplementedError
+
+    @abstractmethod
+    def load_chat_settings(self):
+        """
+        [(chat_id, timezone, report_time)]
+        """
+        raise NotImplementedError
+
+    @abstractmethod
+    def set_chat_timezone(self, chat_id, tz_name):
+        raise NotImplementedError
+
+    @abstractmethod
+    def set_report_time(self, chat_id, report_time):
+        raise NotImplementedError
+
+    # ---------- 记账 ----------
+    @abstractmethod
+    def add_entry(self, chat_id, amount, description, user_name):
+        """
+        写入一条记录并维护汇总，返回 (entry_id, 新余额)
+        """
+        raise NotImplementedError
+
+    @abstractmethod
+    def add_spooled_entry(self, chat_id, amount, description, user_name, timestamp, key):
+        """
+        回放暂存记录；key 已存在时不重复入账，返回是否新写入
+        """
+        raise NotImplementedError
+
+    @abstractmethod
+    def undo_last(self, chat_id):
+        """
+        删除最后一条记录，返回 (id, description, amount, timestamp, user_name) 或 None
+        """
+        raise NotImplementedError
+
+    @abstractmethod
+    def reset(self, chat_id):
+        raise NotImplementedError
+
+    # ---------- 查询 ----------
+    @abstractmethod
+    def ledger_rows(self, chat_id, since=None):
+        """
+        全部记录 [(description, amount, balance_after, timestamp)]，按 id 顺序
+        since: 只返回该时间 (UTC) 之后的记录
+        """
+        raise NotImplementedError
+
+    @abstractmethod
+    def totals(self, chat_id, start=None, end=None):
+        """
+        (收入, 支出)，时间范围左闭右开
+        """
+        raise NotImplementedError
+
+    @abstractmethod
+    def grouped_totals(self, chat_id, tz_name, unit, start=None, end=None, descending=False):
+        """
+        按群组本地 "day" / "month" / "year" 分组 [(标签, 收入, 支出)]
+        标签格式 YYYY-MM-DD / YYYY-MM / YYYY
+        """
+        raise NotImplementedError
+
+    @abstractmethod
+    def periods(self, chat_id, tz_name, unit, limit=None):
+        """
+        有记录的本地月份/年份标签，倒序
+        """
+        raise NotImplementedError
+
+    @abstractmethod
+    def breakdown_months(self, chat_id, kind):
+        """
+        操作人/分类汇总中有数据的月份 (date)，倒序
+        """
+        raise NotImplementedError
+
+    @abstractmethod
+    def breakdown_top(self, chat_id, kind, start=None, end=None, limit=10):
+        """
+        [(label, entries, income, expense)]
+        分类 (tag) 按支出从多到少排列，操作人 (user) 按经手金额 (收入 + 支出绝对值) 从多到少排列
+        """
+        raise NotImplementedError
+
+    @abstractmethod
+    def find_totals(self, chat_id, keyword, start=None, end=None, scan_limit=None):
+        """
+        (匹配条数, 收入, 支出)；指定 scan_limit 时只统计时间段内最近 scan_limit 条记录
+        """
+        raise NotImplementedError
+
+    @abstractmethod
+    def find_page(self, chat_id, keyword, start, end, before_id, limit):
+        """
+        [(id, description, amount, timestamp)]，按 id 倒序，before_id 为 keyset 游标
+        """
+        raise NotImplementedError
+
+    @abstractmethod
+    def balance_as_of(self, chat_id, boundary):
+        """
+        截至 boundary (不含) 的 (余额, 累计收入, 累计支出)
+        """
+        raise NotImplementedError
+
+    # ---------- 维护 / 看板 ----------
+    @abstractmethod
+    def checkpoint_drift(self, chat_id=None):
+        raise NotImplementedError
+
+    @abstractmethod
+    def rebuild_checkpoints(self, chat_id=None):
+        raise NotImplementedError
+
+    @abstractmethod
+    def dashboard_stats(self, now, days, top):
+        """
+        {"chats", "entries", "active_1d", "active_7d", "daily", "largest"}
+        """
+        raise NotImplementedError
+
+
+# ================= THREAD POOL =================
+# 存储方法都是阻塞调用 (psycopg2 / sqlite3)：在有界线程池中执行，
+# 慢查询或连接超时只占用一个线程，不会卡住其它群组的事件循环
+_executor = ThreadPoolExecutor(max_workers=STORAGE_THREADS, thread_name_prefix="storage")
+
+
+async def run_storage(fn, *args, **kwargs):
+    """
+    在存储线程池中执行 fn(*args, **kwargs) (存储方法或调用存储的同步函数)
+    """
+    loop = asyncio.get_running_loop()
+    return await loop.run_in_executor(_executor, functools.partial(fn, *args, **kwargs))
+
+
+# ================= BACKEND =================
+def create_storage(backend=STORAGE_BACKEND):
+    # 按需导入：SQLite 部署不需要安装 psycopg2
+    if backend == "sqlite":
+        from sqlite_storage import SQLiteStorage
+        return SQLiteStorage()
+
+    if backend == "postgres":
+        from postgres_storage import PostgresStorage
+        return PostgresStorage()
+
+    raise ValueError(f"❌ Unknown STORAGE_BACKEND: {backend}")
+
+
+_storage = None
+
+
+def get_storage():
+    global _storage
+    if _storage is None:
+        _storage = create_storage()
+    return _storage
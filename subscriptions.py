@@ -0,0 +1,303 @@
+import os
+import time
+import heapq
+import logging
+import itertools
+from datetime import datetime, timedelta
+
+from storage import get_storage, run_storage, StorageUnavailable
+from sharding import current_shard
+
+
+# ================= CONFIG =================
+EXPIRY_WARNING_DAYS = int(os.getenv("EXPIRY_WARNING_DAYS", "3"))
+
+# 多进程模式下其它 worker 的 /adddays 最多延迟这么久同步过来
+SUBSCRIPTION_RESYNC_SECONDS = int(os.getenv("SUBSCRIPTION_RESYNC_SECONDS", "60"))
+
+# 过期超过这个时间的通知不再补发 (例如长时间停机后重启)
+STALE_NOTICE_AFTER = timedelta(days=1)
+
+# 载入失败后至少间隔这么久再重试，期间 expiry() 改为单行查询
+SUBSCRIPTION_RETRY_SECONDS = int(os.getenv("SUBSCRIPTION_RETRY_SECONDS", "30"))
+
+# 增量同步向前多读一段，覆盖提交较慢的事务与服务器时钟误差
+SUBSCRIPTION_RESYNC_OVERLAP = timedelta(minutes=5)
+
+WARN = "warn"
+EXPIRED = "expired"
+
+
+# ================= SUBSCRIPTION SCHEDULER =================
+class SubscriptionScheduler:
+    """
+    Owner 使用期限：启动时一次性载入，按到期时间放入最小堆
+    到点推送 "即将到期 / 已过期" 通知，并清除内存中的权限
+    is_owner 只查内存，不再每条消息访问数据库
+    """
+
+    def __init__(self):
+        self.loaded = False
+
+        # user_id -> expire_date (UTC)
+        self._expiry = {}
+
+        # user_id -> 最近已发送的通知 ("warn:2024-05-01T00:00:00")
+        self._notices = {}
+
+        # (触发时间, 序号, 类型, user_id, expire_date)
+        self._heap = []
+        self._seq = itertools.count()
+
+        self._job_queue = None
+        self._job = None
+
+        # 已同步到的最大 updated_at (数据库时间)
+        self._watermark = None
+
+        # 最近一次载入失败的时间 (monotonic)
+        self._failed_at = None
+
+    # ---------- 载入 ----------
+    def _fetch(self, **filters):
+        # 失败后的重试间隔内直接放弃，不让每条消息都等待数据库
+        if self._failed_at is not None and time.monotonic() - self._failed_at < SUBSCRIPTION_RETRY_SECONDS:
+            return None
+
+        try:
+            rows = get_storage().load_subscriptions(**filters)
+        except StorageUnavailable:
+            self._failed_at = time.monotonic()
+            return None
+        except Exception as e:
+            logging.error(f"❌ Load subscriptions failed: {e}")
+            self._failed_at = time.monotonic()
+            return None
+
+        self._failed_at = None
+        return rows
+
+    def _advance_watermark(self, rows):
+        for row in rows:
+            updated_at = row[3]
+            if updated_at is not None and (self._watermark is None or updated_at > self._watermark):
+                self._watermark = updated_at
+
+    def _load_filters(self):
+        return {"expire_after": datetime.utcnow() - STALE_NOTICE_AFTER}
+
+    def _sync_filters(self):
+        return {"updated_after": self._watermark - SUBSCRIPTION_RESYNC_OVERLAP if self._watermark else None}
+
+    def load(self):
+        """
+        全量载入一次；早已过期 (不会再发通知) 的 owner 不进入内存和堆
+        """
+        return self._apply_load(self._fetch(**self._load_filters()))
+
+    def _apply_load(self, rows):
+        if rows is None:
+            return False
+
+        self._expiry = {user_id: expire for user_id, expire, _, _ in rows}
+        self._notices = {user_id: notice for user_id, _, notice, _ in rows if notice}
+        self._heap = []
+        for user_id, expire in self._expiry.items():
+            self._push_events(user_id, expire)
+
+        self._advance_watermark(rows)
+        self.loaded = True
+        self._reschedule()
+
+        logging.info(f"✅ Subscriptions loaded: {len(self._expiry)} owners")
+        return True
+
+    def sync(self):
+        """
+        增量同步：只读取上次同步之后修改过期限的行 (其它 worker 的 /adddays)
+        """
+        if not self.loaded:
+            return self.load()
+        return self._apply_sync(self._fetch(**self._sync_filters()))
+
+    async def refresh(self):
+        """
+        在事件循环中使用：查询放到存储线程池，结果 (含定时任务) 回到事件循环中应用
+        """
+        if not self.loaded:
+            return self._apply_load(await run_storage(self._fetch, **self._load_filters()))
+        return self._apply_sync(await run_storage(self._fetch, **self._sync_filters()))
+
+    def _apply_sync(self, rows):
+        if rows is None:
+            return False
+
+        stale_before = datetime.utcnow() - STALE_NOTICE_AFTER
+        changed = 0
+        for user_id, expire, notice, _ in rows:
+            if notice:
+                self._notices[user_id] = notice
+            if expire < stale_before:
+                # 与全量载入一致：早已过期的不放入堆
+                self._expiry.pop(user_id, None)
+                continue
+            if self._expiry.get(user_id) != expire:
+                self._expiry[user_id] = expire
+                self._push_events(user_id, expire)
+                changed += 1
+
+        self._advance_watermark(rows)
+        if changed:
+            self._reschedule()
+            logging.info(f"✅ Subscriptions synced: {changed} changed")
+        return True
+
+    def _push_events(self, user_id, expire):
+        heapq.heappush(
+            self._heap,
+            (expire - timedelta(days=EXPIRY_WARNING_DAYS), next(self._seq), WARN, user_id, expire)
+        )
+        heapq.heappush(
+            self._heap,
+            (expire, next(self._seq), EXPIRED, user_id, expire)
+        )
+
+    # ---------- 查询 ----------
+    def _owner_expiry(self, user_id):
+        # 尚未载入成功：只查这一个用户
+        try:
+            return get_storage().owner_expiry(user_id)
+        except StorageUnavailable:
+            return None
+        except Exception as e:
+            logging.error(f"❌ Owner expiry lookup failed: {e}")
+            return None
+
+    def expiry(self, user_id):
+        if not self.loaded and not self.load():
+            return self._owner_expiry(user_id)
+        return self._expiry.get(user_id)
+
+    def is_active(self, user_id):
+        expire = self.expiry(user_id)
+        return bool(expire and expire > datetime.utcnow())
+
+    async def check_active(self, user_id):
+        """
+        is_active 的事件循环版本：尚未载入时的数据库访问不阻塞事件循环
+        """
+        if not self.loaded and not await self.refresh():
+            expire = await run_storage(self._owner_expiry, user_id)
+        else:
+            expire = self._expiry.get(user_id)
+        return bool(expire and expire > datetime.utcnow())
+
+    def expiring(self, within):
+        """
+        在 within 时间内到期的 owner，按到期时间排序 [(user_id, expire_date)]
+        只读内存 (可在存储线程中调用)；尚未载入时为空，由定时同步负责载入
+        """
+        now = datetime.utcnow()
+        return sorted(
+            ((user_id, expire) for user_id, expire in self._expiry.items()
+             if now < expire <= now + within),
+            key=lambda item: item[1]
+        )
+
+    # ---------- 更新 (/adddays) ----------
+    def update(self, user_id, expire):
+        self._expiry[user_id] = expire
+        self._push_events(user_id, expire)
+        self._reschedule()
+
+    # ---------- 调度 ----------
+    async def start(self, job_queue):
+        self._job_queue = job_queue
+        if not self.loaded:
+            await self.refresh()
+
+        job_queue.run_repeating(
+            self._resync,
+            interval=SUBSCRIPTION_RESYNC_SECONDS,
+            first=SUBSCRIPTION_RESYNC_SECONDS,
+            name="subscription_resync"
+        )
+        self._reschedule()
+
+    def _reschedule(self):
+        if self._job_queue is None:
+            return
+
+        if self._job is not None:
+            self._job.schedule_removal()
+            self._job = None
+
+        if not self._heap:
+            return
+
+        delay = (self._heap[0][0] - datetime.utcnow()).total_seconds()
+        self._job = self._job_queue.run_once(
+            self._run_due,
+            when=max(delay, 0),
+            name="subscription_expiry"
+        )
+
+    async def _resync(self, context):
+        await self.refresh()
+
+    async def _run_due(self, context):
+        self._job = None
+        now = datetime.utcnow()
+
+        while self._heap and self._heap[0][0] <= now:
+            _, _, kind, user_id, expire = heapq.heappop(self._heap)
+
+            # 期限已被修改，旧事件作废
+            if self._expiry.get(user_id) != expire:
+                continue
+
+            if kind == EXPIRED:
+                # 清除内存权限
+                self._expiry.pop(user_id, None)
+
+            await self._notify(context.bot, kind, user_id, expire, now)
+
+        self._reschedule()
+
+    async def _notify(self, bot, kind, user_id, expire, now):
+
+        notice = f"{kind}:{expire.isoformat()}"
+
+        if self._notices.get(user_id) == notice:
+            return
+        if kind == WARN and expire <= now:
+            return
+        if now - expire > STALE_NOTICE_AFTER:
+            return
+
+        # 多进程模式下只由 0 号 worker 发送通知
+        if current_shard()[0] != 0:
+            return
+
+        if kind == WARN:
+            text = (
+                f"⏳ 您的使用权限将于 {expire.strftime('%Y-%m-%d %H:%M')} (UTC) 到期\n"
+                f"剩余不足 {EXPIRY_WARNING_DAYS} 天，请联系管理员 @Mbcdcandy 续费"
+            )
+        else:
+            text = "❌ 您的使用权限已过期，请联系管理员 @Mbcdcandy 续费"
+
+        try:
+            await bot.send_message(chat_id=user_id, text=text)
+        except Exception as e:
+            logging.warning(f"⚠️ Expiry notice to {user_id} failed: {e}")
+
+        self._notices[user_id] = notice
+
+        try:
+            await run_storage(get_storage().set_notice_state, user_id, notice)
+        except StorageUnavailable:
+            return
+
+
+subscription_scheduler = SubscriptionScheduler()
@@ -0,0 +1,76 @@
+"""
+限流测试：按用户 / 按群组的令牌桶，时间由测试控制
+
+    python -m pytest tests
+"""
+import os
+import sys
+
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import rate_limit
+from rate_limit import RateLimiter
+
+LIMITS = {
+    ("write", "user"): (2.0, 60.0),
+    ("write", "chat"): (3.0, 60.0),
+    ("report", "user"): (1.0, 60.0),
+    ("report", "chat"): (1.0, 60.0),
+}
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    now = [1000.0]
+    monkeypatch.setattr(rate_limit.time, "monotonic", lambda: now[0])
+    return now
+
+
+def test_user_bucket_limits_and_notifies_once(clock):
+    limiter = RateLimiter(LIMITS)
+
+    assert limiter.check("write", -1, 1) == (True, False)
+    assert limiter.check("write", -1, 1) == (True, False)
+    # 超额：第一次提示，同一周期内不再提示
+    assert limiter.check("write", -1, 1) == (False, True)
+    assert limiter.check("write", -1, 1) == (False, False)
+    assert limiter.stats() == {("write", "user"): 2}
+
+    # 按速率补充令牌 (2 次 / 60 秒 = 每 30 秒 1 次)
+    clock[0] += 30
+    assert limiter.check("write", -1, 1) == (True, False)
+
+
+def test_chat_bucket_is_shared_by_users(clock):
+    limiter = RateLimiter(LIMITS)
+
+    assert limiter.check("write", -1, 1)[0]
+    assert limiter.check("write", -1, 2)[0]
+    assert limiter.check("write", -1, 3)[0]
+    assert limiter.check("write", -1, 4) == (False, True)
+
+    # 其它群组、其它类型互不影响
+    assert limiter.check("write", -2, 4)[0]
+    assert limiter.check("report", -1, 4)[0]
+
+
+def test_rejected_request_does_not_consume_user_tokens(clock):
+    limiter = RateLimiter(LIMITS)
+
+    for user_id in (1, 2, 3):
+        assert limiter.check("write", -1, user_id)[0]
+
+    # 群组桶已空：用户 1 的请求被拒绝，不扣减用户桶
+    assert not limiter.check("write", -1, 1)[0]
+    assert limiter.check("write", -2, 1)[0]
+
+
+def test_bucket_table_is_bounded(clock):
+    limiter = RateLimiter(LIMITS, table_size=4)
+
+    for user_id in range(10):
+        limiter.check("report", -user_id, user_id)
+
+    assert len(limiter._buckets) == 4
@@ -0,0 +1,98 @@
+"""
+暂存文件测试：按顺序回放、重复回放不重复入账、永久失败的记录移到死信文件
+
+使用临时 SQLite 数据库与临时暂存文件
+
+    python -m pytest tests
+"""
+import os
+import sys
+
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import spool
+from spool import DEAD_LETTER_SUFFIX, LedgerSpool
+from sqlite_storage import SQLiteStorage
+from storage import StorageUnavailable
+
+TEST_CHAT_ID = -999000995
+
+
+@pytest.fixture
+def storage(tmp_path, monkeypatch):
+    backend = SQLiteStorage(str(tmp_path / "ledger.db"))
+    assert backend.init_schema()
+    monkeypatch.setattr(spool, "get_storage", lambda: backend)
+    yield backend
+    backend.close()
+
+
+@pytest.fixture
+def ledger_spool(tmp_path):
+    return LedgerSpool(str(tmp_path / "spool.jsonl"))
+
+
+def test_replay_in_order(storage, ledger_spool):
+    ledger_spool.append(TEST_CHAT_ID, 100, "房租", "amy")
+    ledger_spool.append(TEST_CHAT_ID, -30, "饭", "bob")
+    assert ledger_spool.has_pending(TEST_CHAT_ID)
+
+    assert ledger_spool.replay() == {TEST_CHAT_ID}
+    assert not ledger_spool.has_pending()
+    assert [tuple(r[:3]) for r in storage.ledger_rows(TEST_CHAT_ID)] == [("房租", 100, 100), ("饭", -30, 70)]
+
+    # 文件已清空，再次回放不做任何事
+    assert ledger_spool.replay() == set()
+
+
+def test_replay_is_idempotent(storage, ledger_spool):
+    ledger_spool.append(TEST_CHAT_ID, 100, "房租", "amy")
+    with open(ledger_spool.path, encoding="utf-8") as f:
+        content = f.read()
+
+    ledger_spool.replay()
+
+    # 入账后、改写文件前崩溃：重启后同一条记录会再回放一次
+    with open(ledger_spool.path, "w", encoding="utf-8") as f:
+        f.write(content)
+    restarted = LedgerSpool(ledger_spool.path)
+    assert restarted.has_pending(TEST_CHAT_ID)
+
+    restarted.replay()
+    assert len(storage.ledger_rows(TEST_CHAT_ID)) == 1
+    assert not restarted.has_pending()
+
+
+def test_unavailable_keeps_entries(storage, ledger_spool, monkeypatch):
+    ledger_spool.append(TEST_CHAT_ID, 5, "x", "amy")
+    add_spooled_entry = storage.add_spooled_entry
+    down = [True]
+
+    def flaky(*args):
+        if down[0]:
+            raise StorageUnavailable()
+        return add_spooled_entry(*args)
+
+    monkeypatch.setattr(storage, "add_spooled_entry", flaky)
+    assert ledger_spool.replay() == set()
+    assert ledger_spool.has_pending(TEST_CHAT_ID)
+
+    down[0] = False
+    assert ledger_spool.replay() == {TEST_CHAT_ID}
+    assert len(storage.ledger_rows(TEST_CHAT_ID)) == 1
+
+
+def test_rejected_entry_moves_to_dead_letter(storage, ledger_spool):
+    # 超出 INTEGER 范围的金额永远无法入账，不能挡住后面的记录
+    ledger_spool.append(TEST_CHAT_ID, 10 ** 20, "huge", "amy")
+    ledger_spool.append(TEST_CHAT_ID, 5, "ok", "amy")
+
+    assert ledger_spool.replay() == {TEST_CHAT_ID}
+    assert not ledger_spool.has_pending()
+    assert [tuple(r[:3]) for r in storage.ledger_rows(TEST_CHAT_ID)] == [("ok", 5, 5)]
+
+    with open(ledger_spool.path + DEAD_LETTER_SUFFIX, encoding="utf-8") as f:
+        dead = f.readlines()
+    assert len(dead) == 1 and "huge" in dead[0]
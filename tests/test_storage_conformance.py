@@ -0,0 +1,160 @@
+"""
+存储后端一致性测试：SQLite 与 Postgres 必须给出相同的结果
+
+SQLite 每个测试使用临时文件；设置了 DATABASE_URL 时同时测试 Postgres
+(测试群组的数据在前后用 reset() 清除)
+
+    python -m pytest tests
+    DATABASE_URL=postgresql://... python -m pytest tests
+"""
+import os
+import sys
+from datetime import datetime, timedelta
+
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from storage import LedgerStorage, create_storage
+from sqlite_storage import SQLiteStorage
+
+TEST_CHAT_ID = -999000996
+
+
+@pytest.fixture(params=["sqlite", "postgres"])
+def storage(request, tmp_path):
+    if request.param == "sqlite":
+        backend = SQLiteStorage(str(tmp_path / "ledger.db"))
+    else:
+        if not os.getenv("DATABASE_URL"):
+            pytest.skip("DATABASE_URL not set")
+        backend = create_storage("postgres")
+
+    assert backend.init_schema()
+    backend.reset(TEST_CHAT_ID)
+    yield backend
+    backend.reset(TEST_CHAT_ID)
+
+    if request.param == "sqlite":
+        backend.close()
+
+
+def test_interface_is_abstract():
+    with pytest.raises(TypeError):
+        LedgerStorage()
+
+
+def test_spooled_replay_is_idempotent(storage):
+    timestamp = datetime(2024, 3, 5, 12, 0)
+
+    assert storage.add_spooled_entry(TEST_CHAT_ID, 100, "房租", "amy", timestamp, "k-1")
+    assert not storage.add_spooled_entry(TEST_CHAT_ID, 100, "房租", "amy", timestamp, "k-1")
+
+    rows = storage.ledger_rows(TEST_CHAT_ID)
+    assert [(r[0], r[1], r[2]) for r in rows] == [("房租", 100, 100)]
+    assert tuple(storage.totals(TEST_CHAT_ID)) == (100, 0)
+
+
+def test_undo_updates_aggregates(storage):
+    storage.add_entry(TEST_CHAT_ID, 500, "房租 十月", "amy")
+    storage.add_entry(TEST_CHAT_ID, -20, "饭", "bob")
+    storage.add_entry(TEST_CHAT_ID, -30, "饭 晚餐", "bob")
+
+    undone = storage.undo_last(TEST_CHAT_ID)
+    assert (undone[1], undone[2], undone[4]) == ("饭 晚餐", -30, "bob")
+
+    assert tuple(storage.totals(TEST_CHAT_ID)) == (500, -20)
+    assert storage.ledger_rows(TEST_CHAT_ID)[-1][2] == 480
+    # 分类按支出排行，操作人按经手金额排行
+    assert [tuple(r) for r in storage.breakdown_top(TEST_CHAT_ID, "tag")] == [
+        ("饭", 1, 0, -20),
+        ("房租", 1, 500, 0),
+    ]
+    assert [tuple(r) for r in storage.breakdown_top(TEST_CHAT_ID, "user")] == [
+        ("amy", 1, 500, 0),
+        ("bob", 1, 0, -20),
+    ]
+    assert storage.checkpoint_drift(TEST_CHAT_ID) == []
+
+    storage.undo_last(TEST_CHAT_ID)
+    storage.undo_last(TEST_CHAT_ID)
+    assert storage.undo_last(TEST_CHAT_ID) is None
+    assert storage.breakdown_top(TEST_CHAT_ID, "user") == []
+
+
+def test_out_of_order_replay_keeps_checkpoints(storage):
+    # 回放记录的时间早于已有记录 (跨越多个月份)，检查点必须与明细一致
+    storage.add_entry(TEST_CHAT_ID, 1000, "live", "amy")
+    now = datetime.utcnow()
+    for i, days in enumerate((400, 95, 200, 35, 3)):
+        storage.add_spooled_entry(
+            TEST_CHAT_ID, 10 * (i + 1), f"old{i}", "bob", now - timedelta(days=days), f"k-{i}"
+        )
+    storage.undo_last(TEST_CHAT_ID)
+
+    assert storage.checkpoint_drift(TEST_CHAT_ID) == []
+
+    rows = storage.ledger_rows(TEST_CHAT_ID)
+    balance, income, expense = storage.balance_as_of(TEST_CHAT_ID, now + timedelta(days=1))
+    assert balance == rows[-1][2]
+    assert (income, expense) == (sum(r[1] for r in rows), 0)
+
+    # since 只返回边界之后的记录，顺序仍按 id
+    since = now - timedelta(days=100)
+    assert [r[0] for r in storage.ledger_rows(TEST_CHAT_ID, since=since)] == [
+        r[0] for r in rows if r[3] >= since
+    ]
+
+
+def test_grouping_uses_chat_local_time(storage):
+    # UTC 1 月 31 日 20:00 = 上海 2 月 1 日 04:00
+    storage.add_spooled_entry(TEST_CHAT_ID, 70, "夜宵", "amy", datetime(2024, 1, 31, 20, 0), "k-tz")
+
+    assert [tuple(r) for r in storage.grouped_totals(TEST_CHAT_ID, "Asia/Shanghai", "day")] == [
+        ("2024-02-01", 70, 0)
+    ]
+    assert [tuple(r) for r in storage.grouped_totals(TEST_CHAT_ID, "UTC", "day")] == [
+        ("2024-01-31", 70, 0)
+    ]
+    assert storage.periods(TEST_CHAT_ID, "Asia/Shanghai", "month") == ["2024-02"]
+    assert storage.periods(TEST_CHAT_ID, "UTC", "month") == ["2024-01"]
+    assert storage.periods(TEST_CHAT_ID, "Asia/Shanghai", "year") == ["2024"]
+
+
+def test_find_escapes_like_wildcards(storage):
+    for description in ("五折 50% off", "50 off", "a_b", "ab", "C:\\path"):
+        storage.add_entry(TEST_CHAT_ID, 1, description, "amy")
+
+    assert tuple(storage.find_totals(TEST_CHAT_ID, "%")) == (1, 1, 0)
+    assert tuple(storage.find_totals(TEST_CHAT_ID, "_")) == (1, 1, 0)
+    assert tuple(storage.find_totals(TEST_CHAT_ID, "\\")) == (1, 1, 0)
+    assert tuple(storage.find_totals(TEST_CHAT_ID, "OFF")) == (2, 2, 0)
+
+    # keyset 分页：按 id 倒序，before_id 之后继续
+    first = storage.find_page(TEST_CHAT_ID, "off", None, None, None, 1)
+    second = storage.find_page(TEST_CHAT_ID, "off", None, None, first[0][0], 1)
+    assert [r[1] for r in first + second] == ["50 off", "五折 50% off"]
+
+
+def test_find_totals_scan_limit(storage):
+    # 只统计最近 scan_limit 条记录 (按时间)，其中的匹配才计入小计
+    for i, description in enumerate(("饭", "车", "饭 午餐", "饭")):
+        storage.add_spooled_entry(
+            TEST_CHAT_ID, -(i + 1), description, "amy", datetime(2024, 5, 1 + i), f"k-{i}"
+        )
+
+    assert tuple(storage.find_totals(TEST_CHAT_ID, "饭")) == (3, 0, -8)
+    assert tuple(storage.find_totals(TEST_CHAT_ID, "饭", scan_limit=2)) == (2, 0, -7)
+    assert tuple(storage.find_totals(
+        TEST_CHAT_ID, "饭", None, datetime(2024, 5, 4), scan_limit=2
+    )) == (1, 0, -3)
+
+
+def test_read_batch_reads_consistently(storage):
+    storage.add_entry(TEST_CHAT_ID, 5, "x", "amy")
+
+    with storage.read_batch(TEST_CHAT_ID):
+        assert tuple(storage.totals(TEST_CHAT_ID)) == (5, 0)
+        assert storage.find_totals(TEST_CHAT_ID, "x")[0] == 1
+        assert storage.owner_expiry(-1) is None
+        assert not storage.assistant_exists(TEST_CHAT_ID, -1)
@@ -0,0 +1,92 @@
+"""
+使用期限调度测试：全量载入、增量同步、载入失败后的退避与单行查询
+
+使用临时 SQLite 数据库
+
+    python -m pytest tests
+"""
+import os
+import sys
+import asyncio
+from datetime import datetime, timedelta
+
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import subscriptions
+from subscriptions import SubscriptionScheduler, EXPIRED, WARN
+from sqlite_storage import SQLiteStorage
+
+OWNER, EXPIRED_OWNER, NEW_OWNER = 990001, 990002, 990003
+
+
+@pytest.fixture
+def storage(tmp_path, monkeypatch):
+    backend = SQLiteStorage(str(tmp_path / "ledger.db"))
+    assert backend.init_schema()
+    monkeypatch.setattr(subscriptions, "get_storage", lambda: backend)
+    yield backend
+    backend.close()
+
+
+def test_load_skips_long_expired_owners(storage):
+    now = datetime.utcnow()
+    storage.set_owner_expiry(OWNER, now + timedelta(days=10))
+    storage.set_owner_expiry(EXPIRED_OWNER, now - timedelta(days=30))
+
+    scheduler = SubscriptionScheduler()
+    assert scheduler.load()
+
+    assert scheduler.is_active(OWNER)
+    assert not scheduler.is_active(EXPIRED_OWNER)
+    assert EXPIRED_OWNER not in scheduler._expiry
+
+    # 每个 owner 一条提醒、一条过期事件
+    assert sorted(kind for _, _, kind, _, _ in scheduler._heap) == [EXPIRED, WARN]
+
+
+def test_sync_reads_only_changed_rows(storage):
+    now = datetime.utcnow()
+    storage.set_owner_expiry(OWNER, now + timedelta(days=10))
+
+    scheduler = SubscriptionScheduler()
+    assert scheduler.load()
+    events = len(scheduler._heap)
+
+    assert scheduler.sync()
+    assert len(scheduler._heap) == events
+
+    # 其它 worker 的 /adddays
+    storage.set_owner_expiry(NEW_OWNER, now + timedelta(days=2))
+    assert scheduler.sync()
+    assert scheduler.is_active(NEW_OWNER)
+    assert len(scheduler._heap) == events + 2
+
+
+def test_failed_load_backs_off_and_falls_back(storage, monkeypatch):
+    storage.set_owner_expiry(OWNER, datetime.utcnow() + timedelta(days=10))
+
+    calls = []
+
+    def broken(**filters):
+        calls.append(filters)
+        raise RuntimeError("boom")
+
+    monkeypatch.setattr(storage, "load_subscriptions", broken)
+    scheduler = SubscriptionScheduler()
+
+    # 载入失败时逐个用户查询；重试间隔内不再尝试全量载入
+    assert scheduler.is_active(OWNER)
+    assert scheduler.is_active(OWNER)
+    assert not scheduler.loaded
+    assert len(calls) == 1
+
+
+def test_check_active_loads_outside_event_loop(storage):
+    storage.set_owner_expiry(OWNER, datetime.utcnow() + timedelta(days=10))
+
+    scheduler = SubscriptionScheduler()
+    assert asyncio.run(scheduler.check_active(OWNER))
+    assert not asyncio.run(scheduler.check_active(NEW_OWNER))
+    assert scheduler.loaded
@@ -0,0 +1,184 @@
+"""
+更新处理器测试：优先级名额、同群组顺序、待处理记账计数与过载丢弃
+
+    python -m pytest tests
+"""
+import os
+import sys
+import asyncio
+
+import pytest
+from telegram import Message, Update
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import update_processor
+from update_processor import (
+    ChatOrderedUpdateProcessor,
+    PriorityGate,
+    PRIORITY_LOW,
+    PRIORITY_REPORT,
+    PRIORITY_WRITE,
+    SHED_NOTICE_TEXT,
+    update_priority,
+)
+
+
+def make_update(update_id, chat_id, text):
+    return Update.de_json({
+        "update_id": update_id,
+        "message": {
+            "message_id": update_id,
+            "date": 0,
+            "chat": {"id": chat_id, "type": "group"},
+            "from": {"id": 1, "is_bot": False, "first_name": "amy"},
+            "text": text,
+        },
+    }, None)
+
+
+@pytest.fixture
+def replies(monkeypatch):
+    # 测试中的 Update 没有 bot，回复改为记录到列表
+    sent = []
+
+    async def reply_text(self, text, **kwargs):
+        sent.append((self.chat_id, text))
+
+    monkeypatch.setattr(Message, "reply_text", reply_text)
+    return sent
+
+
+def test_update_priority():
+    assert update_priority(make_update(1, -1, "+100 房租")) == PRIORITY_WRITE
+    assert update_priority(make_update(2, -1, "/undo")) == PRIORITY_WRITE
+    assert update_priority(make_update(3, -1, "/summary@bot")) == PRIORITY_REPORT
+    assert update_priority(make_update(4, -1, "/adddays 1 30")) == PRIORITY_REPORT
+    assert update_priority(make_update(5, -1, "/reset")) == PRIORITY_REPORT
+    assert update_priority(make_update(6, -1, "/help")) == PRIORITY_LOW
+    assert update_priority(make_update(7, -1, "hello")) == PRIORITY_LOW
+
+
+def test_priority_gate_wakes_by_priority():
+    async def run():
+        gate = PriorityGate(1)
+        await gate.acquire(PRIORITY_LOW)
+
+        order = []
+
+        async def waiter(name, priority):
+            await gate.acquire(priority)
+            order.append(name)
+            gate.release()
+
+        tasks = []
+        for name, priority in (("low", PRIORITY_LOW), ("report", PRIORITY_REPORT),
+                               ("write-1", PRIORITY_WRITE), ("write-2", PRIORITY_WRITE)):
+            tasks.append(asyncio.create_task(waiter(name, priority)))
+            await asyncio.sleep(0)
+
+        gate.release()
+        await asyncio.gather(*tasks)
+        return order, gate.active
+
+    order, active = asyncio.run(run())
+    assert order == ["write-1", "write-2", "report", "low"]
+    assert active == 0
+
+
+def test_priority_gate_skips_cancelled_waiter():
+    async def run():
+        gate = PriorityGate(1)
+        await gate.acquire(PRIORITY_WRITE)
+
+        cancelled = asyncio.create_task(gate.acquire(PRIORITY_WRITE))
+        waiting = asyncio.create_task(gate.acquire(PRIORITY_LOW))
+        await asyncio.sleep(0)
+        cancelled.cancel()
+        await asyncio.sleep(0)
+
+        gate.release()
+        await waiting
+        gate.release()
+        return gate.active
+
+    assert asyncio.run(run()) == 0
+
+
+def test_same_chat_runs_in_order_and_counts_pending_writes():
+    async def run():
+        processor = ChatOrderedUpdateProcessor(max_concurrent_updates=4)
+        seen = []
+
+        async def handler(text, chat_id):
+            seen.append((text, processor.pending_writes(chat_id)))
+            await asyncio.sleep(0.01)
+
+        tasks = []
+        for i, text in enumerate(("+1", "/summary", "+2", "+3")):
+            update = make_update(i, -1, text)
+            tasks.append(asyncio.create_task(processor.process_update(update, handler(text, -1))))
+            await asyncio.sleep(0)
+
+        await asyncio.gather(*tasks)
+        return seen, processor.pending
+
+    seen, pending = asyncio.run(run())
+    # 同群组严格按到达顺序；pending_writes 只计算排在后面、尚未开始的记账消息
+    # (第一条到达时立即开始，后面的消息还没有到达)
+    assert seen == [("+1", 0), ("/summary", 2), ("+2", 1), ("+3", 0)]
+    assert pending == 0
+
+
+def test_budget_sheds_low_priority_and_replies(replies):
+    async def run():
+        processor = ChatOrderedUpdateProcessor(max_concurrent_updates=1, max_pending_updates=4)
+        handled = []
+
+        async def handler(text):
+            handled.append(text)
+            await asyncio.sleep(0.01)
+
+        tasks = []
+        specs = [(-1, "+1"), (-2, "+2"), (-3, "/help"), (-4, "/summary"), (-5, "/help"), (-5, "+3")]
+        for i, (chat_id, text) in enumerate(specs):
+            update = make_update(i, chat_id, text)
+            tasks.append(asyncio.create_task(processor.process_update(update, handler(text))))
+            await asyncio.sleep(0)
+
+        await asyncio.gather(*tasks)
+        return handled, processor
+
+    handled, processor = asyncio.run(run())
+    # 待处理数达到一半后拒绝低优先级，记账始终接收；名额按优先级分配，记账先于报表
+    assert handled == ["+1", "+2", "+3", "/summary"]
+    assert processor.shed[(PRIORITY_LOW, "budget")] == 2
+    assert replies == [(-3, SHED_NOTICE_TEXT), (-5, SHED_NOTICE_TEXT)]
+    assert processor.pending == 0
+
+
+def test_stale_updates_are_shed_by_age(monkeypatch, replies):
+    monkeypatch.setitem(update_processor._SHED_AGE, PRIORITY_LOW, 0.01)
+
+    async def run():
+        processor = ChatOrderedUpdateProcessor()
+        handled = []
+
+        async def handler(text):
+            handled.append(text)
+            await asyncio.sleep(0.05)
+
+        tasks = []
+        for i, text in enumerate(("+1", "/help", "/help", "+2")):
+            update = make_update(i, -1, text)
+            tasks.append(asyncio.create_task(processor.process_update(update, handler(text))))
+            await asyncio.sleep(0)
+
+        await asyncio.gather(*tasks)
+        return handled, processor
+
+    handled, processor = asyncio.run(run())
+    # 排队超时的命令被丢弃，同一群组的 "系统繁忙" 在间隔内只回复一次
+    assert handled == ["+1", "+2"]
+    assert processor.shed[(PRIORITY_LOW, "age")] == 2
+    assert replies == [(-1, SHED_NOTICE_TEXT)]
@@ -0,0 +1,152 @@
+import os
+import logging
+from datetime import datetime, timedelta, timezone
+from functools import lru_cache
+from zoneinfo import ZoneInfo, ZoneInfoNotFoundError
+
+from storage import get_storage, StorageUnavailable
+
+
+# ================= CONFIG =================
+# history.timestamp 按 UTC 存储；报表按各群组时区划分日/月/年
+DEFAULT_TIMEZONE = os.getenv("DEFAULT_TIMEZONE", "UTC")
+
+# chat_id -> 时区名称
+_chat_timezones = {}
+
+# 启动时已批量载入 chat_settings，未命中的群组直接使用默认时区
+_preloaded = False
+
+
+# ================= CHAT TIMEZONE =================
+def is_valid_timezone(tz_name):
+    try:
+        ZoneInfo(tz_name)
+        return True
+    except (ZoneInfoNotFoundError, ValueError):
+        return False
+
+
+def chat_timezone(chat_id):
+    """
+    群组时区 (内存缓存，未命中时查询一次 chat_settings)
+    """
+    tz_name = _chat_timezones.get(chat_id)
+    if tz_name is not None:
+        return tz_name
+
+    tz_name = DEFAULT_TIMEZONE
+    if _preloaded:
+        return tz_name
+
+    try:
+        row = get_storage().chat_settings(chat_id)
+        if row and row[0]:
+            tz_name = row[0]
+    except StorageUnavailable:
+        # 暂时使用默认时区但不缓存，数据库恢复后重新查询
+        return tz_name
+    except Exception as e:
+        logging.error(f"❌ Load timezone failed: {e}")
+        return tz_name
+
+    _chat_timezones[chat_id] = tz_name
+    return tz_name
+
+
+def cached_chat_timezone(chat_id):
+    """
+    不访问数据库即可确定的群组时区；需要查询 chat_settings 时返回 None
+    """
+    tz_name = _chat_timezones.get(chat_id)
+    if tz_name is None and _preloaded:
+        return DEFAULT_TIMEZONE
+    return tz_name
+
+
+def set_chat_timezone(chat_id, tz_name):
+
+    try:
+        get_storage().set_chat_timezone(chat_id, tz_name)
+    except StorageUnavailable:
+        return False
+
+    _chat_timezones[chat_id] = tz_name
+    return True
+
+
+def set_report_time(chat_id, report_time):
+    """
+    保存每日报告时间 ("HH:MM")，None 表示关闭
+    """
+    try:
+        get_storage().set_report_time(chat_id, report_time)
+    except StorageUnavailable:
+        return False
+
+    return True
+
+
+def preload_chat_settings():
+    """
+    启动时一次性载入全部群组时区，返回已设置的每日报告 [(chat_id, report_time)]
+    """
+    global _preloaded
+
+    try:
+        rows = get_storage().load_chat_settings()
+    except StorageUnavailable:
+        return None
+    except Exception as e:
+        logging.error(f"❌ Preload chat settings failed: {e}")
+        return None
+
+    for chat_id, tz_name, _ in rows:
+        _chat_timezones[chat_id] = tz_name or DEFAULT_TIMEZONE
+    _preloaded = True
+
+    return [(chat_id, report_time) for chat_id, _, report_time in rows if report_time]
+
+
+# ================= PERIOD BOUNDARIES =================
+def next_month(year, month):
+    return (year + 1, 1) if month == 12 else (year, month + 1)
+
+
+def _to_utc(local, zone):
+    return local.replace(tzinfo=zone).astimezone(timezone.utc).replace(tzinfo=None)
+
+
+@lru_cache(maxsize=4096)
+def period_bounds(tz_name, period):
+    """
+    "YYYY-MM-DD" / "YYYY-MM" / "YYYY" -> (开始, 结束) UTC 时间 (左闭右开)
+    查询条件直接使用 timestamp 范围，可走 (chat_id, timestamp) 索引
+    """
+    zone = ZoneInfo(tz_name)
+    parts = [int(p) for p in period.split("-")]
+
+    if len(parts) == 3:
+        start = datetime(*parts)
+        end = start + timedelta(days=1)
+    elif len(parts) == 2:
+        start = datetime(parts[0], parts[1], 1)
+        end = datetime(*next_month(parts[0], parts[1]), 1)
+    else:
+        start = datetime(parts[0], 1, 1)
+        end = datetime(parts[0] + 1, 1, 1)
+
+    return _to_utc(start, zone), _to_utc(end, zone)
+
+
+def local_today(tz_name):
+    return datetime.now(ZoneInfo(tz_name)).strftime("%Y-%m-%d")
+
+
+def to_local(ts, tz_name):
+    """
+    数据库中的 UTC 时间 -> 群组本地时间 (naive)
+    """
+    if tz_name == "UTC":
+        return ts
+    return ts.replace(tzinfo=timezone.utc).astimezone(ZoneInfo(tz_name)).replace(tzinfo=None)
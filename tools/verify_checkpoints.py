@@ -0,0 +1,52 @@
+"""
+余额检查点校验：按 history 原始记录重新计算每月检查点，
+与 balance_checkpoints 对比并列出差异
+
+用法:
+    DATABASE_URL=postgresql://... python tools/verify_checkpoints.py [--fix] [chat_id]
+    STORAGE_BACKEND=sqlite SQLITE_PATH=ledger.db python tools/verify_checkpoints.py
+
+--fix 时用重新计算的结果覆盖有差异的群组
+"""
+import os
+import sys
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from storage import get_storage, StorageUnavailable
+
+
+def main():
+    args = sys.argv[1:]
+    fix = "--fix" in args
+    args = [a for a in args if a != "--fix"]
+    chat_id = int(args[0]) if args else None
+
+    storage = get_storage()
+
+    try:
+        drift = storage.checkpoint_drift(chat_id)
+    except StorageUnavailable:
+        raise SystemExit(f"❌ {storage.name} storage not available")
+
+    if not drift:
+        print("✅ 检查点与历史记录一致")
+        return
+
+    print("chat_id\tmonth\tstored (balance, income, expense, last_id)\texpected")
+    for drift_chat, month, stored, expected in drift:
+        print(f"{drift_chat}\t{month}\t{stored}\t{expected}")
+
+    chats = sorted(set(row[0] for row in drift))
+    print(f"\n❌ {len(drift)} 个检查点不一致，涉及 {len(chats)} 个群组")
+
+    if fix:
+        for drift_chat in chats:
+            storage.rebuild_checkpoints(drift_chat)
+        print("✅ 已按历史记录重建")
+    else:
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,321 @@
+import os
+import re
+import time
+import heapq
+import asyncio
+import logging
+import itertools
+from collections import Counter, OrderedDict
+
+from telegram import Update
+from telegram.ext import BaseUpdateProcessor
+
+from startup import startup_state
+
+
+# ================= CONFIG =================
+MAX_CONCURRENT_UPDATES = int(os.getenv("MAX_CONCURRENT_UPDATES", "64"))
+CHAT_LOCK_TABLE_SIZE = int(os.getenv("CHAT_LOCK_TABLE_SIZE", "10000"))
+
+# 等待处理 + 正在处理的更新上限；超过后只接收记账写入
+MAX_PENDING_UPDATES = int(os.getenv("MAX_PENDING_UPDATES", "1000"))
+
+# 排队超过这个时间的报表 / 其它请求直接丢弃 (用户多半已经重发或离开)
+SHED_AGE_REPORT = float(os.getenv("SHED_AGE_REPORT", "15"))
+SHED_AGE_LOW = float(os.getenv("SHED_AGE_LOW", "5"))
+
+# 丢弃命令时回复 "系统繁忙"，同一群组在这个间隔内最多回复一次
+SHED_NOTICE_INTERVAL = float(os.getenv("SHED_NOTICE_INTERVAL", "10"))
+SHED_NOTICE_TEXT = "⚠️ 系统繁忙，请稍后再试"
+
+
+# 基类信号量的名额 (见 ChatOrderedUpdateProcessor)
+_UNBOUNDED = 2 ** 31 - 1
+
+
+# ================= PRIORITY =================
+PRIORITY_WRITE = 0     # +N / -N 记账、/undo、清空确认
+PRIORITY_REPORT = 1    # /summary、/find、/balance 及其按钮，管理命令
+PRIORITY_LOW = 2       # /check、/help 等
+
+# 记账消息格式 (+N 备注 / -N 备注)，handle_msg 使用同一个表达式
+ENTRY_PATTERN = re.compile(r'^([+-])(\d+)\s*(.*)$')
+
+# 单笔金额上限 (history.amount 为 INTEGER)；超出的记账在入账/暂存前拒绝
+MAX_ENTRY_AMOUNT = 2147483647
+
+WRITE_COMMANDS = {"undo"}
+REPORT_COMMANDS = {"summary", "find", "balance"}
+# 修改设置 / 权限的管理命令：不与闲聊一起在半额时拒绝
+ADMIN_COMMANDS = {
+    "reset", "setreport", "stopreport", "timezone",
+    "adddays", "addassistant", "removeassistant",
+}
+WRITE_CALLBACKS = ("confirm_reset", "cancel_reset")
+REPORT_CALLBACKS = ("summary_", "find_page:")
+
+# 各优先级最长排队时间 (秒)；写入不在其中，永不丢弃
+_SHED_AGE = {PRIORITY_REPORT: SHED_AGE_REPORT, PRIORITY_LOW: SHED_AGE_LOW}
+
+
+def is_ledger_entry(update):
+    """
+    是否为 +N / -N 记账消息
+    """
+    if not isinstance(update, Update) or update.message is None or not update.message.text:
+        return False
+    return ENTRY_PATTERN.match(update.message.text.strip()) is not None
+
+
+def update_priority(update):
+
+    if not isinstance(update, Update):
+        return PRIORITY_LOW
+
+    if update.callback_query is not None:
+        data = update.callback_query.data or ""
+        if data.startswith(WRITE_CALLBACKS):
+            return PRIORITY_WRITE
+        if data.startswith(REPORT_CALLBACKS):
+            return PRIORITY_REPORT
+        return PRIORITY_LOW
+
+    message = update.message
+    if message is None or not message.text:
+        return PRIORITY_LOW
+
+    if not message.text.startswith("/"):
+        # 只有记账格式的文本才是写入，其它聊天消息与闲聊同级
+        return PRIORITY_WRITE if is_ledger_entry(update) else PRIORITY_LOW
+
+    command = message.text[1:].split(maxsplit=1)[0].split("@")[0].lower()
+    if command in WRITE_COMMANDS:
+        return PRIORITY_WRITE
+    if command in REPORT_COMMANDS or command in ADMIN_COMMANDS:
+        return PRIORITY_REPORT
+    return PRIORITY_LOW
+
+
+# ================= PRIORITY GATE =================
+class PriorityGate:
+    """
+    并发名额：名额用完时按优先级 (其次按到达顺序) 唤醒等待者
+    """
+
+    def __init__(self, capacity):
+        self.capacity = capacity
+        self.active = 0
+
+        # (优先级, 序号, future)
+        self._waiters = []
+        self._seq = itertools.count()
+
+    async def acquire(self, priority):
+        if self.active < self.capacity and not self._waiters:
+            self.active += 1
+            return
+
+        future = asyncio.get_running_loop().create_future()
+        heapq.heappush(self._waiters, (priority, next(self._seq), future))
+
+        try:
+            await future
+        except asyncio.CancelledError:
+            # 已经拿到名额后才被取消，需要交还
+            if future.done() and not future.cancelled():
+                self.release()
+            raise
+
+    def release(self):
+        # 名额直接转交给下一个等待者，已取消的等待者跳过
+        while self._waiters:
+            _, _, future = heapq.heappop(self._waiters)
+            if not future.done():
+                future.set_result(None)
+                return
+
+        self.active -= 1
+
+
+# ================= CHAT ORDERED PROCESSOR =================
+class ChatOrderedUpdateProcessor(BaseUpdateProcessor):
+    """
+    并发处理不同群组的更新，同一群组内严格按顺序执行
+    (balance_after 余额链依赖同群顺序)
+
+    过载保护：待处理更新超过 MAX_PENDING_UPDATES 时拒绝低优先级更新，
+    排队过久的报表 / 其它请求在轮到时丢弃，记账写入始终保留
+
+    process_update 是基类的 final 方法 (先占基类信号量再调用 do_process_update)，
+    排序与并发控制都在 do_process_update 中完成：基类信号量不设实际上限，
+    否则同一群组排队等锁的更新会占满名额，并发名额由 PriorityGate 在拿到群组锁之后分配
+    """
+
+    def __init__(
+        self,
+        max_concurrent_updates=MAX_CONCURRENT_UPDATES,
+        lock_table_size=CHAT_LOCK_TABLE_SIZE,
+        max_pending_updates=MAX_PENDING_UPDATES,
+    ):
+        super().__init__(_UNBOUNDED)
+        self.concurrency = max_concurrent_updates
+        self.lock_table_size = lock_table_size
+        self.max_pending_updates = max_pending_updates
+
+        # chat_id -> [asyncio.Lock, 正在使用/等待的数量, 尚未开始的记账消息数量]
+        self._locks = OrderedDict()
+
+        self._gate = PriorityGate(max_concurrent_updates)
+        self.pending = 0
+
+        # (优先级, 原因) -> 丢弃次数
+        self.shed = Counter()
+
+        # chat_id -> 最近一次回复 "系统繁忙" 的时间 (monotonic)
+        self._shed_notices = {}
+
+    def _acquire_slot(self, chat_id):
+        slot = self._locks.get(chat_id)
+
+        if slot is None:
+            slot = [asyncio.Lock(), 1, 0]
+            self._locks[chat_id] = slot
+            self._evict_idle()
+        else:
+            self._locks.move_to_end(chat_id)
+            slot[1] += 1
+
+        return slot
+
+    def _release_slot(self, chat_id, slot):
+        slot[1] -= 1
+        self._evict_idle()
+
+    def _evict_idle(self):
+        # 只清理没有人使用的锁，正在排队的群组永远保留
+        if len(self._locks) <= self.lock_table_size:
+            return
+
+        for chat_id in list(self._locks):
+            if len(self._locks) <= self.lock_table_size:
+                break
+            if self._locks[chat_id][1] == 0:
+                del self._locks[chat_id]
+
+    def pending_writes(self, chat_id):
+        """
+        该群组排在当前更新之后、尚未开始的记账消息数量 (不含 /undo 与清空确认)
+        """
+        slot = self._locks.get(chat_id)
+        return slot[2] if slot else 0
+
+    # ---------- 准入 ----------
+    def _admit(self, priority):
+        if priority == PRIORITY_WRITE:
+            return True
+        if priority == PRIORITY_REPORT:
+            return self.pending < self.max_pending_updates
+        return self.pending < self.max_pending_updates // 2
+
+    def _shed(self, priority, coroutine, reason):
+        # 协程尚未开始执行，关闭即可 (不会产生 "never awaited" 警告)
+        coroutine.close()
+        self.shed[(priority, reason)] += 1
+
+        total = sum(self.shed.values())
+        if total == 1 or total % 100 == 0:
+            logging.warning(
+                f"⚠️ Load shedding: pending={self.pending}, dropped "
+                + ", ".join(f"p{p}/{r}={n}" for (p, r), n in sorted(self.shed.items()))
+            )
+
+    async def _notify_shed(self, update):
+        """
+        告知用户请求被丢弃：按钮总是应答 (否则一直转圈)，
+        命令按群组限频回复；普通聊天消息不回复
+        """
+        if not isinstance(update, Update):
+            return
+
+        try:
+            if update.callback_query is not None:
+                await update.callback_query.answer(SHED_NOTICE_TEXT)
+                return
+
+            message = update.message
+            if message is None or not message.text or not message.text.startswith("/"):
+                return
+
+            now = time.monotonic()
+            last = self._shed_notices.get(message.chat_id)
+            if last is not None and now - last < SHED_NOTICE_INTERVAL:
+                return
+            if len(self._shed_notices) >= self.lock_table_size:
+                self._shed_notices.clear()
+            self._shed_notices[message.chat_id] = now
+
+            await message.reply_text(SHED_NOTICE_TEXT)
+        except Exception as e:
+            logging.warning(f"⚠️ Shed notice failed: {e}")
+
+    async def do_process_update(self, update, coroutine):
+        priority = update_priority(update)
+
+        if not self._admit(priority):
+            self._shed(priority, coroutine, "budget")
+            await self._notify_shed(update)
+            return
+
+        chat = update.effective_chat if isinstance(update, Update) else None
+        enqueued = time.monotonic()
+        self.pending += 1
+
+        # 没有 chat 的更新不需要排序
+        slot = self._acquire_slot(chat.id) if chat is not None else None
+        waiting_write = slot is not None and is_ledger_entry(update)
+        if waiting_write:
+            slot[2] += 1
+        shed = False
+
+        try:
+            # 先排群组锁再占并发名额，避免同一群组的积压占满全部名额
+            if slot is not None:
+                await slot[0].acquire()
+            try:
+                await self._gate.acquire(priority)
+                try:
+                    if waiting_write:
+                        slot[2] -= 1
+                        waiting_write = False
+
+                    max_age = _SHED_AGE.get(priority)
+                    if max_age is not None and time.monotonic() - enqueued > max_age:
+                        self._shed(priority, coroutine, "age")
+                        shed = True
+                    else:
+                        await coroutine
+                        startup_state.note_update()
+                finally:
+                    self._gate.release()
+            finally:
+                if slot is not None:
+                    slot[0].release()
+        finally:
+            if waiting_write:
+                slot[2] -= 1
+            self.pending -= 1
+            if slot is not None:
+                self._release_slot(chat.id, slot)
+
+        # 已交还群组锁与并发名额后再回复，不占用后面更新的处理
+        if shed:
+            await self._notify_shed(update)
+
+    async def initialize(self):
+        logging.info(
+            f"⚙️ Update processor: max_concurrent={self.concurrency}, "
+            f"lock_table={self.lock_table_size}, max_pending={self.max_pending_updates}"
+        )
+
+    async def shutdown(self):
+        self._locks.clear()